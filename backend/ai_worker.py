@@ -0,0 +1,24 @@
+"""
+独立的AI任务工作进程
+与API进程共享数据库,通过条件更新抢占 ai_jobs 表中的任务。
+
+用法:
+    AI_JOBS_INPROCESS=false uvicorn main:app   # API进程只负责入队
+    python ai_worker.py                        # 可启动多个工作进程
+"""
+import asyncio
+import database
+from services import ai_jobs
+
+
+async def run_worker():
+    ai_jobs.runner.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await ai_jobs.runner.stop()
+
+
+if __name__ == "__main__":
+    database.init_db()
+    asyncio.run(run_worker())
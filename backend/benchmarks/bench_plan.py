@@ -0,0 +1,192 @@
+"""
+学习计划端到端压测(使用本地模拟大模型,无需API Key与网络)
+
+在临时SQLite数据库中为每个请求准备一个独立用户(项目、任务、近7天时间记录、mock AI配置),
+然后通过HTTP并发请求计划接口,统计延迟分位数与吞吐量。
+
+用法(在 backend 目录下):
+    python benchmarks/bench_plan.py --mode enhanced --requests 200 --concurrency 20
+    python benchmarks/bench_plan.py --mode full --latency-ms 500 --tokens-per-second 80 --error-rate 0.1
+
+API服务与模拟大模型服务都在后台线程中由uvicorn监听本地端口,请求经过真实的HTTP与SSE传输。
+注意: AI调用期间请求会一直占用数据库连接,并发数超过连接池容量(默认 5 + 10)时会出现排队超时。
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end plan latency/throughput benchmark against the mock LLM")
+    parser.add_argument("--mode", choices=["rules", "enhanced", "full"], default="enhanced",
+                        help="rules: 规则引擎; enhanced: POST /api/ai/generate-plan; full: SSE完整分析")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="0 表示不限速")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0)
+    parser.add_argument("--tasks-per-user", type=int, default=10)
+    parser.add_argument("--api-port", type=int, default=9010, help="API服务监听的本地端口")
+    return parser.parse_args()
+
+
+def configure_environment():
+    """必须在导入应用模块之前设置: 独立的临时数据库,关闭响应缓存,放宽限流"""
+    workdir = tempfile.mkdtemp(prefix="bench_plan_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["AI_CACHE_ENABLED"] = "false"
+    os.environ["AI_RATE_LIMIT_RPM"] = "1000000"
+    os.environ["AI_RATE_LIMIT_TPM"] = "1000000000"
+    os.environ["AI_JOBS_INPROCESS"] = "false"
+    os.environ.setdefault("AI_BREAKER_FAILURE_THRESHOLD", "1000000")
+    return workdir
+
+
+def seed_users(count: int, tasks_per_user: int):
+    import models, schemas, crud, database
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    user_ids = []
+    try:
+        for i in range(count):
+            user = crud.create_user(db, f"bench{i}@mindbalance.ai")
+            projects = [
+                crud.create_project(db, schemas.ProjectCreate(name=name, color_hex="#000000", energy_percent=percent), user.id)
+                for name, percent in (("Python", 50), ("Database", 30), ("English", 20))
+            ]
+            for j in range(tasks_per_user):
+                project = projects[j % len(projects)]
+                crud.create_task(db, schemas.TaskCreate(
+                    title=f"Task {j}", project_id=project.id, priority=random.choice(["high", "medium", "low"])
+                ))
+            for day in range(7):
+                # 故意让第一个项目投入过多,使提示词包含精力偏差
+                for project, minutes in zip(projects, (120, 20, 10)):
+                    crud.create_time_log(db, schemas.TimeLogCreate(
+                        project_id=project.id, log_type="MANUAL",
+                        duration_seconds=minutes * 60, log_date=date.today() - timedelta(days=day)
+                    ), user.id)
+            crud.create_ai_config(db, user.id, schemas.AIConfigCreate(
+                provider="mock", api_key="bench", model="mock-chat"
+            ))
+            user_ids.append(str(user.id))
+    finally:
+        db.close()
+    return user_ids
+
+
+def start_server(app, port: int):
+    """在后台线程中用uvicorn运行ASGI应用,走真实的HTTP与流式传输"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_servers(args):
+    """配置模拟大模型服务并启动API服务"""
+    from fastapi import Request
+    import main
+    from services import mock_llm
+
+    mock_llm.settings.update({
+        "latency_ms": args.latency_ms,
+        "tokens_per_second": args.tokens_per_second,
+        "error_rate": args.error_rate,
+        "malformed_rate": args.malformed_rate,
+    })
+
+    # 用请求头选择用户,使每个请求落在不同用户上(避免命中计划缓存与合并请求)
+    def bench_user_id(request: Request):
+        return request.headers["X-Bench-User"]
+
+    main.app.dependency_overrides[main.get_current_user_id] = bench_user_id
+
+    # 未设置 MOCK_LLM_URL 时,mock 服务商会在本进程后台线程中自动启动模拟服务
+    return start_server(main.app, args.api_port)
+
+
+async def run_benchmark(args, user_ids):
+    import httpx
+
+    latencies = []
+    outcomes = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.api_port}", timeout=120, limits=limits) as client:
+        async def one(user_id: str):
+            async with semaphore:
+                started = time.perf_counter()
+                headers = {"X-Bench-User": user_id}
+                if args.mode == "full":
+                    response = await client.get(
+                        "/api/ai/generate-plan-stream", params={"use_ai": "full"}, headers=headers
+                    )
+                    body = response.text
+                    outcome = "ai" if "AI完整分析完成" in body else ("error" if "event: error" in body else "fallback")
+                else:
+                    response = await client.post(
+                        "/api/ai/generate-plan", json={"use_ai": args.mode == "enhanced"}, headers=headers
+                    )
+                    note = response.json().get("note", "") if response.status_code == 200 else ""
+                    outcome = "ai" if "AI" in note else ("rules" if args.mode == "rules" else "fallback")
+                if response.status_code != 200:
+                    outcome = f"http_{response.status_code}"
+                latencies.append(time.perf_counter() - started)
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(user_ids[i % len(user_ids)]) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, outcomes, elapsed
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    args = parse_args()
+    workdir = configure_environment()
+    print(f"[压测] 临时数据库目录: {workdir}")
+
+    seed_started = time.perf_counter()
+    user_ids = seed_users(args.requests, args.tasks_per_user)
+    print(f"[压测] 已准备 {len(user_ids)} 个用户,耗时 {time.perf_counter() - seed_started:.1f}秒")
+
+    server = start_servers(args)
+    try:
+        latencies, outcomes, elapsed = asyncio.run(run_benchmark(args, user_ids))
+    finally:
+        server.should_exit = True
+
+    print(f"\nmode={args.mode} requests={args.requests} concurrency={args.concurrency} "
+          f"latency_ms={args.latency_ms} tokens/s={args.tokens_per_second or 'unlimited'} "
+          f"error_rate={args.error_rate} malformed_rate={args.malformed_rate}")
+    print(f"throughput: {args.requests / elapsed:.1f} req/s (wall {elapsed:.2f}s)")
+    print("latency: " + "  ".join(
+        f"p{p}={percentile(latencies, p) * 1000:.0f}ms" for p in (50, 90, 95, 99)
+    ) + f"  max={max(latencies) * 1000:.0f}ms")
+    print("outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+
+
+if __name__ == "__main__":
+    main()
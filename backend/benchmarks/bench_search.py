@@ -0,0 +1,115 @@
+"""
+全文检索压测
+
+在临时SQLite数据库中批量写入大量任务(随机中英文标题与描述,分属多个用户),
+建立 FTS5 索引后测量 services.search.search 的延迟分位数,并对比 LIKE 全表扫描。
+
+用法(在 backend 目录下):
+    python benchmarks/bench_search.py --tasks 1000000 --users 1000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ["python", "database", "design", "english", "vocabulary", "reading", "algorithm", "review",
+         "practice", "lecture", "homework", "exam", "project", "notes", "chapter", "exercise",
+         "学习", "复习", "单词", "阅读", "算法", "笔记", "练习", "考试", "项目", "章节", "听力", "写作"]
+
+
+def configure_environment():
+    """必须在导入应用模块之前设置"""
+    workdir = tempfile.mkdtemp(prefix="bench_search_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    return workdir
+
+
+def seed(task_count: int, user_count: int, projects_per_user: int = 5, seed: int = 42):
+    """直接批量插入(绕过触发器),最后一次性建立索引"""
+    import models, database
+    from services import search
+
+    rng = random.Random(seed)
+    models.Base.metadata.create_all(bind=database.engine)
+    users = [models.generate_uuid() for _ in range(user_count)]
+    projects = [(models.generate_uuid(), u) for u in users for _ in range(projects_per_user)]
+    tasks_table, projects_table = models.Task.__table__, models.Project.__table__
+
+    def sentence(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    with database.engine.begin() as conn:
+        conn.execute(projects_table.insert(), [
+            {"id": pid, "user_id": uid, "name": sentence(2)} for pid, uid in projects
+        ])
+        for start in range(0, task_count, 20_000):
+            conn.execute(tasks_table.insert(), [
+                {"id": models.generate_uuid(), "project_id": rng.choice(projects)[0],
+                 "title": sentence(4), "description": sentence(12), "status": "todo"}
+                for _ in range(min(20_000, task_count - start))
+            ])
+
+    started = time.perf_counter()
+    search.ensure_search_index()
+    print(f"index built in {time.perf_counter() - started:.1f}s")
+    database.analyze_tables()
+    return users
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FTS5 search latency benchmark")
+    parser.add_argument("--tasks", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    configure_environment()
+    users = seed(args.tasks, args.users)
+
+    import database, models
+    from services import search
+
+    rng = random.Random(7)
+    db = database.SessionLocal()
+    try:
+        timings = []
+        hits = 0
+        for _ in range(args.queries):
+            words = rng.sample(WORDS, rng.choice((1, 2)))
+            q = " ".join(w[:max(2, len(w) - 2)] if w.isascii() else w for w in words)
+            started = time.perf_counter()
+            result = search.search(db, rng.choice(users), q, limit=20)
+            timings.append(time.perf_counter() - started)
+            hits += len(result["items"])
+
+        # 对照: 同一用户的 LIKE 扫描(先按项目过滤再匹配标题/描述)
+        like_timings = []
+        for _ in range(min(args.queries, 50)):
+            user_id = rng.choice(users)
+            word = rng.choice(WORDS)
+            started = time.perf_counter()
+            db.query(models.Task).join(models.Project, models.Project.id == models.Task.project_id).filter(
+                models.Project.user_id == user_id,
+                models.Task.title.like(f"%{word}%") | models.Task.description.like(f"%{word}%")
+            ).limit(20).all()
+            like_timings.append(time.perf_counter() - started)
+    finally:
+        db.close()
+
+    print(f"tasks: {args.tasks:,}, users: {args.users}, queries: {args.queries}, avg hits/page: {hits / args.queries:.1f}")
+    print(f"fts search: p50 {percentile(timings, 0.5) * 1000:.1f}ms, p95 {percentile(timings, 0.95) * 1000:.1f}ms, "
+          f"max {max(timings) * 1000:.1f}ms")
+    print(f"like scan:  p50 {percentile(like_timings, 0.5) * 1000:.1f}ms, p95 {percentile(like_timings, 0.95) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
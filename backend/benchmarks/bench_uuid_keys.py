@@ -0,0 +1,143 @@
+"""
+UUID 主键存储格式对比
+
+在两个临时SQLite数据库中写入同样的 time_logs 形状的数据: 一个用文本UUID(String,36字节),
+一个用 database.GUID(16字节二进制),比较数据库文件大小、索引大小与按主键/按用户查找的耗时。
+查找经过 SQLAlchemy 的类型转换,与应用中的实际开销一致。
+
+用法(在 backend 目录下):
+    python benchmarks/bench_uuid_keys.py --rows 500000 --users 200
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, Column, Date, Index, Integer, MetaData, String, Table
+
+from database import GUID
+from models import generate_uuid
+
+
+def make_table(id_type) -> Table:
+    metadata = MetaData()
+    return Table(
+        "time_logs", metadata,
+        Column("id", id_type, primary_key=True),
+        Column("task_id", id_type),
+        Column("project_id", id_type),
+        Column("user_id", id_type),
+        Column("duration_seconds", Integer),
+        Column("log_date", Date),
+        Index("idx_time_logs_user_date", "user_id", "log_date"),
+    )
+
+
+def make_rows(count: int, users: int, seed: int = 42):
+    rng = random.Random(seed)
+    user_ids = [generate_uuid() for _ in range(users)]
+    projects = {u: [generate_uuid() for _ in range(5)] for u in user_ids}
+    tasks = {p: [generate_uuid() for _ in range(10)] for ps in projects.values() for p in ps}
+    start = date.today() - timedelta(days=365)
+    rows = []
+    for _ in range(count):
+        user_id = rng.choice(user_ids)
+        project_id = rng.choice(projects[user_id])
+        rows.append({
+            "id": generate_uuid(),
+            "task_id": rng.choice(tasks[project_id]),
+            "project_id": project_id,
+            "user_id": user_id,
+            "duration_seconds": rng.randint(300, 7200),
+            "log_date": start + timedelta(days=rng.randint(0, 364)),
+        })
+    return rows, user_ids
+
+
+def run(label: str, id_type, rows, user_ids, lookups: int, workdir: str):
+    path = os.path.join(workdir, f"{label}.db")
+    engine = create_engine(f"sqlite:///{path}")
+    table = make_table(id_type)
+    table.metadata.create_all(engine)
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for i in range(0, len(rows), 10_000):
+            conn.execute(table.insert(), rows[i:i + 10_000])
+    insert_seconds = time.perf_counter() - started
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+        index_bytes = conn.exec_driver_sql(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name != 'time_logs'"
+        ).scalar() if _has_dbstat(conn) else None
+
+        rng = random.Random(7)
+        ids = [rng.choice(rows)["id"] for _ in range(lookups)]
+        started = time.perf_counter()
+        for row_id in ids:
+            conn.execute(select(table.c.duration_seconds).where(table.c.id == row_id)).scalar()
+        pk_seconds = time.perf_counter() - started
+
+        since = date.today() - timedelta(days=30)
+        users = [rng.choice(user_ids) for _ in range(max(lookups // 10, 1))]
+        started = time.perf_counter()
+        for user_id in users:
+            conn.execute(select(table.c.project_id, table.c.duration_seconds).where(
+                table.c.user_id == user_id, table.c.log_date >= since
+            )).all()
+        range_seconds = time.perf_counter() - started
+    engine.dispose()
+
+    return {
+        "label": label,
+        "file_bytes": os.path.getsize(path),
+        "index_bytes": index_bytes,
+        "insert_seconds": insert_seconds,
+        "pk_us": pk_seconds / len(ids) * 1e6,
+        "range_us": range_seconds / len(users) * 1e6,
+    }
+
+
+def _has_dbstat(conn) -> bool:
+    try:
+        conn.exec_driver_sql("SELECT 1 FROM dbstat LIMIT 1")
+        return True
+    except Exception:
+        return False
+
+
+def _mb(value):
+    return f"{value / 1024 / 1024:.1f}MB" if value is not None else "n/a"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text vs binary UUID key benchmark (SQLite)")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    rows, user_ids = make_rows(args.rows, args.users)
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [
+            run("text", String, rows, user_ids, args.lookups, workdir),
+            run("binary", GUID, rows, user_ids, args.lookups, workdir),
+        ]
+
+    print(f"rows: {args.rows:,}, users: {args.users}, lookups: {args.lookups:,}")
+    for r in results:
+        print(f"{r['label']:>6}: file {_mb(r['file_bytes'])}, indexes {_mb(r['index_bytes'])}, "
+              f"insert {r['insert_seconds']:.1f}s, pk lookup {r['pk_us']:.0f}us, "
+              f"user 30-day range {r['range_us']:.0f}us")
+    text, binary = results
+    print(f"binary/text file size: {binary['file_bytes'] / text['file_bytes']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
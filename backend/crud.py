@@ -1,7 +1,9 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, cast, String
-import models, schemas
+from sqlalchemy import func, case, select, union_all
+import models, schemas, database
+from services import analytics_cache, reviews, realtime
 from datetime import datetime, date, timezone
+import json
 
 # --- User ---
 def get_user_by_email(db: Session, email: str):
@@ -14,48 +16,154 @@ def create_user(db: Session, email: str):
     db.refresh(user)
     return user
 
+# --- Data Version ---
+def get_data_version(db: Session, user_id: str) -> int:
+    """获取用户当前的数据版本号(无记录时为0)"""
+    version = db.query(models.UserDataVersion.version).filter(
+        models.UserDataVersion.user_id == str(user_id)
+    ).scalar()
+    return version or 0
+
+def bump_data_version(db: Session, user_id: str):
+    """递增用户数据版本号
+
+    只修改会话中的数据,由调用方的 commit 一并提交,保证版本号与数据变更原子生效。
+    """
+    if not user_id:
+        return
+    # 之后短时间内该用户的只读请求留在主库,避免读到副本上的旧数据
+    database.note_write(user_id)
+    updated = db.query(models.UserDataVersion).filter(
+        models.UserDataVersion.user_id == str(user_id)
+    ).update({models.UserDataVersion.version: models.UserDataVersion.version + 1})
+    if not updated:
+        db.add(models.UserDataVersion(user_id=str(user_id), version=1))
+
+# --- Change Log ---
+def record_change(db: Session, user_id: str, entity: str, entity_id: str, op: str = 'upsert'):
+    """写入一条变更日志(outbox)
+
+    与 bump_data_version 一样只修改会话,由调用方的 commit 与数据变更一并提交。
+    """
+    if user_id and entity_id:
+        db.add(models.ChangeLog(user_id=str(user_id), entity=entity, entity_id=str(entity_id), op=op))
+
+def _record_task_change(db: Session, user_id: str, task: models.Task, op: str = 'upsert'):
+    """任务变更同时记录其项目(项目的任务数、完成数与累计时长随之变化)"""
+    record_change(db, user_id, 'task', task.id, op)
+    record_change(db, user_id, 'project', task.project_id)
+
+def _record_log_change(db: Session, user_id: str, log: models.TimeLog):
+    """时间记录改变了任务与项目的累计时长"""
+    record_change(db, user_id, 'task', log.task_id)
+    record_change(db, user_id, 'project', log.project_id)
+
+def _project_owner(db: Session, project_id: str):
+    """根据项目ID查询所属用户ID"""
+    return db.query(models.Project.user_id).filter(models.Project.id == project_id).scalar()
+
+# --- Project Counters ---
+def _bump_project_counters(db: Session, project_id: str, **deltas):
+    """原子增减项目计数列(UPDATE ... SET 列 = 列 + 增量),由调用方的 commit 一并提交"""
+    values = {
+        getattr(models.Project, name): getattr(models.Project, name) + delta
+        for name, delta in deltas.items() if delta
+    }
+    if project_id and values:
+        db.query(models.Project).filter(models.Project.id == str(project_id)).update(values, synchronize_session=False)
+
+def _logged_seconds(db: Session, task_ids) -> dict:
+    """任务的累计时长(热表 + 归档汇总),所有按任务返回的 total_duration 都由此计算"""
+    totals = {}
+    for model in (models.TimeLog, models.TimeLogDaily):
+        for task_id, seconds in db.query(model.task_id, func.sum(model.duration_seconds)).filter(
+            model.task_id.in_(list(task_ids))
+        ).group_by(model.task_id):
+            totals[task_id] = totals.get(task_id, 0) + (seconds or 0)
+    return totals
+
+def _populate_project(project: models.Project) -> models.Project:
+    """把计数列映射为响应字段"""
+    project.energy_percent = project.current_target_percentage or 0
+    project.total_tasks = project.task_count or 0
+    project.completed_tasks = project.done_count or 0
+    project.total_duration = project.total_seconds or 0
+    project.is_completed = (project.status == 'completed')
+    return project
+
+def reconcile_project_counters(db: Session, user_id: str = None) -> int:
+    """按预算、任务与时间记录明细重新计算项目计数列,修正不一致的项目并返回修正数量"""
+    projects = db.query(models.Project)
+    if user_id:
+        projects = projects.filter(models.Project.user_id == str(user_id))
+    projects = projects.all()
+    if not projects:
+        return 0
+    scope = [p.id for p in projects] if user_id else None
+
+    def grouped(*columns, key):
+        query = db.query(key, *columns)
+        if scope is not None:
+            query = query.filter(key.in_(scope))
+        return {row[0]: row[1:] for row in query.group_by(key)}
+
+    budgets = dict(db.query(models.ProjectBudget.project_id, models.ProjectBudget.target_percentage).filter(
+        models.ProjectBudget.valid_to == None
+    ).order_by(models.ProjectBudget.id).all())
+    tasks = grouped(
+        func.count(models.Task.id), func.sum(case((models.Task.status == 'done', 1), else_=0)),
+        key=models.Task.project_id
+    )
+    hot = grouped(func.sum(models.TimeLog.duration_seconds), key=models.TimeLog.project_id)
+    archived = grouped(func.sum(models.TimeLogDaily.duration_seconds), key=models.TimeLogDaily.project_id)
+
+    fixed_users = set()
+    fixed = 0
+    for p in projects:
+        task_count, done_count = tasks.get(p.id, (0, 0))
+        expected = {
+            'current_target_percentage': budgets.get(p.id),
+            'task_count': task_count or 0,
+            'done_count': done_count or 0,
+            'total_seconds': (hot.get(p.id, (0,))[0] or 0) + (archived.get(p.id, (0,))[0] or 0)
+        }
+        if any(getattr(p, name) != value for name, value in expected.items()):
+            for name, value in expected.items():
+                setattr(p, name, value)
+            fixed_users.add(p.user_id)
+            record_change(db, p.user_id, 'project', p.id)
+            fixed += 1
+
+    for owner in fixed_users:
+        bump_data_version(db, owner)
+    db.commit()
+    return fixed
+
+def backfill_task_owners(db: Session) -> int:
+    """为缺少 user_id 的任务填入所属项目的用户(tasks.user_id 列刚添加时),返回更新的行数"""
+    owner = db.query(models.Project.user_id).filter(
+        models.Project.id == models.Task.project_id
+    ).scalar_subquery()
+    updated = db.query(models.Task).filter(models.Task.user_id.is_(None)).update(
+        {models.Task.user_id: owner}, synchronize_session=False
+    )
+    db.commit()
+    return updated
+
 # --- Projects ---
 def get_projects(db: Session, user_id: str):
     projects = db.query(models.Project).filter(models.Project.user_id == user_id).all()
-    results = []
-    for p in projects:
-        # Get active budget
-        budget = db.query(models.ProjectBudget).filter(
-            models.ProjectBudget.project_id == p.id,
-            models.ProjectBudget.valid_to == None
-        ).first()
-        energy_percent = budget.target_percentage if budget else 0
-        
-        # Get task stats
-        task_count = db.query(func.count(models.Task.id)).filter(models.Task.project_id == p.id).scalar()
-        completed_count = db.query(func.count(models.Task.id)).filter(
-            models.Task.project_id == p.id, 
-            models.Task.status == 'done'
-        ).scalar()
-        
-        # Get duration stats
-        duration = db.query(func.sum(models.TimeLog.duration_seconds)).filter(
-            models.TimeLog.project_id == p.id
-        ).scalar()
-        
-        # Create a transient object or dictionary to match Schema
-        # We can attach attributes to the ORM object if we are careful, 
-        # or convert to dict. Pydantic from_attributes handles objects with attributes.
-        p.energy_percent = energy_percent
-        p.total_tasks = task_count or 0
-        p.completed_tasks = completed_count or 0
-        p.total_duration = duration or 0
-        p.is_completed = (p.status == 'completed')
-        
-        results.append(p)
-    return results
+    return [_populate_project(p) for p in projects]
 
 def create_project(db: Session, project: schemas.ProjectCreate, user_id: str):
     # Extract energy_percent to handle separately
     project_data = project.model_dump(exclude={'energy_percent'})
     
-    db_project = models.Project(**project_data, user_id=user_id)
+    db_project = models.Project(**project_data, user_id=user_id, current_target_percentage=project.energy_percent)
     db.add(db_project)
+    db.flush()
+    record_change(db, user_id, 'project', db_project.id)
+    bump_data_version(db, user_id)
     db.commit()
     db.refresh(db_project)
     
@@ -66,16 +174,10 @@ def create_project(db: Session, project: schemas.ProjectCreate, user_id: str):
             target_percentage=project.energy_percent
         )
         db.add(budget)
+        bump_data_version(db, user_id)
         db.commit()
         
-    # Set default attributes for response
-    db_project.energy_percent = project.energy_percent or 0
-    db_project.total_tasks = 0
-    db_project.completed_tasks = 0
-    db_project.total_duration = 0
-    db_project.is_completed = False
-    
-    return db_project
+    return _populate_project(db_project)
 
 def update_project(db: Session, project_id: str, updates: schemas.ProjectUpdate):
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
@@ -118,50 +220,29 @@ def update_project(db: Session, project_id: str, updates: schemas.ProjectUpdate)
                 target_percentage=energy_percent
             )
             db.add(new_budget)
+        project.current_target_percentage = energy_percent
 
+    record_change(db, project.user_id, 'project', project.id)
+    bump_data_version(db, project.user_id)
     db.commit()
     db.refresh(project)
-    
-    # Prepare response (populate transient fields)
-    # We can reuse get_projects logic or just query specifically for this one
-    # Re-fetching is safer to ensure all counts/stats are correct
-    # But for efficiency, we might just set what we changed. 
-    # Let's simple-fetch stats again.
-    
-    budget = db.query(models.ProjectBudget).filter(
-        models.ProjectBudget.project_id == project.id,
-        models.ProjectBudget.valid_to == None
-    ).first()
-    project.energy_percent = budget.target_percentage if budget else 0
-    
-    project.total_tasks = db.query(func.count(models.Task.id)).filter(models.Task.project_id == project.id).scalar() or 0
-    project.completed_tasks = db.query(func.count(models.Task.id)).filter(
-            models.Task.project_id == project.id, 
-            models.Task.status == 'done'
-        ).scalar() or 0
-    project.total_duration = db.query(func.sum(models.TimeLog.duration_seconds)).filter(
-            models.TimeLog.project_id == project.id
-        ).scalar() or 0
-    project.is_completed = (project.status == 'completed')
-    
-    return project
+
+    return _populate_project(project)
 
 def delete_project(db: Session, project_id: str):
+    """软删除项目: 只标记项目及其任务,时间记录与预算由后台清理任务分批删除"""
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
     if project:
-        # SQLAlchemy cascade might handle this if configured, 
-        # but let's be explicit if needed or rely on cascade. 
-        # Assuming cascade is NOT configured in models (checked models.py, it's not explicit 'cascade="all, delete"'), 
-        # we might need to delete related items or rely on FK constraints failing.
-        # Let's check models.py again. relationships don't have cascade.
-        # So we should delete related data or update models. 
-        # For simplicity, let's delete tasks and logs first.
-        
-        db.query(models.TimeLog).filter(models.TimeLog.project_id == project_id).delete()
-        db.query(models.Task).filter(models.Task.project_id == project_id).delete()
-        db.query(models.ProjectBudget).filter(models.ProjectBudget.project_id == project_id).delete()
-        
-        db.delete(project)
+        now = datetime.now(timezone.utc)
+        task_ids = [t for (t,) in db.query(models.Task.id).filter(models.Task.project_id == project_id)]
+        project.deleted_at = now
+        db.query(models.Task).filter(models.Task.project_id == project_id).update(
+            {models.Task.deleted_at: now}, synchronize_session=False
+        )
+        for task_id in task_ids:
+            record_change(db, project.user_id, 'task', task_id, 'delete')
+        record_change(db, project.user_id, 'project', project.id, 'delete')
+        bump_data_version(db, project.user_id)
         db.commit()
         return True
     return False
@@ -170,6 +251,8 @@ def complete_project(db: Session, project_id: str):
     project = db.query(models.Project).filter(models.Project.id == project_id).first()
     if project:
         project.status = 'completed'
+        record_change(db, project.user_id, 'project', project.id)
+        bump_data_version(db, project.user_id)
         db.commit()
         return True
     return False
@@ -184,24 +267,7 @@ def get_project(db: Session, project_id: str, user_id: str):
     if not project:
         return None
 
-    # 填充额外信息
-    budget = db.query(models.ProjectBudget).filter(
-        models.ProjectBudget.project_id == project.id,
-        models.ProjectBudget.valid_to == None
-    ).first()
-    project.energy_percent = budget.target_percentage if budget else 0
-
-    project.total_tasks = db.query(func.count(models.Task.id)).filter(models.Task.project_id == project.id).scalar() or 0
-    project.completed_tasks = db.query(func.count(models.Task.id)).filter(
-            models.Task.project_id == project.id,
-            models.Task.status == 'done'
-        ).scalar() or 0
-    project.total_duration = db.query(func.sum(models.TimeLog.duration_seconds)).filter(
-            models.TimeLog.project_id == project.id
-        ).scalar() or 0
-    project.is_completed = (project.status == 'completed')
-
-    return project
+    return _populate_project(project)
 
 def get_task(db: Session, task_id: str):
     """获取单个任务详情"""
@@ -212,7 +278,7 @@ def get_task(db: Session, task_id: str):
     # 填充额外信息
     project = db.query(models.Project).filter(models.Project.id == task.project_id).first()
     task.project_name = project.name if project else ""
-    task.total_duration = db.query(func.sum(models.TimeLog.duration_seconds)).filter(models.TimeLog.task_id == task.id).scalar() or 0
+    task.total_duration = _logged_seconds(db, [task.id]).get(task.id, 0)
 
     # 映射状态
     status_map = {
@@ -232,6 +298,8 @@ def get_tasks(db: Session, project_id: str = None):
         query = query.filter(models.Task.project_id == project_id)
 
     tasks = query.all()
+    # 一次分组查询取回累计时长(含已归档的记录)
+    durations = _logged_seconds(db, [t.id for t in tasks]) if tasks else {}
     results = []
     # 状态映射: todo -> pending, in_progress -> in_progress, done -> completed
     status_map = {
@@ -245,9 +313,7 @@ def get_tasks(db: Session, project_id: str = None):
         project = db.query(models.Project).filter(models.Project.id == t.project_id).first()
         t.project_name = project.name if project else "Unknown"
 
-        # Calculate duration
-        total = db.query(func.sum(models.TimeLog.duration_seconds)).filter(models.TimeLog.task_id == t.id).scalar()
-        t.total_duration = total or 0
+        t.total_duration = durations.get(t.id, 0)
 
         # 映射状态到前端期望的格式
         original_status = t.status
@@ -256,9 +322,99 @@ def get_tasks(db: Session, project_id: str = None):
         results.append(t)
     return results
 
+# --- Sparse Fieldsets ---
+# 列表接口的 fields= 参数: 只查询请求的列,只计算请求的聚合字段
+PROJECT_COLUMNS = ('id', 'user_id', 'name', 'color_hex', 'icon', 'description', 'status')
+PROJECT_AGGREGATES = ('energy_percent', 'total_tasks', 'completed_tasks', 'total_duration', 'is_completed')
+# 聚合字段与维护它们的计数列
+PROJECT_COUNTERS = {
+    'energy_percent': models.Project.current_target_percentage,
+    'total_tasks': models.Project.task_count,
+    'completed_tasks': models.Project.done_count,
+    'total_duration': models.Project.total_seconds
+}
+TASK_COLUMNS = ('id', 'project_id', 'title', 'description', 'status', 'priority', 'created_at',
+                'due_date', 'next_review_at', 'review_stage')
+TASK_AGGREGATES = ('project_name', 'total_duration')
+
+TASK_STATUS_MAP = {
+    'todo': 'pending',
+    'in_progress': 'in_progress',
+    'done': 'completed'
+}
+
+def parse_fields(raw: str, allowed) -> list:
+    """解析逗号分隔的字段列表(id 总是返回),包含未知字段时抛出 ValueError"""
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return ['id'] + [f for f in dict.fromkeys(fields) if f != 'id']
+
+def get_projects_sparse(db: Session, user_id: str, fields: list):
+    """按字段投影的项目列表: 聚合字段直接读取计数列,单表查询"""
+    columns = [getattr(models.Project, f) for f in PROJECT_COLUMNS if f in fields]
+    columns += [
+        func.coalesce(PROJECT_COUNTERS[f], 0).label(f) for f in PROJECT_AGGREGATES
+        if f in fields and f in PROJECT_COUNTERS
+    ]
+    if 'is_completed' in fields and 'status' not in fields:
+        columns.append(models.Project.status)
+    query = db.query(*columns).filter(models.Project.user_id == user_id)
+
+    results = []
+    for row in query.all():
+        item = dict(row._mapping)
+        if 'is_completed' in fields:
+            item['is_completed'] = (item['status'] == 'completed')
+        results.append({f: item[f] for f in fields})
+    return results
+
+def get_tasks_sparse(db: Session, fields: list, project_id: str = None):
+    """按字段投影的任务列表: 项目名用连接查询,时长用分组子查询,不再逐条查询"""
+    columns = [getattr(models.Task, f) for f in TASK_COLUMNS if f in fields]
+    query = db.query(*columns)
+    if project_id:
+        query = query.filter(models.Task.project_id == project_id)
+
+    if 'project_name' in fields:
+        query = query.add_columns(
+            func.coalesce(models.Project.name, 'Unknown').label('project_name')
+        ).outerjoin(models.Project, models.Project.id == models.Task.project_id)
+
+    if 'total_duration' in fields:
+        # 热表与归档汇总合并后按任务分组
+        parts = []
+        for model in (models.TimeLog, models.TimeLogDaily):
+            part = select(model.task_id, model.duration_seconds)
+            if project_id:
+                part = part.where(model.project_id == project_id)
+            parts.append(part)
+        logged = union_all(*parts).subquery()
+        durations = db.query(
+            logged.c.task_id,
+            func.sum(logged.c.duration_seconds).label('total_duration')
+        ).group_by(logged.c.task_id).subquery()
+        query = query.add_columns(
+            func.coalesce(durations.c.total_duration, 0).label('total_duration')
+        ).outerjoin(durations, durations.c.task_id == models.Task.id)
+
+    results = []
+    for row in query.all():
+        item = dict(row._mapping)
+        if 'status' in item:
+            item['status'] = TASK_STATUS_MAP.get(item['status'], item['status'])
+        results.append(item)
+    return results
+
 def create_task(db: Session, task: schemas.TaskCreate):
     db_task = models.Task(**task.model_dump())
+    db_task.user_id = _project_owner(db, db_task.project_id)
     db.add(db_task)
+    db.flush()
+    _record_task_change(db, db_task.user_id, db_task)
+    _bump_project_counters(db, db_task.project_id, task_count=1)
+    bump_data_version(db, db_task.user_id)
     db.commit()
     db.refresh(db_task)
 
@@ -283,17 +439,22 @@ def update_task(db: Session, task_id: str, updates: schemas.TaskUpdate):
         return None
 
     update_data = updates.model_dump(exclude_unset=True)
+    was_done = task.status == 'done'
     for key, value in update_data.items():
         setattr(task, key, value)
+    _bump_project_counters(db, task.project_id, done_count=(task.status == 'done') - was_done)
+    reviews.on_status_change(task, was_done)
 
+    owner = _project_owner(db, task.project_id)
+    _record_task_change(db, owner, task)
+    bump_data_version(db, owner)
     db.commit()
     db.refresh(task)
 
     # Re-populate computed fields for response
     project = db.query(models.Project).filter(models.Project.id == task.project_id).first()
     task.project_name = project.name if project else ""
-    total = db.query(func.sum(models.TimeLog.duration_seconds)).filter(models.TimeLog.task_id == task.id).scalar()
-    task.total_duration = total or 0
+    task.total_duration = _logged_seconds(db, [task.id]).get(task.id, 0)
 
     # 映射状态到前端期望的格式
     status_map = {
@@ -306,13 +467,179 @@ def update_task(db: Session, task_id: str, updates: schemas.TaskUpdate):
     return task
 
 def delete_task(db: Session, task_id: str):
+    """软删除任务: 其时间记录立即不再参与统计,由后台清理任务分批删除"""
     task = db.query(models.Task).filter(models.Task.id == task_id).first()
     if task:
-        db.delete(task)
+        seconds = _logged_seconds(db, [task.id]).get(task.id, 0)
+        task.deleted_at = datetime.now(timezone.utc)
+        _bump_project_counters(
+            db, task.project_id, task_count=-1, done_count=-(task.status == 'done'), total_seconds=-seconds
+        )
+        owner = _project_owner(db, task.project_id)
+        _record_task_change(db, owner, task, 'delete')
+        bump_data_version(db, owner)
         db.commit()
         return True
     return False
 
+# --- Task Batch ---
+# 前端状态与数据库状态的对应关系(批量 status 操作两种写法都接受)
+TASK_STATUS_FROM_CLIENT = {v: k for k, v in TASK_STATUS_MAP.items()}
+
+def _task_payload(task: models.Task, project_name: str, total_duration: int) -> dict:
+    return {
+        'id': task.id,
+        'project_id': task.project_id,
+        'project_name': project_name,
+        'title': task.title,
+        'description': task.description,
+        'priority': task.priority,
+        'status': TASK_STATUS_MAP.get(task.status, task.status),
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'due_date': task.due_date.isoformat() if task.due_date else None,
+        'next_review_at': task.next_review_at.isoformat() if task.next_review_at else None,
+        'total_duration': total_duration
+    }
+
+def apply_task_batch(db: Session, user_id: str, operations: list, atomic: bool = False):
+    """在一个事务中执行一批任务操作
+
+    任务与项目各用一次查询预加载,修改只在会话中进行,最后由一次 flush 批量写入并提交;
+    数据版本只递增一次。每个操作单独报告结果,成功的操作连同结果按操作ID记录,
+    重复提交同一操作ID时直接返回记录的结果。
+
+    Returns:
+        (是否已提交, 每个操作的结果列表)
+    """
+    op_ids = [op.op_id for op in operations]
+    replayed = {
+        row.op_id: json.loads(row.result)
+        for row in db.query(models.TaskBatchOperation).filter(
+            models.TaskBatchOperation.user_id == str(user_id),
+            models.TaskBatchOperation.op_id.in_(op_ids)
+        )
+    }
+
+    projects = dict(db.query(models.Project.id, models.Project.name).filter(models.Project.user_id == user_id).all())
+    task_ids = {op.task_id for op in operations if op.task_id}
+    tasks = {
+        t.id: t for t in db.query(models.Task).filter(
+            models.Task.id.in_(task_ids),
+            models.Task.project_id.in_(list(projects))
+        )
+    } if task_ids else {}
+
+    results = []
+    touched = {}  # op_id -> 需要在结果中返回的任务
+    changed = {}  # 任务ID -> 变更日志操作(同一批中多次修改只记录最后一次)
+    deleted = []  # (项目ID, 任务ID) -> 提交前扣除其累计时长
+    counters = {}  # 项目ID -> 计数列增量
+    seen = set()
+
+    def count(project_id, **deltas):
+        for name, delta in deltas.items():
+            counters.setdefault(project_id, {})[name] = counters.get(project_id, {}).get(name, 0) + delta
+
+    for op in operations:
+        if op.op_id in replayed:
+            results.append({**replayed[op.op_id], 'op_id': op.op_id, 'replayed': True})
+            continue
+        if op.op_id in seen:
+            results.append({'op_id': op.op_id, 'ok': False, 'error': 'Duplicate op_id in batch'})
+            continue
+        seen.add(op.op_id)
+
+        try:
+            if op.op == 'create':
+                data = schemas.TaskCreate(**(op.data or {}))
+                if str(data.project_id) not in projects:
+                    raise LookupError("Project not found")
+                task = models.Task(
+                    **data.model_dump(),
+                    id=models.generate_uuid(),
+                    user_id=str(user_id),
+                    status='todo',
+                    created_at=datetime.now(timezone.utc)
+                )
+                task.project_id = str(task.project_id)
+                db.add(task)
+                tasks[task.id] = task
+                changed[task.id] = (task, 'upsert')
+                count(task.project_id, task_count=1)
+            elif op.op in ('update', 'status', 'delete'):
+                task = tasks.get(op.task_id)
+                if task is None:
+                    raise LookupError("Task not found")
+                was_done = task.status == 'done'
+                if op.op == 'update':
+                    updates = schemas.TaskUpdate(**(op.data or {})).model_dump(exclude_unset=True)
+                    for key, value in updates.items():
+                        setattr(task, key, value)
+                elif op.op == 'status':
+                    status = TASK_STATUS_FROM_CLIENT.get(op.status, op.status)
+                    if status not in TASK_STATUS_MAP:
+                        raise ValueError(f"Invalid status: {op.status}")
+                    task.status = status
+                else:
+                    task.deleted_at = datetime.now(timezone.utc)
+                    del tasks[task.id]
+                    deleted.append((task.project_id, task.id))
+                    changed[task.id] = (task, 'delete')
+                    count(task.project_id, task_count=-1, done_count=-was_done)
+                if op.op != 'delete':
+                    changed[task.id] = (task, 'upsert')
+                    count(task.project_id, done_count=(task.status == 'done') - was_done)
+                    reviews.on_status_change(task, was_done)
+            else:
+                raise ValueError(f"Unknown op: {op.op}")
+        except (LookupError, ValueError) as e:
+            # pydantic 的 ValidationError 也是 ValueError
+            results.append({'op_id': op.op_id, 'ok': False, 'error': str(e)})
+            continue
+
+        result = {'op_id': op.op_id, 'ok': True}
+        if op.op != 'delete':
+            touched[op.op_id] = task
+        results.append(result)
+
+    failed = any(not r['ok'] for r in results)
+    executed = [r for r in results if r['ok'] and not r.get('replayed')]
+    if (atomic and failed) or not executed:
+        db.rollback()
+        if atomic and failed:
+            for r in executed:
+                r.update(ok=False, error='Rolled back: another operation in the batch failed')
+        return False, results
+
+    # 一次分组查询取回结果任务的累计时长(此处 autoflush 批量写入前面的修改)
+    result_ids = {t.id for t in touched.values() if t.id in tasks}
+    durations = _logged_seconds(db, result_ids) if result_ids else {}
+
+    for r in executed:
+        task = touched.get(r['op_id'])
+        if task is not None:
+            # 同一批中后续被删除的任务返回的是删除前的状态
+            r['task'] = _task_payload(task, projects.get(task.project_id, ""), durations.get(task.id) or 0)
+        db.add(models.TaskBatchOperation(
+            user_id=str(user_id),
+            op_id=r['op_id'],
+            result=json.dumps({k: v for k, v in r.items() if k != 'op_id'}, ensure_ascii=False)
+        ))
+
+    # 项目计数: 每个受影响的项目一条累加 UPDATE
+    if deleted:
+        seconds = _logged_seconds(db, [task_id for _, task_id in deleted])
+        for project_id, task_id in deleted:
+            count(project_id, total_seconds=-seconds.get(task_id, 0))
+    for project_id, deltas in counters.items():
+        _bump_project_counters(db, project_id, **deltas)
+    for task, change in changed.values():
+        _record_task_change(db, user_id, task, change)
+
+    bump_data_version(db, user_id)
+    db.commit()
+    return True, results
+
 # --- Timer Logic ---
 def start_timer(db: Session, task_id: str, user_id: str):
     # Stop any running timer for this user first (optional, but good practice)
@@ -330,10 +657,13 @@ def start_timer(db: Session, task_id: str, user_id: str):
         log_date=date.today()
     )
     db.add(log)
+    bump_data_version(db, user_id)
     db.commit()
+    analytics_cache.cache.append(db, user_id, [log])
+    realtime.publish_timer_event(user_id, "timer.started", log)
     return log
 
-def stop_timer(db: Session, task_id: str, user_id: str):
+def stop_timer(db: Session, task_id: str, user_id: str, paused: bool = False):
     # Find latest open log for this task
     log = db.query(models.TimeLog).filter(
         models.TimeLog.task_id == task_id,
@@ -344,16 +674,23 @@ def stop_timer(db: Session, task_id: str, user_id: str):
     if log:
         # Use timezone-aware datetime to match the model's timezone-aware field
         log.end_at = datetime.now(timezone.utc)
-        # Calculate duration
-        delta = log.end_at - log.start_at
+        # Calculate duration (SQLite 读回的开始时间不带时区,按UTC处理)
+        start_at = log.start_at if log.start_at.tzinfo else log.start_at.replace(tzinfo=timezone.utc)
+        delta = log.end_at - start_at
         log.duration_seconds = int(delta.total_seconds())
+        _bump_project_counters(db, log.project_id, total_seconds=log.duration_seconds)
+        _record_log_change(db, user_id, log)
+        bump_data_version(db, user_id)
         db.commit()
+        # 开始计时时已追加了一行0秒,这里把本次时长作为增量再追加一行
+        analytics_cache.cache.append(db, user_id, [log])
+        realtime.publish_timer_event(user_id, "timer.paused" if paused else "timer.stopped", log)
         return log
     return None
 
 def pause_timer(db: Session, task_id: str, user_id: str):
     # Same as stop for now
-    return stop_timer(db, task_id, user_id)
+    return stop_timer(db, task_id, user_id, paused=True)
 
 def log_manual_time(db: Session, task_id: str, manual_data: schemas.ManualTimeLog, user_id: str):
     task = db.query(models.Task).filter(models.Task.id == task_id).first()
@@ -371,13 +708,23 @@ def log_manual_time(db: Session, task_id: str, manual_data: schemas.ManualTimeLo
         end_at=datetime.now(timezone.utc)
     )
     db.add(log)
+    _bump_project_counters(db, log.project_id, total_seconds=manual_data.duration)
+    _record_log_change(db, user_id, log)
+    bump_data_version(db, user_id)
     db.commit()
+    analytics_cache.cache.append(db, user_id, [log])
     return log
 
 def update_task_status(db: Session, task_id: str, status: str):
     task = db.query(models.Task).filter(models.Task.id == task_id).first()
     if task:
+        was_done = task.status == 'done'
+        _bump_project_counters(db, task.project_id, done_count=(status == 'done') - was_done)
         task.status = status
+        reviews.on_status_change(task, was_done)
+        owner = _project_owner(db, task.project_id)
+        _record_task_change(db, owner, task)
+        bump_data_version(db, owner)
         db.commit()
         db.refresh(task)
     return task
@@ -388,8 +735,12 @@ def create_time_log(db: Session, log: schemas.TimeLogCreate, user_id: str):
     if not db_log.log_date:
         db_log.log_date = date.today()
     db.add(db_log)
+    _bump_project_counters(db, db_log.project_id, total_seconds=db_log.duration_seconds)
+    _record_log_change(db, user_id, db_log)
+    bump_data_version(db, user_id)
     db.commit()
     db.refresh(db_log)
+    analytics_cache.cache.append(db, user_id, [db_log])
     return db_log
 
 # --- Budgets ---
@@ -407,6 +758,12 @@ def set_project_budget(db: Session, budget: schemas.BudgetCreate):
         target_percentage=budget.target_percentage
     )
     db.add(new_budget)
+    db.query(models.Project).filter(models.Project.id == str(budget.project_id)).update(
+        {models.Project.current_target_percentage: budget.target_percentage}, synchronize_session=False
+    )
+    owner = _project_owner(db, budget.project_id)
+    record_change(db, owner, 'project', budget.project_id)
+    bump_data_version(db, owner)
     db.commit()
     return new_budget
 
@@ -414,13 +771,13 @@ def set_project_budget(db: Session, budget: schemas.BudgetCreate):
 def get_ai_configs(db: Session, user_id: str):
     """获取用户的所有AI配置"""
     return db.query(models.AIConfig).filter(
-        cast(models.AIConfig.user_id, String) == str(user_id)
+        models.AIConfig.user_id == str(user_id)
     ).all()
 
 def get_active_ai_config(db: Session, user_id: str):
     """获取用户激活的AI配置"""
     return db.query(models.AIConfig).filter(
-        cast(models.AIConfig.user_id, String) == str(user_id),
+        models.AIConfig.user_id == str(user_id),
         models.AIConfig.is_active == True
     ).first()
 
@@ -434,6 +791,7 @@ def create_ai_config(db: Session, user_id: str, config: schemas.AIConfigCreate):
         model=config.model
     )
     db.add(db_config)
+    bump_data_version(db, user_id)
     db.commit()
     db.refresh(db_config)
     return db_config
@@ -448,6 +806,7 @@ def update_ai_config(db: Session, config_id: int, updates: schemas.AIConfigUpdat
     for key, value in update_data.items():
         setattr(config, key, value)
 
+    bump_data_version(db, config.user_id)
     db.commit()
     db.refresh(config)
     return config
@@ -457,6 +816,7 @@ def delete_ai_config(db: Session, config_id: int):
     config = db.query(models.AIConfig).filter(models.AIConfig.id == config_id).first()
     if config:
         db.delete(config)
+        bump_data_version(db, config.user_id)
         db.commit()
         return True
     return False
@@ -465,18 +825,75 @@ def set_active_ai_config(db: Session, user_id: str, config_id: int):
     """设置激活的AI配置"""
     # 取消所有配置的激活状态
     db.query(models.AIConfig).filter(
-        cast(models.AIConfig.user_id, String) == str(user_id)
+        models.AIConfig.user_id == str(user_id)
     ).update({"is_active": False})
 
     # 激活指定配置
     config = db.query(models.AIConfig).filter(
         models.AIConfig.id == config_id,
-        cast(models.AIConfig.user_id, String) == str(user_id)
+        models.AIConfig.user_id == str(user_id)
     ).first()
 
     if config:
         config.is_active = True
+        bump_data_version(db, user_id)
         db.commit()
         db.refresh(config)
         return config
     return None
+
+# --- Plan Cache ---
+def _plan_mode(use_ai) -> str:
+    """规范化AI模式: 规则引擎为"false", 任何AI模式都走 enhance_with_ai, 统一为"enhanced" """
+    if not use_ai or use_ai == "false":
+        return "false"
+    return "enhanced"
+
+def get_cached_plan(db: Session, user_id: str, period: str, use_ai):
+    """读取预先生成的学习计划
+
+    只有未过期且生成时的数据版本与当前一致的计划才有效,
+    用户数据一旦变化(数据版本递增)缓存即自动失效。
+    """
+    mode = _plan_mode(use_ai)
+    now = datetime.now(timezone.utc)
+    version = get_data_version(db, user_id)
+    rows = db.query(models.AISuggestion).filter(
+        models.AISuggestion.user_id == str(user_id),
+        models.AISuggestion.suggestion_type == 'daily_plan'
+    ).all()
+    for row in rows:
+        expires_at = row.expires_at
+        if expires_at is not None and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        if expires_at is not None and expires_at <= now:
+            continue
+        content = json.loads(row.content)
+        if content.get('period') == period and content.get('mode') == mode and content.get('data_version') == version:
+            return content['plan']
+    return None
+
+def save_cached_plan(db: Session, user_id: str, period: str, use_ai, plan: dict, data_version: int, expires_at: datetime):
+    """保存学习计划,替换同一用户/周期/模式下的旧计划"""
+    mode = _plan_mode(use_ai)
+    rows = db.query(models.AISuggestion).filter(
+        models.AISuggestion.user_id == str(user_id),
+        models.AISuggestion.suggestion_type == 'daily_plan'
+    ).all()
+    for row in rows:
+        content = json.loads(row.content)
+        if content.get('period') == period and content.get('mode') == mode:
+            db.delete(row)
+
+    db.add(models.AISuggestion(
+        user_id=str(user_id),
+        suggestion_type='daily_plan',
+        content=json.dumps({
+            'period': period,
+            'mode': mode,
+            'data_version': data_version,
+            'plan': plan
+        }, ensure_ascii=False),
+        expires_at=expires_at
+    ))
+    db.commit()
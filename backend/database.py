@@ -1,28 +1,317 @@
 import os
+import re
+import time
+import uuid
+import itertools
+import threading
+from typing import Any, Dict
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, LargeBinary, String
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 load_dotenv()
 
 # Default to SQLite if not specified
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./mindbalance.db")
+# 只读副本,多个用逗号分隔;为空时所有查询都走主库
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
 
-connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+# 连接池配置(SQLite 使用 SQLAlchemy 默认值)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 连接最长使用秒数,避免被数据库或中间代理静默断开
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# 用户写入后的这段时间内,其只读请求仍然读主库(读己之写,避免副本延迟)
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args=connect_args
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# 中日韩字符(统一表意文字、假名、谚文)
+_CJK = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff])")
+
+
+def search_text(value):
+    """全文检索的文本预处理: 在中日韩字符两侧加空格,使 FTS5 的 unicode61 分词器按单字建索引
+
+    unicode61 不做中文分词,会把连续的汉字当成一个词;按单字索引后用短语查询即可匹配任意位置的词。
+    """
+    if value is None:
+        return None
+    return _CJK.sub(r" \1 ", value)
+
+
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    # 全文检索索引的触发器中调用
+    dbapi_connection.create_function("search_text", 1, search_text, deterministic=True)
+
+
+def _create_engine(url: str):
+    if url.startswith("sqlite"):
+        sqlite_engine = create_engine(url, connect_args={"check_same_thread": False})
+        event.listen(sqlite_engine, "connect", _register_sqlite_functions)
+        return sqlite_engine
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING
+    )
+
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+replica_engines = [_create_engine(url) for url in DATABASE_REPLICA_URLS]
+
+# replica: 分配到副本的会话数;read_your_writes: 因用户刚写入而留在主库的只读请求数
+routing_stats = {"replica": 0, "read_your_writes": 0}
+_replica_cursor = itertools.count()
+_recent_writes: Dict[str, float] = {}
+_recent_writes_lock = threading.Lock()
+
+
+class RoutingSession(Session):
+    """按语句路由的会话
+
+    默认所有语句走主库。标记为只读(info["read_only"])的会话把 SELECT 发往一个只读副本
+    (每个会话固定一个,轮询分配);一旦会话中出现写入,之后的语句都回到主库。
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not replica_engines or not self.info.get("read_only") or self.info.get("wrote"):
+            return super().get_bind(mapper, clause=clause, **kw)
+        if clause is None and not self._flushing:
+            # 不带语句的调用(如查询方言)不代表写入
+            return super().get_bind(mapper, clause=clause, **kw)
+        if self._flushing or not getattr(clause, "is_select", False):
+            self.info["wrote"] = True
+            return super().get_bind(mapper, clause=clause, **kw)
+        if "replica" not in self.info:
+            self.info["replica"] = replica_engines[next(_replica_cursor) % len(replica_engines)]
+            routing_stats["replica"] += 1
+        return self.info["replica"]
+
+
+def note_write(user_id: str):
+    """记录用户的写入时间,供读己之写判断"""
+    if replica_engines and user_id:
+        with _recent_writes_lock:
+            now = time.monotonic()
+            _recent_writes[str(user_id)] = now
+            if len(_recent_writes) > 10000:
+                for key, at in list(_recent_writes.items()):
+                    if now - at > DB_READ_YOUR_WRITES_SECONDS:
+                        del _recent_writes[key]
+
+
+def recently_wrote(user_id: str) -> bool:
+    """用户最近是否写入过(进程内记录;多进程部署时应配合粘性会话)"""
+    at = _recent_writes.get(str(user_id))
+    return at is not None and time.monotonic() - at < DB_READ_YOUR_WRITES_SECONDS
+
+
+def mark_read_only(db: Session, user_id: str = None) -> Session:
+    """把会话标记为只读,使查询路由到副本;该用户刚写入过时保持读主库"""
+    if replica_engines and not (user_id and recently_wrote(user_id)):
+        db.info["read_only"] = True
+    elif replica_engines:
+        routing_stats["read_your_writes"] += 1
+    return db
+
+
+def _pool_status(bind) -> Dict[str, Any]:
+    pool = bind.pool
+    status = {"url": bind.url.render_as_string(hide_password=True), "class": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+
+def pool_metrics() -> Dict[str, Any]:
+    """主库与副本的连接池状态,以及只读请求的路由次数"""
+    return {
+        "primary": _pool_status(engine),
+        "replicas": [_pool_status(e) for e in replica_engines],
+        "routing": dict(routing_stats)
+    }
+
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+
+class GUID(TypeDecorator):
+    """UUID 列类型: PostgreSQL 使用原生 uuid,其他数据库存 16 字节二进制;应用中始终是字符串形式
+
+    主键、索引只有文本UUID(36字节)的一半大小。SQLite 上无法解析为UUID的值按 UTF-8 字节保存,
+    查询时匹配不到任何UUID,读取时还原为原字符串。
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import UUID
+            return dialect.type_descriptor(UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == "postgresql":
+            return str(value)
+        return _uuid_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if len(value) != 16:
+            return value.decode()
+        h = value.hex()  # 比 str(uuid.UUID(bytes=...)) 快,大结果集上差别明显
+        return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _uuid_bytes(value):
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value)
+    value = str(value)
+    try:
+        if len(value) == 36 and value[8] == value[13] == value[18] == value[23] == "-":
+            return bytes.fromhex(value.replace("-", ""))
+        return uuid.UUID(value).bytes
+    except ValueError:
+        return value.encode()
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def add_missing_columns(bind=None):
+    """为已存在的表补齐模型中新增的列和索引(幂等),返回新增的列名(表名.列名)
+
+    create_all 只创建缺失的表;新增的列必须可为空或带常量服务端默认值。
+    """
+    bind = bind or engine
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                default = column.server_default.arg if column.server_default is not None else None
+                default = f" DEFAULT '{default}'" if isinstance(default, str) else ""
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}')
+                added.append(f"{table.name}.{column.name}")
+                print(f"[数据库] 已添加列 {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return added
+
+def migrate_uuid_columns(bind=None):
+    """把仍以文本保存的 GUID 列转换为紧凑格式(幂等),返回转换的列名(表名.列名)
+
+    PostgreSQL 就地 ALTER COLUMN ... TYPE uuid;SQLite 不能修改列类型,按新定义重建整张表后
+    用 INSERT ... SELECT 转换数据,最后 VACUUM 回收空间。
+    """
+    bind = bind or engine
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    converted = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+        columns = [
+            c.name for c in table.columns
+            if isinstance(c.type, GUID) and isinstance(existing.get(c.name), String)
+        ]
+        if not columns:
+            continue
+
+        with bind.begin() as conn:
+            if bind.dialect.name == "postgresql":
+                for name in columns:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ALTER COLUMN {name} TYPE uuid USING NULLIF({name}, '')::uuid"
+                    )
+            else:
+                conn.connection.driver_connection.create_function("uuid_bytes", 1, _uuid_bytes, deterministic=True)
+                old = f"{table.name}__text_ids"
+                # 重命名会把引用该表的触发器(包括其他表上的)改为指向旧表,旧表删除后这些触发器失效;
+                # 触发器先全部删除,由启动时的 search.ensure_search_index 重建
+                for (trigger,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+                    conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS "{trigger}"')
+                for index in inspector.get_indexes(table.name):
+                    conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{index["name"]}"')
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {old}")
+                table.create(conn)
+                names = [c.name for c in table.columns if c.name in existing]
+                select_list = ", ".join(f"uuid_bytes({n})" if n in columns else n for n in names)
+                conn.exec_driver_sql(
+                    f"INSERT INTO {table.name} ({', '.join(names)}) SELECT {select_list} FROM {old}"
+                )
+                conn.exec_driver_sql(f"DROP TABLE {old}")
+        converted += [f"{table.name}.{name}" for name in columns]
+        print(f"[数据库] 已转换UUID列 {table.name}: {', '.join(columns)}")
+
+    if converted and bind.dialect.name == "sqlite":
+        with bind.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql("VACUUM")
+    return converted
+
+
+def analyze_tables(bind=None):
+    """刷新 SQLite 的查询规划统计(sqlite_stat1)
+
+    没有统计信息时,规划器会把 deleted_at IS NULL 当作高选择性条件,
+    在 id IN (...) 列表较长时改走 ix_*_deleted_at 索引扫描几乎整张表。
+    analysis_limit 限制每个索引的采样行数,百万行级别也在一秒内完成。
+    """
+    bind = bind or engine
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        conn.exec_driver_sql("PRAGMA analysis_limit = 1000")
+        conn.exec_driver_sql("ANALYZE")
+
+
+def init_db():
+    """建表并执行全部启动迁移(幂等);API进程、AI工作进程和运维命令启动时都调用这里
+
+    模型与服务模块依赖本模块,因此在函数内导入。
+    """
+    import models
+    import crud
+    from services import search, changes
+
+    models.Base.metadata.create_all(bind=engine)
+    added = add_missing_columns()
+    migrate_uuid_columns()
+    search.ensure_search_index()
+    analyze_tables()
+    if "tasks.user_id" in added:
+        # 任务所有者列刚添加,按所属项目回填
+        with SessionLocal() as db:
+            crud.backfill_task_owners(db)
+    if "projects.task_count" in added:
+        # 项目计数列刚添加,按现有数据回填
+        with SessionLocal() as db:
+            crud.reconcile_project_counters(db)
+    changes.seed_change_log()
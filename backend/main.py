@@ -1,14 +1,19 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
+from datetime import date, datetime, time, timedelta, timezone
+import asyncio
+import hashlib
 import models, schemas, crud, database
 from services import analysis, statistics, ai_planning
-from services import ai_planning_stream
+from services import ai_planning_stream, ai_service, ai_jobs, plan_precompute, ai_chat, ai_usage, purger, analytics_cache, search, reviews, realtime, changes
 
 # Create Tables
-models.Base.metadata.create_all(bind=database.engine)
+database.init_db()
 
 app = FastAPI(title="MindBalance API")
 
@@ -19,6 +24,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Dependency
@@ -73,6 +79,50 @@ def startup_event():
 
     db.close()
 
+@app.on_event("startup")
+async def start_ai_jobs():
+    # 设置 AI_JOBS_INPROCESS=false 时由独立的 ai_worker.py 进程执行任务
+    if ai_jobs.AI_JOBS_INPROCESS:
+        ai_jobs.runner.start()
+
+@app.on_event("shutdown")
+async def stop_ai_jobs():
+    await ai_jobs.runner.stop()
+
+@app.on_event("startup")
+async def start_ai_usage():
+    ai_usage.recorder.start()
+
+@app.on_event("shutdown")
+async def flush_ai_usage():
+    await ai_usage.recorder.stop()
+
+@app.on_event("startup")
+async def start_realtime():
+    await realtime.broker.start()
+
+@app.on_event("shutdown")
+async def stop_realtime():
+    await realtime.broker.stop()
+
+@app.on_event("startup")
+async def start_purger():
+    # 分批物理删除已软删除的项目、任务及其时间记录
+    if purger.PURGE_ENABLED:
+        asyncio.ensure_future(purger.run_periodically())
+
+@app.on_event("startup")
+async def start_changes_compaction():
+    # 删除被覆盖的变更记录与过期的删除记录
+    if changes.CHANGES_COMPACT_ENABLED:
+        asyncio.ensure_future(changes.run_periodically())
+
+@app.on_event("startup")
+async def start_plan_precompute():
+    # 夜间为所有用户预生成计划,早高峰请求直接命中缓存
+    if plan_precompute.PLAN_PRECOMPUTE_ENABLED:
+        asyncio.ensure_future(plan_precompute.run_scheduler())
+
 def get_current_user_id(db: Session = Depends(get_db)):
     user = crud.get_user_by_email(db, DEMO_USER_EMAIL)
     if not user:
@@ -80,10 +130,51 @@ def get_current_user_id(db: Session = Depends(get_db)):
         user = crud.create_user(db, DEMO_USER_EMAIL)
     return user.id
 
+def get_read_db(db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+    """只读接口使用的会话: 配置了只读副本时查询走副本,用户刚写入过时仍读主库"""
+    return database.mark_read_only(db, user_id)
+
+def check_not_modified(request: Request, response: Response, db: Session, user_id: str, extra: str = "") -> Optional[Response]:
+    """基于用户数据版本的条件请求校验
+
+    ETag 由用户数据版本、当天日期(统计含"今日"数据)和请求URL派生;
+    结果还随时间变化的接口通过 extra 传入决定结果的时间点。
+    客户端携带的 If-None-Match 仍然有效时直接返回304,跳过后续聚合查询。
+    """
+    version = crud.get_data_version(db, user_id)
+    raw = f"{user_id}:{version}:{date.today().isoformat()}:{extra}:{request.url.path}?{request.url.query}"
+    etag = f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:24]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    client_tags = [tag.strip() for tag in if_none_match.split(",")]
+    if etag in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
+
+def sparse_response(response: Response, rows) -> JSONResponse:
+    """fields= 投影结果直接返回(不经过完整的响应模型),并带上已设置的 ETag 等响应头"""
+    return JSONResponse(content=jsonable_encoder(rows), headers=dict(response.headers))
+
+def parse_fields_or_400(fields: str, allowed) -> list:
+    try:
+        return crud.parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # --- Routes ---
 
 @app.get("/api/projects", response_model=List[schemas.Project])
-def read_projects(db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+def read_projects(request: Request, response: Response, fields: Optional[str] = None, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
+    """项目列表;fields=id,name 只返回指定字段,未请求的统计字段不计算"""
+    selected = parse_fields_or_400(fields, crud.PROJECT_COLUMNS + crud.PROJECT_AGGREGATES) if fields else None
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    if selected:
+        return sparse_response(response, crud.get_projects_sparse(db, user_id, selected))
     return crud.get_projects(db, user_id)
 
 @app.post("/api/projects", response_model=schemas.Project)
@@ -98,8 +189,11 @@ def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/projects/{project_id}", response_model=schemas.Project)
-def read_project(project_id: str, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+def read_project(project_id: str, request: Request, response: Response, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取单个项目详情"""
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
     project = crud.get_project(db, project_id, user_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -125,16 +219,72 @@ def complete_project(project_id: str, db: Session = Depends(get_db)):
     return {"message": "Project marked as completed"}
 
 @app.get("/api/projects/{project_id}/tasks", response_model=List[schemas.Task])
-def read_project_tasks(project_id: str, db: Session = Depends(get_db)):
+def read_project_tasks(project_id: str, request: Request, response: Response, fields: Optional[str] = None, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
+    selected = parse_fields_or_400(fields, crud.TASK_COLUMNS + crud.TASK_AGGREGATES) if fields else None
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    if selected:
+        return sparse_response(response, crud.get_tasks_sparse(db, selected, project_id))
     return crud.get_tasks(db, project_id)
 
 @app.get("/api/tasks", response_model=List[schemas.Task])
-def read_all_tasks(project_id: Optional[str] = None, db: Session = Depends(get_db)):
+def read_all_tasks(request: Request, response: Response, project_id: Optional[str] = None, fields: Optional[str] = None, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
+    """任务列表;fields=id,title,status 只查询指定列,项目名与时长仅在请求时计算"""
+    selected = parse_fields_or_400(fields, crud.TASK_COLUMNS + crud.TASK_AGGREGATES) if fields else None
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    if selected:
+        return sparse_response(response, crud.get_tasks_sparse(db, selected, project_id))
     return crud.get_tasks(db, project_id)
 
+@app.get("/api/changes", response_model=schemas.ChangeFeed)
+def read_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id)
+):
+    """增量同步: 游标 since 之后新增、修改与删除的项目和任务
+
+    首次同步传 since=0;之后传上次返回的 cursor,has_more 为 true 时继续拉取。
+    reset 为 true 时客户端的游标已过期,应全量重新加载列表后从返回的 cursor 继续。
+    游标会停在最近写入的记录之前,响应随时间变化,因此不做 ETag 校验。
+    """
+    return changes.get_changes(db, user_id, since, limit)
+
+@app.get("/api/search", response_model=schemas.SearchResponse)
+def search_items(
+    request: Request,
+    response: Response,
+    q: str,
+    types: str = "task,project",
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id)
+):
+    """全文检索任务(标题、描述)与项目(名称),每个词按前缀匹配,按相关度排序
+
+    Args:
+        types: 逗号分隔的结果类型 task, project
+    """
+    kinds = [k.strip() for k in types.split(",") if k.strip()]
+    unknown = [k for k in kinds if k not in search.KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown types: {', '.join(unknown)}. Allowed: {', '.join(search.KINDS)}")
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    return search.search(db, user_id, q, kinds, limit, offset)
+
 @app.get("/api/tasks/{task_id}", response_model=schemas.Task)
-def read_task(task_id: str, db: Session = Depends(get_db)):
+def read_task(task_id: str, request: Request, response: Response, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取单个任务详情"""
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
     task = crud.get_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
@@ -144,6 +294,17 @@ def read_task(task_id: str, db: Session = Depends(get_db)):
 def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db)):
     return crud.create_task(db, task)
 
+@app.post("/api/tasks/batch", response_model=schemas.TaskBatchResponse)
+def batch_tasks(batch: schemas.TaskBatchRequest, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+    """批量执行任务的 create/update/status/delete 操作(单个事务,按 op_id 幂等,逐个报告结果)"""
+    try:
+        committed, results = crud.apply_task_batch(db, user_id, batch.operations, batch.atomic)
+    except IntegrityError:
+        # 同一 op_id 被并发提交: 回滚后重试一次,已记录的操作会按幂等结果返回
+        db.rollback()
+        committed, results = crud.apply_task_batch(db, user_id, batch.operations, batch.atomic)
+    return {"committed": committed, "results": results}
+
 @app.put("/api/tasks/{task_id}", response_model=schemas.Task)
 def update_task(task_id: str, task: schemas.TaskUpdate, db: Session = Depends(get_db)):
     updated = crud.update_task(db, task_id, task)
@@ -176,11 +337,54 @@ def pause_timer(task_id: str, db: Session = Depends(get_db), user_id: str = Depe
         raise HTTPException(status_code=400, detail="No active timer found for this task")
     return {"message": "Timer paused"}
 
+@app.websocket("/api/ws/timer")
+async def timer_socket(websocket: WebSocket):
+    """计时器状态同步: 连接后收到 timer.snapshot,之后推送本用户所有设备上的
+    timer.started / timer.paused / timer.stopped 事件,计时进行中每秒推送 timer.tick
+    """
+    # 会话只用于建立连接,不在整个连接期间占用连接池
+    with database.SessionLocal() as db:
+        user_id = get_current_user_id(db)
+    await websocket.accept()
+    await realtime.serve(websocket, str(user_id))
+
 @app.post("/api/tasks/{task_id}/time-manual")
 def add_manual_time(task_id: str, data: schemas.ManualTimeLog, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
     crud.log_manual_time(db, task_id, data, user_id)
     return {"message": "Time added"}
 
+@app.get("/api/reviews/due", response_model=List[schemas.Task])
+def read_due_reviews(
+    request: Request,
+    response: Response,
+    until: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id)
+):
+    """待复习队列: 截至 until(默认当前时间)到期的已完成任务,最早到期的在前
+
+    前端取今日队列时传入今天结束的时间。
+    """
+    until = until or datetime.now(timezone.utc)
+    # 数据未变时,队列只在下一个任务到期时变化: ETag 包含 until 之后最早的到期时间
+    next_due = reviews.next_due_at(db, user_id, until)
+    not_modified = check_not_modified(request, response, db, user_id, extra=next_due.isoformat() if next_due else "")
+    if not_modified:
+        return not_modified
+    return reviews.get_due_tasks(db, user_id, until, limit)
+
+@app.post("/api/tasks/{task_id}/review", response_model=schemas.Task)
+def review_task(task_id: str, result: schemas.ReviewResult, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+    """记录一次复习: 记住则推进到下一个复习间隔,忘记则从第一个间隔重新开始"""
+    try:
+        task = reviews.review_task(db, user_id, task_id, result.remembered)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
 @app.post("/api/timelogs", response_model=schemas.TimeLog)
 def create_timelog(log: schemas.TimeLogCreate, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
     return crud.create_time_log(db, log, user_id)
@@ -191,35 +395,101 @@ def set_budget(budget: schemas.BudgetCreate, db: Session = Depends(get_db)):
     return budget
 
 @app.get("/api/analysis/variance", response_model=List[schemas.VarianceResult])
-def get_variance(days: int = 7, db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+def get_variance(request: Request, response: Response, days: int = 7, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
     return analysis.calculate_variance(db, user_id, days)
 
 # --- Statistics Routes ---
 
 @app.get("/api/statistics/overview")
-def get_overview(period: str = "week", db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+def get_overview(request: Request, response: Response, period: str = "week", start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取概览统计数据"""
-    stats = statistics.get_overview_stats(db, user_id, period)
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    stats = statistics.get_overview_stats(db, user_id, period, start, end)
     return stats.model_dump(by_alias=True)
 
 @app.get("/api/statistics/project-time")
-def get_project_time(period: str = "week", db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+def get_project_time(request: Request, response: Response, period: str = "week", start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取项目时间分布"""
-    projects = statistics.get_project_time_distribution(db, user_id, period)
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    projects = statistics.get_project_time_distribution(db, user_id, period, start, end)
     return [p.model_dump(by_alias=True) for p in projects]
 
 @app.get("/api/statistics/daily-trend")
-def get_daily_trend(period: str = "week", db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
-    """获取每日学习时长趋势"""
-    trends = statistics.get_daily_trend(db, user_id, period)
+def get_daily_trend(
+    request: Request,
+    response: Response,
+    period: str = "week",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    granularity: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id)
+):
+    """获取学习时长趋势
+
+    Args:
+        start/end: 日期范围(包含当天),覆盖 period
+        granularity: "hour", "day", "week"(ISO周), "month";不传时按时间跨度自动选择
+    """
+    if granularity and granularity not in statistics.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(statistics.GRANULARITIES)}")
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    trends = statistics.get_daily_trend(db, user_id, period, start, end, granularity)
     return [t.model_dump(by_alias=True) for t in trends]
 
+@app.get("/api/statistics/heatmap")
+def get_focus_heatmap(
+    request: Request,
+    response: Response,
+    period: str = "week",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    tz_offset_minutes: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+    user_id: str = Depends(get_current_user_id)
+):
+    """获取学习时段热力图: 计时记录按整点切分后累加到 星期 × 小时 的矩阵
+
+    Args:
+        tz_offset_minutes: 本地时区相对UTC的分钟数(如东八区为480),默认使用服务器时区
+    """
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    return statistics.get_focus_heatmap(db, user_id, period, start, end, tz_offset_minutes)
+
 @app.get("/api/statistics/energy")
-def get_energy_distribution(period: str = "week", db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+def get_energy_distribution(request: Request, response: Response, period: str = "week", start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取精力分配对比"""
-    energy = statistics.get_energy_distribution(db, user_id, period)
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
+    energy = statistics.get_energy_distribution(db, user_id, period, start, end)
     return [e.model_dump(by_alias=True) for e in energy]
 
+@app.get("/api/metrics")
+def get_metrics():
+    """运行时指标(AI服务熔断状态与调用统计、数据库连接池)"""
+    return {
+        "ai": ai_service.get_metrics(),
+        "ai_jobs": ai_jobs.runner.snapshot(),
+        "ai_usage": ai_usage.recorder.snapshot(),
+        "purger": purger.stats,
+        "analytics_cache": analytics_cache.cache.snapshot(),
+        "realtime": realtime.broker.snapshot(),
+        "changes": changes.stats,
+        "database": database.pool_metrics()
+    }
+
 @app.get("/")
 def read_root():
     return {"message": "MindBalance API is running. Go to /docs for Swagger UI."}
@@ -270,13 +540,16 @@ def activate_ai_config(config_id: int, db: Session = Depends(get_db), user_id: s
 # --- AI Planning Routes ---
 
 @app.get("/api/ai/warnings")
-async def get_energy_warnings(db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+async def get_energy_warnings(request: Request, response: Response, db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取精力预警"""
+    not_modified = check_not_modified(request, response, db, user_id)
+    if not_modified:
+        return not_modified
     warnings = await ai_planning.get_energy_warnings(db, user_id)
     return warnings
 
 @app.get("/api/ai/recommendations")
-async def get_recommendations(db: Session = Depends(get_db), user_id: str = Depends(get_current_user_id)):
+async def get_recommendations(db: Session = Depends(get_read_db), user_id: str = Depends(get_current_user_id)):
     """获取今日任务推荐"""
     result = await ai_planning.generate_daily_plan(db, user_id)
     if 'error' in result:
@@ -291,6 +564,8 @@ async def generate_plan(
 ):
     """生成学习计划
 
+    会写入计划缓存,使用主库会话: 数据版本与计划输入必须与写入的缓存一致,不能读自可能滞后的副本。
+
     Args:
         request: 包含 period 和 use_ai 参数的请求体
         period: 时间周期，支持 "today"(默认), "week", "month"
@@ -318,7 +593,6 @@ async def generate_plan(
 async def generate_plan_stream(
     period: str = "today",
     use_ai: str = "false",
-    db: Session = Depends(get_db),
     user_id = Depends(get_current_user_id)
 ):
     """流式生成学习计划 (SSE)
@@ -334,10 +608,15 @@ async def generate_plan_stream(
         SSE流式响应
     """
     async def event_stream():
-        async for chunk in ai_planning_stream.generate_daily_plan_stream(
-            db, user_id, period, use_ai
-        ):
-            yield chunk
+        # 依赖注入的会话在响应开始发送前就已关闭,事件流使用独立的会话
+        db = database.SessionLocal()
+        try:
+            async for chunk in ai_planning_stream.generate_daily_plan_stream(
+                db, user_id, period, use_ai
+            ):
+                yield chunk
+        finally:
+            db.close()
 
     return StreamingResponse(
         event_stream(),
@@ -348,3 +627,106 @@ async def generate_plan_stream(
             "X-Accel-Buffering": "no"  # 禁用Nginx缓冲
         }
     )
+
+# --- AI Job Routes ---
+
+@app.post("/api/ai/jobs", response_model=schemas.AIJob, status_code=202)
+def create_ai_job(
+    request: schemas.GeneratePlanRequest,
+    db: Session = Depends(get_db),
+    user_id = Depends(get_current_user_id)
+):
+    """提交学习计划生成任务,立即返回任务ID
+
+    通过 GET /api/ai/jobs/{job_id} 轮询,或订阅 /api/ai/jobs/{job_id}/events 等待完成。
+    """
+    job = ai_jobs.submit_plan_job(db, user_id, request.period, request.use_ai)
+    return ai_jobs.job_to_dict(job)
+
+@app.get("/api/ai/jobs/{job_id}", response_model=schemas.AIJob)
+def read_ai_job(job_id: str, db: Session = Depends(get_db), user_id = Depends(get_current_user_id)):
+    """查询任务状态与结果"""
+    job = ai_jobs.get_job(db, job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ai_jobs.job_to_dict(job)
+
+@app.get("/api/ai/jobs/{job_id}/events")
+async def ai_job_events(job_id: str, db: Session = Depends(get_db), user_id = Depends(get_current_user_id)):
+    """订阅任务状态变化 (SSE),任务结束时推送 complete 事件"""
+    if not ai_jobs.get_job(db, job_id, user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        stream_db = database.SessionLocal()
+        last_status = None
+        try:
+            while True:
+                stream_db.expire_all()
+                job = ai_jobs.get_job(stream_db, job_id, user_id)
+                data = schemas.AIJob(**ai_jobs.job_to_dict(job)).model_dump(mode="json")
+                if job.status in ai_jobs.FINISHED_STATUSES:
+                    yield ai_planning_stream.sse_event("complete", data)
+                    return
+                if job.status != last_status:
+                    last_status = job.status
+                    yield ai_planning_stream.sse_event("status", {"id": data["id"], "status": job.status})
+                await ai_jobs.runner.wait_finished(job_id, timeout=ai_jobs.AI_JOBS_POLL_SECONDS)
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+# --- AI Chat Routes ---
+
+@app.post("/api/ai/chat", response_model=schemas.ChatReply)
+async def ai_chat_message(request: schemas.ChatRequest, db: Session = Depends(get_db), user_id = Depends(get_current_user_id)):
+    """对话式学习规划(自动携带受token预算约束的历史上下文)"""
+    try:
+        return await ai_chat.chat(db, user_id, request.message)
+    except ai_chat.ChatNotConfigured:
+        raise HTTPException(status_code=400, detail="No active AI configuration found")
+    except Exception as e:
+        print(f"Error in ai chat: {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+
+@app.get("/api/ai/usage", response_model=List[schemas.AIUsageAggregate])
+def get_ai_usage(
+    group_by: str = "day",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: Session = Depends(get_db),
+    user_id: str = Depends(get_current_user_id)
+):
+    """当前用户AI调用的token用量与费用,按 day/provider/model/user/feature 聚合(end 为包含当天)
+
+    只返回当前用户的记录,不通过接口暴露其他用户的用量。
+    """
+    if group_by not in ai_usage.GROUP_BY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(ai_usage.GROUP_BY_FIELDS)}")
+    return ai_usage.aggregate_usage(
+        db,
+        group_by,
+        start=datetime.combine(start, time.min) if start else None,
+        end=datetime.combine(end + timedelta(days=1), time.min) if end else None,
+        user_id=user_id
+    )
+
+@app.get("/api/ai/chat/history", response_model=List[schemas.ChatMessage])
+def ai_chat_history(limit: int = 50, db: Session = Depends(get_db), user_id = Depends(get_current_user_id)):
+    """获取最近的对话记录"""
+    return ai_chat.get_history(db, user_id, limit)
+
+@app.delete("/api/ai/chat/history")
+def clear_ai_chat_history(db: Session = Depends(get_db), user_id = Depends(get_current_user_id)):
+    """清空对话记录与摘要"""
+    ai_chat.clear_history(db, user_id)
+    return {"message": "Conversation cleared"}
@@ -0,0 +1,91 @@
+"""
+运维命令行工具
+
+用法:
+    python manage.py precompute-plans [--period today] [--mode enhanced] [--rate 30]
+    python manage.py purge-deleted [--batch-size 500]
+    python manage.py archive-logs [--horizon-days 365] [--user USER_ID]
+    python manage.py restore-logs [--user USER_ID] [--month 2024-01]
+    python manage.py reconcile-counters [--user USER_ID]
+    python manage.py compact-changes [--retention-days 30]
+"""
+import argparse
+import asyncio
+
+import database
+
+
+def cmd_precompute_plans(args):
+    from services import plan_precompute
+    asyncio.run(plan_precompute.precompute_daily_plans(args.period, args.mode, args.rate))
+
+
+def cmd_purge_deleted(args):
+    from services import purger
+    asyncio.run(purger.purge(args.batch_size, args.pause))
+
+
+def cmd_archive_logs(args):
+    from services import archive
+    horizon_days = archive.ARCHIVE_HORIZON_DAYS if args.horizon_days is None else args.horizon_days
+    archive.archive_logs(horizon_days, args.user)
+
+
+def cmd_restore_logs(args):
+    from services import archive
+    archive.restore_logs(args.user, args.month)
+
+
+def cmd_reconcile_counters(args):
+    import crud
+    with database.SessionLocal() as db:
+        fixed = crud.reconcile_project_counters(db, args.user)
+    print(f"[计数校正] 已修正 {fixed} 个项目")
+
+
+def cmd_compact_changes(args):
+    from services import changes
+    retention_days = changes.CHANGES_RETENTION_DAYS if args.retention_days is None else args.retention_days
+    asyncio.run(changes.compact(retention_days))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MindBalance 运维命令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("precompute-plans", help="为所有用户预生成今日学习计划(可断点续跑)")
+    p.add_argument("--period", default="today")
+    p.add_argument("--mode", default="enhanced")
+    p.add_argument("--rate", type=float, default=30, help="每分钟处理的用户数")
+    p.set_defaults(func=cmd_precompute_plans)
+
+    p = subparsers.add_parser("purge-deleted", help="立即分批物理删除已软删除的项目、任务及其时间记录")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.add_argument("--pause", type=float, default=0.05, help="批与批之间的停顿(秒)")
+    p.set_defaults(func=cmd_purge_deleted)
+
+    p = subparsers.add_parser("archive-logs", help="把早于期限的时间记录按用户+月份归档为压缩分段")
+    p.add_argument("--horizon-days", type=int, default=None, help="默认取 ARCHIVE_HORIZON_DAYS")
+    p.add_argument("--user", default=None, help="只归档指定用户")
+    p.set_defaults(func=cmd_archive_logs)
+
+    p = subparsers.add_parser("restore-logs", help="把归档分段还原回 time_logs")
+    p.add_argument("--user", default=None)
+    p.add_argument("--month", default=None, help="只还原指定月份(YYYY-MM)")
+    p.set_defaults(func=cmd_restore_logs)
+
+    p = subparsers.add_parser("reconcile-counters", help="按明细数据校正项目的预算、任务数与累计时长计数列")
+    p.add_argument("--user", default=None, help="只校正指定用户的项目")
+    p.set_defaults(func=cmd_reconcile_counters)
+
+    p = subparsers.add_parser("compact-changes", help="压缩变更日志: 删除被覆盖的记录与过期的删除记录")
+    p.add_argument("--retention-days", type=int, default=None, help="默认取 CHANGES_RETENTION_DAYS")
+    p.set_defaults(func=cmd_compact_changes)
+
+    args = parser.parse_args()
+    database.init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
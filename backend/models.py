@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Float, Text
+from sqlalchemy import event, select, or_, Column, Integer, String, Boolean, ForeignKey, DateTime, Date, Float, Text, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, with_loader_criteria
 import uuid
-from database import Base
+import database
+from database import Base, GUID
 
 def generate_uuid():
     return str(uuid.uuid4())
@@ -10,7 +11,7 @@ def generate_uuid():
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(GUID, primary_key=True, default=generate_uuid)
     email = Column(String, unique=True, index=True)
     full_name = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -18,20 +19,28 @@ class User(Base):
 class Project(Base):
     __tablename__ = "projects"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    user_id = Column(String)  # 不使用外键
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    user_id = Column(GUID)  # 不使用外键
     name = Column(String, index=True)
     color_hex = Column(String, default="#000000")
     icon = Column(String, default="fas fa-book")
     description = Column(String, nullable=True)
     status = Column(String, default="active") # active, archived
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True, index=True)  # 软删除标记,由后台清理任务物理删除
+
+    # 冗余计数列,由 crud 中任务/时间记录/预算的写路径在同一事务内原子更新
+    # (manage.py reconcile-counters 按明细数据重新校正)
+    current_target_percentage = Column(Integer, nullable=True)  # 当前生效预算,无预算时为空
+    task_count = Column(Integer, nullable=False, default=0, server_default="0")
+    done_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_seconds = Column(Integer, nullable=False, default=0, server_default="0")  # 含已归档的记录
 
 class ProjectBudget(Base):
     __tablename__ = "project_budgets"
 
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(String)  # 不使用外键
+    project_id = Column(GUID)  # 不使用外键
     target_percentage = Column(Integer) # 0-100
     valid_from = Column(DateTime(timezone=True), server_default=func.now())
     valid_to = Column(DateTime(timezone=True), nullable=True) # Null means current
@@ -54,21 +63,47 @@ Project.budgets = relationship(
 class Task(Base):
     __tablename__ = "tasks"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    project_id = Column(String)  # 不使用外键
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    project_id = Column(GUID)  # 不使用外键
     title = Column(String, index=True)
     description = Column(String, nullable=True)
     status = Column(String, default="todo") # todo, in_progress, done
     priority = Column(String, default="medium")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True, index=True)  # 软删除标记,由后台清理任务物理删除
+
+    user_id = Column(GUID, nullable=True)  # 冗余的项目所有者,用于按用户的复习队列索引
+    due_date = Column(DateTime(timezone=True), nullable=True)
+    # 间隔复习(services/reviews.py): 完成时安排第一次复习,复习完全部间隔后为空
+    next_review_at = Column(DateTime(timezone=True), nullable=True)
+    review_stage = Column(Integer, nullable=False, default=0, server_default="0")  # 下一次复习使用的间隔序号
+    last_reviewed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('idx_tasks_user_next_review', 'user_id', 'next_review_at'),
+    )
+
+class TaskBatchOperation(Base):
+    """批量任务接口已执行的操作(按用户+操作ID幂等)"""
+    __tablename__ = "task_batch_operations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(GUID, nullable=False)  # 不使用外键
+    op_id = Column(String, nullable=False)
+    result = Column(Text, nullable=False)  # JSON格式的操作结果
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'op_id', name='uq_task_batch_operations_user_op'),
+    )
 
 class TimeLog(Base):
     __tablename__ = "time_logs"
 
-    id = Column(String, primary_key=True, default=generate_uuid)
-    task_id = Column(String, nullable=True)  # 不使用外键
-    project_id = Column(String)  # 不使用外键
-    user_id = Column(String)  # 不使用外键
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    task_id = Column(GUID, nullable=True)  # 不使用外键
+    project_id = Column(GUID)  # 不使用外键
+    user_id = Column(GUID)  # 不使用外键
 
     log_type = Column(String) # TIMER, MANUAL
     start_at = Column(DateTime(timezone=True), nullable=True)
@@ -78,13 +113,46 @@ class TimeLog(Base):
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class TimeLogDaily(Base):
+    """已归档时间记录的按日汇总,统计查询直接读取"""
+    __tablename__ = "time_log_daily"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(GUID, nullable=False)  # 不使用外键
+    project_id = Column(GUID)  # 不使用外键
+    task_id = Column(GUID, nullable=True)  # 不使用外键
+    log_date = Column(Date, nullable=False)
+    duration_seconds = Column(Integer, nullable=False, default=0)
+    log_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('idx_time_log_daily_user_date', 'user_id', 'log_date'),
+    )
+
+class TimeLogArchive(Base):
+    """冷存储的时间记录分段(每个用户每月一段,按列组织后压缩)"""
+    __tablename__ = "time_log_archives"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(GUID, nullable=False)  # 不使用外键
+    month = Column(String, nullable=False)  # 'YYYY-MM'
+    row_count = Column(Integer, nullable=False, default=0)
+    total_seconds = Column(Integer, nullable=False, default=0)
+    data = Column(LargeBinary, nullable=False)  # zlib压缩的JSON: {列名: [值, ...]}
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'month', name='uq_time_log_archives_user_month'),
+    )
+
 class AIConfig(Base):
     """AI配置表"""
     __tablename__ = "ai_configs"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String)  # 不使用外键
-    provider = Column(String, nullable=False)  # 'deepseek', 'qwen', 'openai', etc.
+    user_id = Column(GUID)  # 不使用外键
+    provider = Column(String, nullable=False)  # 'deepseek', 'qwen', 'openai', 'mock', etc.
     api_key = Column(String, nullable=False)
     api_base = Column(String, nullable=True)  # 自定义API端点
     model = Column(String, nullable=True)  # 使用的模型名称
@@ -97,18 +165,117 @@ class AIConversation(Base):
     __tablename__ = "ai_conversations"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String)  # 不使用外键
-    role = Column(String, nullable=False)  # 'system', 'user', 'assistant'
+    user_id = Column(GUID)  # 不使用外键
+    role = Column(String, nullable=False)  # 'system', 'user', 'assistant', 'summary'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index('idx_ai_conversations_user', 'user_id', 'id'),
+    )
+
 class AISuggestion(Base):
     """AI学习建议缓存表"""
     __tablename__ = "ai_suggestions"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(String)  # 不使用外键
+    user_id = Column(GUID)  # 不使用外键
     suggestion_type = Column(String, nullable=False)  # 'daily_plan', 'energy_warning', 'task_recommendation'
     content = Column(Text, nullable=False)  # JSON格式的建议内容
     generated_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=True)  # 缓存过期时间
+
+class UserDataVersion(Base):
+    """用户数据版本表(每次写操作递增,用于生成ETag)"""
+    __tablename__ = "user_data_versions"
+
+    user_id = Column(GUID, primary_key=True)  # 不使用外键
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ChangeLog(Base):
+    """项目与任务的变更日志(outbox): 与数据变更在同一事务中写入,增量同步接口按游标读取"""
+    __tablename__ = "change_log"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)  # 同步游标,单调递增
+    user_id = Column(GUID, nullable=False)  # 不使用外键
+    entity = Column(String, nullable=False)  # 'project', 'task'
+    entity_id = Column(GUID, nullable=False)
+    op = Column(String, nullable=False)  # 'upsert', 'delete'
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_change_log_user_id', 'user_id', 'id'),
+        Index('idx_change_log_entity', 'entity_id', 'id'),
+        {'sqlite_autoincrement': True},  # 压缩删除最新行后也不复用游标
+    )
+
+class ChangeLogWatermark(Base):
+    """每个用户已被压缩掉的删除记录的最大游标,更早的游标无法增量同步,客户端需要全量重新加载"""
+    __tablename__ = "change_log_watermarks"
+
+    user_id = Column(GUID, primary_key=True)  # 不使用外键
+    purged_through = Column(Integer, nullable=False, default=0)
+
+class AIJob(Base):
+    """AI后台任务表(完整AI分析等耗时请求异步执行)"""
+    __tablename__ = "ai_jobs"
+
+    id = Column(GUID, primary_key=True, default=generate_uuid)
+    user_id = Column(GUID, index=True)  # 不使用外键
+    job_type = Column(String, nullable=False, default="daily_plan")
+    params = Column(Text, nullable=False)  # JSON格式的请求参数
+    provider = Column(String, nullable=True)  # 用于按服务商限制并发, 无AI配置时为空
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, succeeded, failed
+    result = Column(Text, nullable=True)  # JSON格式的结果
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class AIUsage(Base):
+    """AI调用用量记录表(只追加)"""
+    __tablename__ = "ai_usage"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(GUID, nullable=True)  # 不使用外键
+    provider = Column(String, nullable=False)
+    model = Column(String, nullable=True)
+    feature = Column(String, nullable=True)  # 'plan_enhanced', 'plan_full', 'chat', 'chat_summary'
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    estimated = Column(Boolean, default=False)  # 服务商未返回usage时为本地估算值
+    latency_ms = Column(Integer, nullable=False, default=0)
+    outcome = Column(String, nullable=False)  # success, cache_hit, error, timeout, circuit_open, rate_limited, cancelled
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_ai_usage_created', 'created_at'),
+        Index('idx_ai_usage_user_created', 'user_id', 'created_at'),
+    )
+
+
+# --- 软删除 ---
+# 已标记删除的项目、任务以及它们的时间记录(含归档汇总)对所有 ORM 查询不可见(基于 deleted_at 索引),
+# 行本身由 services/purger.py 分批物理删除。需要读取已删除数据时使用
+# .execution_options(include_deleted=True)。
+_deleted_projects = select(Project.__table__.c.id).where(Project.__table__.c.deleted_at.isnot(None))
+_deleted_tasks = select(Task.__table__.c.id).where(Task.__table__.c.deleted_at.isnot(None))
+
+def _live_logs(cls):
+    """时间记录(及其按日汇总)所属的项目和任务都未被删除"""
+    return cls.project_id.notin_(_deleted_projects) & or_(
+        cls.task_id.is_(None), cls.task_id.notin_(_deleted_tasks)
+    )
+
+@event.listens_for(database.SessionLocal, "do_orm_execute")
+def _exclude_deleted(state):
+    if not state.is_select or state.is_column_load or state.execution_options.get("include_deleted"):
+        return
+    state.statement = state.statement.options(
+        with_loader_criteria(Project, Project.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(Task, Task.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(TimeLog, _live_logs, include_aliases=True),
+        with_loader_criteria(TimeLogDaily, _live_logs, include_aliases=True),
+    )
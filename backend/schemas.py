@@ -1,5 +1,5 @@
 import uuid
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Union
 from datetime import datetime, date
 
@@ -45,6 +45,7 @@ class TaskBase(BaseModel):
     title: str
     description: Optional[str] = None
     priority: str = "medium"
+    due_date: Optional[datetime] = None
 
 class TaskCreate(TaskBase):
     project_id: Union[str, uuid.UUID]
@@ -54,6 +55,7 @@ class TaskUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
     priority: Optional[str] = None
+    due_date: Optional[datetime] = None
 
 class Task(TaskBase):
     id: Union[str, uuid.UUID]
@@ -62,9 +64,67 @@ class Task(TaskBase):
     status: str
     created_at: datetime
     total_duration: int = 0
+    next_review_at: Optional[datetime] = None  # 下一次复习时间,未安排时为空
+    review_stage: int = 0
     
     model_config = ConfigDict(from_attributes=True)
 
+class ReviewResult(BaseModel):
+    remembered: bool = True  # false 时回到第一个复习间隔
+
+class TaskBatchOperation(BaseModel):
+    op_id: str  # 客户端生成的操作ID,重复提交时直接返回首次执行的结果
+    op: str  # 'create', 'update', 'status', 'delete'
+    task_id: Optional[str] = None  # update/status/delete 必填
+    data: Optional[dict] = None  # create: TaskCreate 字段; update: TaskUpdate 字段
+    status: Optional[str] = None  # status 操作的目标状态(pending/in_progress/completed 或 todo/done)
+
+class TaskBatchRequest(BaseModel):
+    operations: List[TaskBatchOperation] = Field(..., max_length=500)
+    atomic: bool = False  # 为 true 时任一操作失败则整批回滚
+
+class TaskBatchResult(BaseModel):
+    op_id: str
+    ok: bool
+    replayed: bool = False  # 该操作ID此前已执行过
+    task: Optional[dict] = None
+    error: Optional[str] = None
+
+class TaskBatchResponse(BaseModel):
+    committed: bool
+    results: List[TaskBatchResult]
+
+# --- Change Feed Schemas ---
+class ChangeEntry(BaseModel):
+    cursor: int  # 该实体最新一条变更记录的游标
+    entity: str  # project, task
+    id: str
+    op: str  # upsert, delete
+    data: Optional[dict] = None  # upsert 时为实体的当前状态(与列表接口的字段相同)
+
+class ChangeFeed(BaseModel):
+    changes: List[ChangeEntry]
+    cursor: int  # 下次请求的 since
+    has_more: bool
+    reset: bool = False  # 游标早于已压缩的记录,需要全量重新加载后从 cursor 继续
+
+# --- Search Schemas ---
+class SearchHit(BaseModel):
+    type: str  # task, project
+    id: str
+    title: str
+    description: Optional[str] = None
+    project_id: Optional[str] = None  # 仅任务
+    project_name: Optional[str] = None  # 仅任务
+    status: Optional[str] = None  # 仅任务
+    score: float
+
+class SearchResponse(BaseModel):
+    items: List[SearchHit]
+    limit: int
+    offset: int
+    has_more: bool
+
 # --- TimeLog Schemas ---
 class ManualTimeLog(BaseModel):
     duration: int
@@ -136,6 +196,11 @@ class DailyTrend(BaseModel):
     date: str  # 日期字符串，如 "2024-01-01"
     duration: int  # 时长（秒）
 
+class FocusHeatmap(BaseModel):
+    cells: List[List[int]]  # 7×24 学习秒数,行为周一至周日,列为0-23点
+    total_seconds: int = 0
+    tz_offset_minutes: int = 0  # 统计所用的时区(相对UTC的分钟数)
+
 class EnergyDistribution(BaseModel):
     id: str
     name: str
@@ -159,7 +224,7 @@ class EnergyDistribution(BaseModel):
 
 # --- AI Config Schemas ---
 class AIConfigBase(BaseModel):
-    provider: str  # 'deepseek', 'qwen', 'openai'
+    provider: str  # 'deepseek', 'qwen', 'openai', 'mock'
     api_key: str
     api_base: Optional[str] = None
     model: Optional[str] = None
@@ -213,3 +278,44 @@ class EnergySuggestion(BaseModel):
     actual: int
     status: str  # 'balanced', 'unbalanced'
     suggestion: str
+
+class AIJob(BaseModel):
+    id: str
+    job_type: str
+    status: str  # 'queued', 'running', 'succeeded', 'failed'
+    params: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+# --- AI Chat Schemas ---
+class ChatRequest(BaseModel):
+    message: str
+
+class ChatMessage(BaseModel):
+    id: int
+    role: str  # 'user', 'assistant'
+    content: str
+    created_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ChatReply(BaseModel):
+    reply: str
+    prompt_tokens: int  # 本地估算的提示词token数
+    context_turns: int  # 进入提示词的历史轮次数
+    summarized: bool  # 提示词是否包含历史摘要
+
+class AIUsageAggregate(BaseModel):
+    key: Optional[str] = None  # 分组键: 日期/服务商/模型/用户ID/功能
+    calls: int = 0
+    errors: int = 0
+    cache_hits: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    avg_latency_ms: int = 0
+    cost: float = 0.0  # 按 AI_PRICES 估算的费用
@@ -0,0 +1,172 @@
+"""
+大模型提示词/响应缓存
+以 (provider, model, messages, temperature, max_tokens) 的哈希为键,
+内存LRU作为一级缓存,SQLite文件作为持久化二级缓存,两级均按字节数淘汰。
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AI_CACHE_MEMORY_MB = float(os.getenv("AI_CACHE_MEMORY_MB", "16"))
+# 置空则只使用内存缓存
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", "./ai_cache.db")
+AI_CACHE_DISK_MB = float(os.getenv("AI_CACHE_DISK_MB", "256"))
+AI_CACHE_TTL_SECONDS = float(os.getenv("AI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def make_key(provider: str, model: str, messages: List[Dict[str, str]],
+             temperature: Any = None, max_tokens: Any = None, **extra) -> str:
+    """计算请求内容的哈希键(内容寻址)"""
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "extra": extra,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """两级(内存LRU + SQLite)响应缓存"""
+
+    def __init__(self, memory_max_bytes: int, disk_path: Optional[str], disk_max_bytes: int, ttl_seconds: float):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        self._disk = None
+        self._disk_bytes = 0
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache(accessed_at)")
+            self._disk.commit()
+            self._disk_bytes = self._disk.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                self._memory_pop(key)
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    self._disk.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._disk.commit()
+                    self._memory_put(key, row[0], row[1])
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self.stats["writes"] += 1
+            self._memory_put(key, value, now)
+            if self._disk is not None and size <= self.disk_max_bytes:
+                old = self._disk.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now)
+                )
+                self._disk_bytes += size - (old[0] if old else 0)
+                self._evict_disk()
+                self._disk.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM llm_cache")
+                self._disk.commit()
+                self._disk_bytes = 0
+
+    def _memory_put(self, key: str, value: str, created_at: float):
+        size = len(value.encode("utf-8"))
+        if size > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_pop(key)
+        self._memory[key] = (value, created_at)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes:
+            oldest = next(iter(self._memory))
+            self._memory_pop(oldest)
+            self.stats["evictions"] += 1
+
+    def _memory_pop(self, key: str):
+        value, _ = self._memory.pop(key)
+        self._memory_bytes -= len(value.encode("utf-8"))
+
+    def _evict_disk(self):
+        """按最近访问时间淘汰,直到低于容量的90%"""
+        if self._disk_bytes <= self.disk_max_bytes:
+            return
+        target = self.disk_max_bytes * 0.9
+        rows = self._disk.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if self._disk_bytes <= target:
+                break
+            self._disk.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._disk_bytes -= size
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+_cache: Optional[LLMCache] = None
+
+
+def get_cache() -> Optional[LLMCache]:
+    """获取全局缓存实例(未启用时返回None)"""
+    global _cache
+    if not AI_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = LLMCache(
+            memory_max_bytes=int(AI_CACHE_MEMORY_MB * 1024 * 1024),
+            disk_path=AI_CACHE_PATH or None,
+            disk_max_bytes=int(AI_CACHE_DISK_MB * 1024 * 1024),
+            ttl_seconds=AI_CACHE_TTL_SECONDS,
+        )
+    return _cache
@@ -0,0 +1,238 @@
+"""
+AI对话式规划服务
+对话轮次保存在 ai_conversations 表中;每次请求在token预算内构建提示词:
+系统提示 + 学习数据快照 + 历史摘要 + 最近的若干轮对话(滑动窗口)。
+未摘要的轮次过多时,在后台把较早的轮次滚动合并进摘要,保证提示词长度与延迟有上限。
+"""
+import os
+import json
+import asyncio
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+
+import database
+import models
+from services import ai_service
+from services.ai_planning import get_active_ai_config
+
+
+# 提示词(不含回复)的token预算
+AI_CHAT_TOKEN_BUDGET = int(os.getenv("AI_CHAT_TOKEN_BUDGET", "3000"))
+AI_CHAT_MAX_REPLY_TOKENS = int(os.getenv("AI_CHAT_MAX_REPLY_TOKENS", "600"))
+# 未摘要的轮次超过该数量时触发滚动摘要
+AI_CHAT_SUMMARY_TRIGGER = int(os.getenv("AI_CHAT_SUMMARY_TRIGGER", "16"))
+# 滚动摘要后保留原文的最近轮次数
+AI_CHAT_KEEP_TURNS = int(os.getenv("AI_CHAT_KEEP_TURNS", "6"))
+AI_CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("AI_CHAT_SUMMARY_MAX_TOKENS", "400"))
+
+SYSTEM_PROMPT = "你是学习规划助手。结合用户的学习数据和对话上下文,给出简洁、可执行的建议。"
+
+# 正在进行滚动摘要的用户,避免并发重复摘要
+_summarizing = set()
+
+
+class ChatNotConfigured(Exception):
+    """用户没有激活的AI配置"""
+
+
+def _latest_summary(db: Session, user_id: str) -> Optional[Dict[str, Any]]:
+    row = db.query(models.AIConversation).filter(
+        models.AIConversation.user_id == str(user_id),
+        models.AIConversation.role == 'summary'
+    ).order_by(models.AIConversation.id.desc()).first()
+    return json.loads(row.content) if row else None
+
+
+def _unsummarized_query(db: Session, user_id: str, through_id: int):
+    return db.query(models.AIConversation).filter(
+        models.AIConversation.user_id == str(user_id),
+        models.AIConversation.role.in_(['user', 'assistant']),
+        models.AIConversation.id > through_id
+    )
+
+
+def _study_context(db: Session, user_id: str) -> str:
+    """最近7天各项目的目标/实际精力占比,作为对话的背景数据"""
+    projects = db.query(models.Project).options(
+        selectinload(models.Project.budgets)
+    ).filter(models.Project.user_id == user_id).all()
+
+    start_date = date.today() - timedelta(days=7)
+    project_times = dict(db.query(
+        models.TimeLog.project_id,
+        func.sum(models.TimeLog.duration_seconds)
+    ).filter(
+        models.TimeLog.user_id == user_id,
+        models.TimeLog.log_date >= start_date
+    ).group_by(models.TimeLog.project_id).all())
+    total_time = sum(v or 0 for v in project_times.values()) or 1
+
+    items = []
+    for project in projects:
+        budget = [b for b in project.budgets if b.valid_to is None]
+        target = budget[0].target_percentage if budget else 0
+        actual = int((project_times.get(project.id) or 0) / total_time * 100)
+        items.append({'项目': project.name, '目标%': target, '实际%': actual})
+    return json.dumps(items, ensure_ascii=False)
+
+
+def build_chat_messages(db: Session, user_id: str, message: Optional[str] = None, budget: int = AI_CHAT_TOKEN_BUDGET):
+    """在token预算内构建对话提示词
+
+    message 为尚未保存的本轮用户消息,总是放在最后。
+
+    Returns:
+        (messages, 估算token数, 进入提示词的历史轮次数, 是否包含摘要)
+    """
+    system = f"{SYSTEM_PROMPT}\n【最近7天精力分配】\n{_study_context(db, user_id)}"
+    summary = _latest_summary(db, user_id)
+    if summary:
+        system += f"\n【此前对话摘要】\n{summary['text']}"
+
+    head = [{"role": "system", "content": system}]
+    used = ai_service.estimate_messages_tokens(head)
+
+    # 从最新一轮开始向前取,直到预算用尽(最新的用户消息总是保留)
+    turns: List[Dict[str, str]] = []
+    if message is not None:
+        turns.append({"role": "user", "content": message})
+        used += ai_service.estimate_messages_tokens(turns)
+    rows = _unsummarized_query(db, user_id, summary['through_id'] if summary else 0)\
+        .order_by(models.AIConversation.id.desc()).all()
+    for row in rows:
+        turn = {"role": row.role, "content": row.content}
+        cost = ai_service.estimate_messages_tokens([turn])
+        if turns and used + cost > budget:
+            break
+        turns.append(turn)
+        used += cost
+    turns.reverse()
+
+    # 提示词不能以assistant消息开头
+    while turns and turns[0]["role"] != "user":
+        used -= ai_service.estimate_messages_tokens([turns.pop(0)])
+
+    return head + turns, used, len(turns), summary is not None
+
+
+async def chat(db: Session, user_id: str, message: str) -> Dict[str, Any]:
+    """发送一条对话消息并返回AI回复
+
+    用户消息与回复在收到回复后一起保存;调用失败或超时时两者都不保存,不会留下没有回复的轮次。
+    """
+    config = await get_active_ai_config(db, user_id)
+    if not config:
+        raise ChatNotConfigured("未配置AI")
+
+    messages, prompt_tokens, context_turns, summarized = build_chat_messages(db, user_id, message)
+
+    service = ai_service.get_ai_service(
+        config['provider'],
+        config['api_key'],
+        config['api_base'],
+        config['model'],
+        user_id=user_id,
+        feature='chat'
+    )
+    try:
+        reply = await service.chat(messages, temperature=0.7, max_tokens=AI_CHAT_MAX_REPLY_TOKENS)
+    finally:
+        await service.close()
+
+    db.add_all([
+        models.AIConversation(user_id=str(user_id), role='user', content=message),
+        models.AIConversation(user_id=str(user_id), role='assistant', content=reply)
+    ])
+    db.commit()
+
+    schedule_summary(db, user_id, config)
+
+    return {
+        'reply': reply,
+        'prompt_tokens': prompt_tokens,
+        'context_turns': context_turns,
+        'summarized': summarized
+    }
+
+
+def schedule_summary(db: Session, user_id: str, config: Dict[str, Any]):
+    """未摘要轮次超过阈值时在后台滚动摘要,不阻塞当前回复"""
+    summary = _latest_summary(db, user_id)
+    pending = _unsummarized_query(db, user_id, summary['through_id'] if summary else 0).count()
+    if pending > AI_CHAT_SUMMARY_TRIGGER and str(user_id) not in _summarizing:
+        _summarizing.add(str(user_id))
+        asyncio.ensure_future(_roll_summary(str(user_id), config))
+
+
+async def _roll_summary(user_id: str, config: Dict[str, Any]):
+    """把较早的轮次与已有摘要合并为新的摘要"""
+    db = database.SessionLocal()
+    try:
+        summary = _latest_summary(db, user_id)
+        rows = _unsummarized_query(db, user_id, summary['through_id'] if summary else 0)\
+            .order_by(models.AIConversation.id).all()
+        to_fold = rows[:-AI_CHAT_KEEP_TURNS] if len(rows) > AI_CHAT_KEEP_TURNS else []
+        if not to_fold:
+            return
+
+        transcript = "\n".join(
+            f"{'用户' if r.role == 'user' else '助手'}: {r.content}" for r in to_fold
+        )
+        prompt = (
+            f"已有摘要:\n{summary['text'] if summary else '(无)'}\n\n"
+            f"新增对话:\n{transcript}\n\n"
+            f"请合并为一段不超过300字的摘要,保留用户的目标、约束和已达成的结论。"
+        )
+
+        service = ai_service.get_ai_service(
+            config['provider'],
+            config['api_key'],
+            config['api_base'],
+            config['model'],
+            user_id=user_id,
+            feature='chat_summary'
+        )
+        try:
+            text = await service.chat(
+                [
+                    {"role": "system", "content": "你负责压缩对话历史,只输出摘要正文。"},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=AI_CHAT_SUMMARY_MAX_TOKENS
+            )
+        finally:
+            await service.close()
+
+        db.add(models.AIConversation(
+            user_id=user_id,
+            role='summary',
+            content=json.dumps({'through_id': to_fold[-1].id, 'text': text.strip()}, ensure_ascii=False)
+        ))
+        db.commit()
+        print(f"[AI对话] 已将 {len(to_fold)} 轮对话合并进摘要")
+    except Exception as e:
+        print(f"[AI对话] 滚动摘要失败: {e}")
+    finally:
+        _summarizing.discard(user_id)
+        db.close()
+
+
+def get_history(db: Session, user_id: str, limit: int = 50) -> List[models.AIConversation]:
+    """最近的对话记录(按时间正序,不含摘要)"""
+    rows = db.query(models.AIConversation).filter(
+        models.AIConversation.user_id == str(user_id),
+        models.AIConversation.role.in_(['user', 'assistant'])
+    ).order_by(models.AIConversation.id.desc()).limit(limit).all()
+    return list(reversed(rows))
+
+
+def clear_history(db: Session, user_id: str) -> int:
+    deleted = db.query(models.AIConversation).filter(
+        models.AIConversation.user_id == str(user_id)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
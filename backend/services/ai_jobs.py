@@ -0,0 +1,276 @@
+"""
+AI后台任务队列
+完整AI分析耗时较长,接口只负责入队并返回任务ID,由工作协程池异步执行。
+任务持久化在 ai_jobs 表中:工作协程通过条件更新抢占任务,因此既可以在API进程内运行,
+也可以通过 ai_worker.py 在独立进程中运行;服务重启后未完成的任务会被重新执行。
+按服务商的并发上限(AI_JOBS_PROVIDER_CONCURRENCY / AI_JOBS_PROVIDER_LIMITS)按进程内存中的计数执行,
+只限制单个进程;多个工作进程时总并发为上限乘以进程数。
+"""
+import os
+import json
+import asyncio
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+import database
+import models
+from services import ai_planning
+
+
+AI_JOBS_INPROCESS = os.getenv("AI_JOBS_INPROCESS", "true").lower() in ("1", "true", "yes")
+AI_JOBS_WORKERS = int(os.getenv("AI_JOBS_WORKERS", "4"))
+# 每个服务商同时执行的任务数上限,可按服务商覆盖: "deepseek=2,qwen=1"
+AI_JOBS_PROVIDER_CONCURRENCY = int(os.getenv("AI_JOBS_PROVIDER_CONCURRENCY", "2"))
+AI_JOBS_PROVIDER_LIMITS = os.getenv("AI_JOBS_PROVIDER_LIMITS", "")
+# 没有新任务时的轮询间隔(秒),用于发现其他进程提交的任务
+AI_JOBS_POLL_SECONDS = float(os.getenv("AI_JOBS_POLL_SECONDS", "1"))
+# 执行中的任务超过该时长视为工作进程已退出,重新入队
+AI_JOBS_LEASE_SECONDS = float(os.getenv("AI_JOBS_LEASE_SECONDS", "300"))
+AI_JOBS_MAX_ATTEMPTS = int(os.getenv("AI_JOBS_MAX_ATTEMPTS", "3"))
+# 回收过期租约的间隔: 由一个协程执行,不在每个工作协程的每次轮询中执行
+AI_JOBS_RECOVER_SECONDS = AI_JOBS_LEASE_SECONDS / 10
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+def _parse_provider_limits(raw: str) -> Dict[str, int]:
+    limits = {}
+    for item in raw.split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            limits[name.strip().lower()] = int(value)
+    return limits
+
+
+def job_to_dict(job: models.AIJob) -> Dict[str, Any]:
+    """转换为接口返回格式"""
+    return {
+        "id": str(job.id),
+        "job_type": job.job_type,
+        "status": job.status,
+        "params": json.loads(job.params) if job.params else {},
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "attempts": job.attempts or 0,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def submit_plan_job(db: Session, user_id: str, period: str, use_ai) -> models.AIJob:
+    """提交学习计划生成任务"""
+    config = db.query(models.AIConfig).filter(
+        models.AIConfig.user_id == str(user_id),
+        models.AIConfig.is_active == True
+    ).first()
+
+    job = models.AIJob(
+        user_id=str(user_id),
+        job_type="daily_plan",
+        params=json.dumps({"period": period, "use_ai": use_ai}),
+        provider=config.provider.lower() if config and use_ai else None,
+        status="queued"
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    runner.notify()
+    return job
+
+
+def get_job(db: Session, job_id: str, user_id: str) -> Optional[models.AIJob]:
+    return db.query(models.AIJob).filter(
+        models.AIJob.id == job_id,
+        models.AIJob.user_id == str(user_id)
+    ).first()
+
+
+class JobRunner:
+    """基于数据库抢占的工作协程池"""
+
+    def __init__(self, workers: int, provider_concurrency: int, provider_limits: Dict[str, int]):
+        self.workers = workers
+        self.provider_concurrency = provider_concurrency
+        self.provider_limits = provider_limits
+        self.running: Dict[str, int] = {}  # 本进程内各服务商执行中的任务数
+        self._tasks = []
+        self._recovery: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # 只被等待中的请求引用,全部等待结束(完成或超时)后条目自动移除
+        self._finished: "weakref.WeakValueDictionary[str, asyncio.Event]" = weakref.WeakValueDictionary()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+        self._recovery = asyncio.ensure_future(self._recover_periodically())
+        print(f"[AI任务] 已启动 {self.workers} 个工作协程")
+
+    async def stop(self):
+        tasks = self._tasks + ([self._recovery] if self._recovery else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._recovery = None
+
+    def notify(self):
+        """有新任务入队时唤醒空闲的工作协程"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_finished(self, job_id: str, timeout: float) -> bool:
+        """等待本进程内的任务完成通知;超时返回False(调用方应回查数据库)"""
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _limit(self, provider: str) -> int:
+        return self.provider_limits.get(provider, self.provider_concurrency)
+
+    def _saturated_providers(self):
+        return [p for p, count in self.running.items() if count >= self._limit(p)]
+
+    def recover_expired(self, db: Session) -> int:
+        """把租约过期的执行中任务重新入队(超过最大尝试次数则标记失败)
+
+        没有过期任务时只执行一次查询,不开启写事务。
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=AI_JOBS_LEASE_SECONDS)
+        expired = db.query(models.AIJob).filter(
+            models.AIJob.status == "running",
+            models.AIJob.started_at < cutoff
+        )
+        if not db.query(expired.exists()).scalar():
+            return 0
+        failed = expired.filter(models.AIJob.attempts >= AI_JOBS_MAX_ATTEMPTS).update(
+            {"status": "failed", "error": "任务执行超时", "finished_at": datetime.now(timezone.utc)},
+            synchronize_session=False
+        )
+        requeued = expired.filter(models.AIJob.attempts < AI_JOBS_MAX_ATTEMPTS).update(
+            {"status": "queued"}, synchronize_session=False
+        )
+        if failed or requeued:
+            db.commit()
+        else:
+            db.rollback()
+        return failed + requeued
+
+    def claim_next(self, db: Session, saturated=None) -> Optional[models.AIJob]:
+        """抢占最早的可执行任务(跳过已达并发上限的服务商)
+
+        在线程池中调用时由调用方传入 saturated,避免在其他线程读取 self.running。
+        """
+        query = db.query(models.AIJob.id).filter(models.AIJob.status == "queued")
+        if saturated is None:
+            saturated = self._saturated_providers()
+        if saturated:
+            query = query.filter(
+                (models.AIJob.provider == None) | (models.AIJob.provider.notin_(saturated))
+            )
+
+        for (job_id,) in query.order_by(models.AIJob.created_at, models.AIJob.id).limit(self.workers).all():
+            claimed = db.query(models.AIJob).filter(
+                models.AIJob.id == job_id,
+                models.AIJob.status == "queued"
+            ).update({
+                "status": "running",
+                "started_at": datetime.now(timezone.utc),
+                "attempts": models.AIJob.attempts + 1
+            }, synchronize_session=False)
+            if claimed:
+                db.commit()
+                return db.query(models.AIJob).filter(models.AIJob.id == job_id).first()
+            # 已被其他工作协程抢占
+            db.rollback()
+        return None
+
+    def _recover_once(self) -> int:
+        db = database.SessionLocal()
+        try:
+            return self.recover_expired(db)
+        finally:
+            db.close()
+
+    async def _recover_periodically(self):
+        """每 AI_JOBS_RECOVER_SECONDS 回收一次过期租约(在线程池中执行)"""
+        while True:
+            try:
+                if await asyncio.to_thread(self._recover_once):
+                    self.notify()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[AI任务] 回收过期任务失败: {e}")
+            await asyncio.sleep(AI_JOBS_RECOVER_SECONDS)
+
+    async def _worker(self, index: int):
+        while True:
+            job = None
+            db = database.SessionLocal()
+            try:
+                job = await asyncio.to_thread(self.claim_next, db, self._saturated_providers())
+                if job is not None:
+                    await self._run(db, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[AI任务] 工作协程{index}异常: {e}")
+            finally:
+                db.close()
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=AI_JOBS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _run(self, db: Session, job: models.AIJob):
+        provider = job.provider
+        if provider:
+            self.running[provider] = self.running.get(provider, 0) + 1
+        try:
+            params = json.loads(job.params)
+            result = await ai_planning.generate_daily_plan(
+                db, job.user_id, params.get("period", "today"), use_ai=params.get("use_ai", False)
+            )
+            if "error" in result:
+                job.status = "failed"
+                job.error = result["error"]
+            else:
+                job.status = "succeeded"
+                job.result = json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            if provider:
+                self.running[provider] -= 1
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            self.notify()
+            event = self._finished.pop(str(job.id), None)
+            if event is not None:
+                event.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "running": dict(self.running),
+        }
+
+
+runner = JobRunner(
+    AI_JOBS_WORKERS,
+    AI_JOBS_PROVIDER_CONCURRENCY,
+    _parse_provider_limits(AI_JOBS_PROVIDER_LIMITS)
+)
@@ -2,18 +2,25 @@
 AI规划服务 - 使用AI生成学习建议和任务推荐
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import func, cast, String
+from sqlalchemy import func
 from services import ai_service
+from services.singleflight import SingleFlight
+import crud
 import models
-from datetime import date, timedelta, datetime
+from datetime import date, timedelta, datetime, timezone
 from typing import List, Dict, Any
+import hashlib
 import json
 
 
+# 合并并发的相同AI规划请求(多标签页/前端重试),每个不同请求只调用一次大模型
+_plan_flights = SingleFlight()
+
+
 async def get_active_ai_config(db: Session, user_id: str) -> Dict[str, Any]:
     """获取用户激活的AI配置"""
     config = db.query(models.AIConfig).filter(
-        cast(models.AIConfig.user_id, String) == str(user_id),
+        models.AIConfig.user_id == str(user_id),
         models.AIConfig.is_active == True
     ).first()
 
@@ -28,7 +35,38 @@ async def get_active_ai_config(db: Session, user_id: str) -> Dict[str, Any]:
     }
 
 
-async def generate_daily_plan(db: Session, user_id: str, period: str = "today", use_ai: str = "false") -> Dict[str, Any]:
+def plan_fingerprint(projects, project_times, pending_tasks, config) -> str:
+    """计算规划输入数据的指纹
+
+    项目、预算、时间投入、待办任务和AI配置完全相同的请求会得到相同的提示词,
+    可以共享同一次AI调用。
+    """
+    project_items = []
+    for project in projects:
+        budget = None
+        if hasattr(project, 'budgets') and project.budgets:
+            budget = [b for b in project.budgets if b.valid_to is None]
+            budget = budget[0] if budget else None
+        project_items.append([str(project.id), project.name, budget.target_percentage if budget else None])
+
+    payload = {
+        'projects': project_items,
+        'times': sorted([str(pid), seconds] for pid, seconds in project_times.items()),
+        'tasks': [[str(t.id), t.title, t.priority, str(t.project_id)] for t in pending_tasks],
+        'ai': [config['provider'], config['model'], config['api_base']] if config else None
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def end_of_today() -> datetime:
+    """本地时间今天结束的时刻(UTC),用作预生成计划的过期时间"""
+    tomorrow = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    return tomorrow.astimezone(timezone.utc)
+
+
+async def generate_daily_plan(db: Session, user_id: str, period: str = "today", use_ai: str = "false",
+                              use_cache: bool = True) -> Dict[str, Any]:
     """生成今日学习计划
 
     Args:
@@ -39,8 +77,17 @@ async def generate_daily_plan(db: Session, user_id: str, period: str = "today",
             - "false": 快速模式,纯规则引擎 (<0.1秒)
             - "enhanced": AI增强模式,规则引擎+AI优化推荐理由 (~2秒)
             - "full": AI完整分析,AI生成所有数据 (~20秒)
+        use_cache: 是否读取预生成/已缓存的AI计划(数据变化后自动失效)
     """
 
+    # 先读取数据版本,保证缓存的计划不会比其依赖的数据更新
+    data_version = crud.get_data_version(db, user_id)
+    if use_cache and use_ai and use_ai != "false":
+        cached_plan = crud.get_cached_plan(db, user_id, period, use_ai)
+        if cached_plan is not None:
+            print(f"[AI规划] 命中预生成计划缓存")
+            return cached_plan
+
     # 获取用户的项目和任务数据（包含预算信息）
     from sqlalchemy.orm import selectinload
     projects = db.query(models.Project).options(
@@ -92,18 +139,35 @@ async def generate_daily_plan(db: Session, user_id: str, period: str = "today",
     rule_based_result = generate_rule_based_plan(projects, project_times, total_time, pending_tasks)
     print(f"[AI规划] 规则引擎已生成计划, 耗时 <0.1秒")
 
+    # 服务商熔断中:不再等待注定失败的AI调用,直接返回规则引擎结果
+    if use_ai and not ai_service.is_provider_available(config['provider']):
+        print(f"[AI规划] {config['provider']} 熔断中,直接使用规则引擎结果")
+        return rule_based_result
+
     # 如果用户请求AI完整分析,则调用AI
     if use_ai and rule_based_result.get('recommendations'):
         try:
             print(f"[AI规划] 用户请求AI完整分析模式,启用AI...")
-            ai_enhanced_result = await enhance_with_ai(
-                rule_based_result,
-                projects,
-                project_times,
-                total_time,
-                pending_tasks,
-                config
+            flight_key = (
+                str(user_id),
+                period,
+                str(use_ai),
+                plan_fingerprint(projects, project_times, pending_tasks, config)
+            )
+            ai_enhanced_result = await _plan_flights.do(
+                flight_key,
+                lambda: enhance_with_ai(
+                    rule_based_result,
+                    projects,
+                    project_times,
+                    total_time,
+                    pending_tasks,
+                    config,
+                    user_id=user_id
+                )
             )
+            if ai_enhanced_result.get('note') == '规则引擎 + AI优化':
+                crud.save_cached_plan(db, user_id, period, use_ai, ai_enhanced_result, data_version, end_of_today())
             return ai_enhanced_result
         except Exception as e:
             print(f"[AI规划] AI分析失败,降级使用规则引擎结果: {e}")
@@ -277,7 +341,8 @@ def generate_rule_based_plan(projects, project_times, total_time, pending_tasks)
     }
 
 
-async def enhance_with_ai(rule_result, projects, project_times, total_time, pending_tasks, config) -> Dict[str, Any]:
+async def enhance_with_ai(rule_result, projects, project_times, total_time, pending_tasks, config,
+                          user_id: str = None) -> Dict[str, Any]:
     """使用AI优化规则引擎生成的结果"""
 
     # 如果没有推荐任务,直接返回规则结果
@@ -301,7 +366,9 @@ async def enhance_with_ai(rule_result, projects, project_times, total_time, pend
             config['provider'],
             config['api_key'],
             config['api_base'],
-            config['model']
+            config['model'],
+            user_id=user_id,
+            feature='plan_enhanced'
         )
 
         messages = [
@@ -418,16 +485,11 @@ async def get_energy_warnings(db: Session, user_id: str) -> List[Dict[str, Any]]
     warnings = []
 
     for project in projects:
-        # 获取目标精力
-        budget = db.query(models.ProjectBudget).filter(
-            models.ProjectBudget.project_id == project.id,
-            models.ProjectBudget.valid_to == None
-        ).first()
-
-        if not budget:
+        # 目标精力读取项目上维护的当前预算
+        if project.current_target_percentage is None:
             continue
 
-        target_percent = budget.target_percentage
+        target_percent = project.current_target_percentage
 
         # 计算实际投入
         actual_seconds = db.query(func.sum(models.TimeLog.duration_seconds)).filter(
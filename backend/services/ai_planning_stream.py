@@ -5,8 +5,23 @@ AI规划服务 - 流式输出版本
 from sqlalchemy.orm import Session
 from typing import AsyncGenerator
 import json
+import crud
 import models
-from services import ai_planning
+from services import ai_planning, ai_service
+from services.singleflight import StreamSingleFlight
+from services.json_stream import MalformedField, TopLevelFieldParser
+
+
+# 合并并发的相同流式规划请求,多个SSE订阅者共享同一条进度流
+_stream_flights = StreamSingleFlight()
+
+# AI完整分析模式下逐字段推送的顶层字段
+STREAM_FIELDS = ('warnings', 'recommendations', 'energySuggestions', 'dailyTips')
+
+
+def sse_event(event: str, data: dict):
+    """生成SSE事件格式"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 async def generate_daily_plan_stream(
@@ -27,11 +42,7 @@ async def generate_daily_plan_stream(
         SSE格式的数据流
     """
 
-    def sse_event(event: str, data: dict):
-        """生成SSE事件格式"""
-        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
-
-    # 1. 立即返回规则引擎的基础数据
+    # 1. 在请求上下文中加载全部输入数据,事件流本身不再访问数据库
     try:
         # 查询项目时预加载预算信息
         from sqlalchemy.orm import selectinload
@@ -67,6 +78,50 @@ async def generate_daily_plan_stream(
             models.Task.status.in_(['todo', 'pending'])
         ).all()
 
+        config = None
+        if use_ai != "false":
+            config = await ai_planning.get_active_ai_config(db, user_id)
+
+        # AI增强模式优先使用预生成的计划
+        if use_ai == "enhanced":
+            cached_plan = crud.get_cached_plan(db, user_id, period, use_ai)
+            if cached_plan is not None:
+                yield sse_event("init", {
+                    "message": "基础数据已加载",
+                    "data": cached_plan
+                })
+                yield sse_event("complete", {
+                    "message": "已加载预生成的计划",
+                    "mode": "规则引擎 + AI增强"
+                })
+                return
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield sse_event("error", {
+            "message": f"生成失败: {str(e)}"
+        })
+        return
+
+    # 2. 相同输入的并发请求订阅同一条事件流
+    flight_key = (
+        str(user_id),
+        period,
+        use_ai,
+        ai_planning.plan_fingerprint(projects, project_times, pending_tasks, config)
+    )
+    async for chunk in _stream_flights.subscribe(
+        flight_key,
+        lambda: _plan_events(projects, project_times, total_time, pending_tasks, use_ai, config, user_id)
+    ):
+        yield chunk
+
+
+async def _plan_events(projects, project_times, total_time, pending_tasks, use_ai, config,
+                       user_id: str = None) -> AsyncGenerator[str, None]:
+    """根据已加载的数据生成规划事件流"""
+    try:
         # 生成规则引擎数据
         rule_result = ai_planning.generate_rule_based_plan(
             projects, project_times, total_time, pending_tasks
@@ -87,7 +142,6 @@ async def generate_daily_plan_stream(
             return
 
         # 如果需要AI,开始流式输出
-        config = await ai_planning.get_active_ai_config(db, user_id)
         if not config:
             yield sse_event("warning", {
                 "message": "未配置AI,使用规则引擎结果"
@@ -95,6 +149,14 @@ async def generate_daily_plan_stream(
             yield sse_event("complete", {"mode": "规则引擎"})
             return
 
+        # 服务商熔断中,直接使用规则引擎结果
+        if not ai_service.is_provider_available(config['provider']):
+            yield sse_event("warning", {
+                "message": "AI服务暂时不可用,使用规则引擎结果"
+            })
+            yield sse_event("complete", {"mode": "规则引擎"})
+            return
+
         # AI增强模式 - 只优化推荐理由
         if use_ai == "enhanced" and rule_result.get('recommendations'):
             yield sse_event("progress", {
@@ -104,7 +166,7 @@ async def generate_daily_plan_stream(
 
             enhanced_result = await ai_planning.enhance_with_ai(
                 rule_result, projects, project_times, total_time,
-                pending_tasks, config
+                pending_tasks, config, user_id=user_id
             )
 
             yield sse_event("update", {
@@ -138,13 +200,14 @@ async def generate_daily_plan_stream(
 
             # 调用AI生成
             import time
-            from services import ai_service
 
             service = ai_service.get_ai_service(
                 config['provider'],
                 config['api_key'],
                 config['api_base'],
-                config['model']
+                config['model'],
+                user_id=user_id,
+                feature='plan_full'
             )
 
             messages = [
@@ -152,58 +215,35 @@ async def generate_daily_plan_stream(
                 {"role": "user", "content": prompt}
             ]
 
+            # 边接收边解析:每个顶层字段的值完整后立即增强并推送
             start_time = time.time()
-            response = await service.chat(messages, temperature=0.3)
+            parser = TopLevelFieldParser()
+            try:
+                async for chunk in service.chat_stream(messages, temperature=0.3):
+                    for field, value in parser.feed(chunk):
+                        if field not in STREAM_FIELDS:
+                            continue
+                        if isinstance(value, MalformedField):
+                            # 单个字段格式错误时跳过该字段并提示,不影响其余字段
+                            yield sse_event("field_error", {
+                                "field": field,
+                                "message": f"{field} 解析失败,已跳过"
+                            })
+                            continue
+                        fragment = ai_planning._enhance_ai_result(
+                            {field: value}, projects, project_times, total_time
+                        )
+                        if fragment.get(field):
+                            yield sse_event("update", {
+                                "field": field,
+                                "data": fragment[field]
+                            })
+            finally:
+                await service.close()
             elapsed = time.time() - start_time
 
-            # 解析AI响应
-            cleaned_response = response.strip()
-            if cleaned_response.startswith('```json'):
-                cleaned_response = cleaned_response[7:]
-            elif cleaned_response.startswith('```'):
-                cleaned_response = cleaned_response[3:]
-            if cleaned_response.endswith('```'):
-                cleaned_response = cleaned_response[:-3]
-            cleaned_response = cleaned_response.strip()
-
-            ai_result = json.loads(cleaned_response)
-            await service.close()
-
-            yield sse_event("progress", {
-                "message": "AI分析完成,正在处理结果...",
-                "step": "processing",
-                "progress": 80
-            })
-
-            # 增强AI结果
-            enhanced_result = ai_planning._enhance_ai_result(
-                ai_result, projects, project_times, total_time
-            )
-
-            # 分块发送更新
-            if enhanced_result.get('warnings'):
-                yield sse_event("update", {
-                    "field": "warnings",
-                    "data": enhanced_result['warnings']
-                })
-
-            if enhanced_result.get('recommendations'):
-                yield sse_event("update", {
-                    "field": "recommendations",
-                    "data": enhanced_result['recommendations']
-                })
-
-            if enhanced_result.get('energySuggestions'):
-                yield sse_event("update", {
-                    "field": "energySuggestions",
-                    "data": enhanced_result['energySuggestions']
-                })
-
-            if enhanced_result.get('dailyTips'):
-                yield sse_event("update", {
-                    "field": "dailyTips",
-                    "data": enhanced_result['dailyTips']
-                })
+            if not parser.done:
+                raise ValueError("AI返回的JSON不完整")
 
             yield sse_event("complete", {
                 "message": f"AI完整分析完成 (耗时{elapsed:.1f}秒)",
@@ -4,32 +4,543 @@ AI服务集成模块
 """
 import os
 import json
+import time
+import random
+import asyncio
+import hashlib
 import httpx
-from typing import List, Dict, Any, Optional
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncGenerator
 from datetime import datetime, timedelta
+from services import ai_cache, ai_usage
+
+
+# --- 超时、重试与熔断配置 ---
+# 单次请求的总时间预算(秒),包含所有重试与退避等待
+AI_REQUEST_DEADLINE = float(os.getenv("AI_REQUEST_DEADLINE", "30"))
+# 可重试错误的最大重试次数
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+# 指数退避的基础间隔与上限(秒),实际等待时间在 [0, 上限] 内随机抖动
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "4"))
+# 连续失败多少次后熔断,以及熔断后多久允许试探请求
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("AI_BREAKER_FAILURE_THRESHOLD", "5"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# --- 限流配置(按 服务商 + API Key 计) ---
+# 每分钟请求数与每分钟token数上限,可按服务商覆盖: "deepseek=60/100000,qwen=30/60000"
+AI_RATE_LIMIT_RPM = float(os.getenv("AI_RATE_LIMIT_RPM", "60"))
+AI_RATE_LIMIT_TPM = float(os.getenv("AI_RATE_LIMIT_TPM", "100000"))
+AI_RATE_LIMITS = os.getenv("AI_RATE_LIMITS", "")
+# 请求在限流队列中最多等待的时间(秒),超过则直接拒绝
+AI_RATE_LIMIT_MAX_WAIT = float(os.getenv("AI_RATE_LIMIT_MAX_WAIT", "10"))
+# 未指定 max_tokens 时预估的输出token数
+AI_RATE_LIMIT_DEFAULT_COMPLETION_TOKENS = int(os.getenv("AI_RATE_LIMIT_DEFAULT_COMPLETION_TOKENS", "1000"))
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态,请求被直接拒绝"""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"AI provider '{provider}' circuit is open, retry in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """按服务商统计连续失败次数的熔断器
+
+    closed: 正常放行; open: 直接拒绝,直到冷却结束;
+    half_open: 冷却结束后只放行一个试探请求,成功则关闭,失败则重新打开。
+    """
+
+    def __init__(self, provider: str, failure_threshold: int, reset_seconds: float):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.stats = {"requests": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0}
+
+    def retry_in(self) -> float:
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def is_available(self) -> bool:
+        """当前是否可能放行请求(不占用试探名额)"""
+        if self.state == "open":
+            return self.retry_in() <= 0
+        if self.state == "half_open":
+            return not self.trial_in_flight
+        return True
+
+    def acquire(self):
+        """请求前调用,熔断时抛出 CircuitOpenError"""
+        if self.state == "open" and self.retry_in() <= 0:
+            self.state = "half_open"
+            self.trial_in_flight = False
+        if self.state == "open" or (self.state == "half_open" and self.trial_in_flight):
+            self.stats["rejected"] += 1
+            raise CircuitOpenError(self.provider, self.retry_in() or self.reset_seconds)
+        if self.state == "half_open":
+            self.trial_in_flight = True
+        self.stats["requests"] += 1
+
+    def record_success(self):
+        self.stats["successes"] += 1
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def release(self):
+        """请求以不计入健康状态的方式结束(如参数错误)时释放试探名额"""
+        self.trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": "half_open" if self.state == "open" and self.retry_in() <= 0 else self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": round(self.retry_in(), 1),
+            **self.stats
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+class RateLimitExceeded(Exception):
+    """限流队列等待超过允许时间,请求被拒绝"""
+
+    def __init__(self, name: str, wait: float):
+        super().__init__(f"AI rate limit for '{name}' would require waiting {wait:.1f}s")
+        self.name = name
+        self.wait = wait
+
+
+def estimate_tokens(text: str) -> int:
+    """本地粗略估算token数: 中日韩字符约1字符1token,其他文本约4字符1token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算消息列表的提示词token数(每条消息另计约4个格式token)"""
+    return sum(estimate_tokens(m.get("content", "")) + 4 for m in messages)
+
+
+class TokenBucketLimiter:
+    """每分钟请求数 + 每分钟token数的双令牌桶,等待者按到达顺序(FIFO)放行"""
+
+    def __init__(self, name: str, rpm: float, tpm: float):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = rpm
+        self._tokens = tpm
+        self._updated_at = time.monotonic()
+        self._queue = deque()
+        self._cond = asyncio.Condition()
+        self.stats = {"acquired": 0, "rejected": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def _time_until_available(self, cost: float) -> float:
+        need_requests = max(0.0, 1 - self._requests) * 60.0 / self.rpm
+        need_tokens = max(0.0, cost - self._tokens) * 60.0 / self.tpm
+        return max(need_requests, need_tokens)
+
+    async def acquire(self, tokens: int, max_wait: float):
+        """排队获取一次请求额度;预计等待超过 max_wait 时抛出 RateLimitExceeded"""
+        cost = min(float(tokens), self.tpm)
+        started = time.monotonic()
+        ticket = object()
+        async with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    self._refill()
+                    is_head = self._queue[0] is ticket
+                    remaining = started + max_wait - time.monotonic()
+                    if is_head:
+                        wait = self._time_until_available(cost)
+                        if wait <= 0:
+                            self._requests -= 1
+                            self._tokens -= cost
+                            waited = time.monotonic() - started
+                            self.stats["acquired"] += 1
+                            self.stats["total_wait"] += waited
+                            self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+                            return
+                        if wait > remaining:
+                            self.stats["rejected"] += 1
+                            raise RateLimitExceeded(self.name, wait)
+                    elif remaining <= 0:
+                        self.stats["rejected"] += 1
+                        raise RateLimitExceeded(self.name, max_wait)
+                    else:
+                        wait = remaining
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=min(wait, remaining))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._refill()
+        acquired = self.stats["acquired"]
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "available_requests": round(self._requests, 2),
+            "available_tokens": int(self._tokens),
+            "queue_depth": len(self._queue),
+            "acquired": acquired,
+            "rejected": self.stats["rejected"],
+            "avg_wait": round(self.stats["total_wait"] / acquired, 3) if acquired else 0.0,
+            "max_wait": round(self.stats["max_wait"], 3),
+        }
+
+
+_limiters: Dict[str, TokenBucketLimiter] = {}
+
+
+def _parse_rate_limits(raw: str) -> Dict[str, tuple]:
+    limits = {}
+    for item in raw.split(","):
+        if "=" in item and "/" in item:
+            name, value = item.split("=", 1)
+            rpm, tpm = value.split("/", 1)
+            limits[name.strip().lower()] = (float(rpm), float(tpm))
+    return limits
+
+
+_rate_limit_overrides = _parse_rate_limits(AI_RATE_LIMITS)
+
+
+def get_rate_limiter(provider: str, api_key: str) -> TokenBucketLimiter:
+    """获取(或创建)服务商 + API Key 对应的限流器(Key只以哈希形式出现在指标中)"""
+    name = f"{provider}:{hashlib.sha256((api_key or '').encode()).hexdigest()[:8]}"
+    limiter = _limiters.get(name)
+    if limiter is None:
+        rpm, tpm = _rate_limit_overrides.get(provider, (AI_RATE_LIMIT_RPM, AI_RATE_LIMIT_TPM))
+        limiter = TokenBucketLimiter(name, rpm, tpm)
+        _limiters[name] = limiter
+    return limiter
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """获取(或创建)服务商对应的熔断器"""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        breaker = CircuitBreaker(provider, AI_BREAKER_FAILURE_THRESHOLD, AI_BREAKER_RESET_SECONDS)
+        _breakers[provider] = breaker
+    return breaker
+
+
+def is_provider_available(provider: str) -> bool:
+    """服务商熔断器是否允许请求(熔断时调用方应直接使用规则引擎结果)"""
+    return get_breaker(provider.lower()).is_available()
+
+
+def get_metrics() -> Dict[str, Any]:
+    """AI服务运行指标"""
+    cache = ai_cache.get_cache()
+    return {
+        "breakers": {name: breaker.snapshot() for name, breaker in _breakers.items()},
+        "cache": cache.snapshot() if cache else None,
+        "rate_limits": {name: limiter.snapshot() for name, limiter in _limiters.items()}
+    }
+
+
+def _is_retryable(error: Exception) -> bool:
+    """判断错误是否值得重试(同时计入熔断统计)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError))
+
+
+def _usage_outcome(error: BaseException) -> str:
+    """把调用失败的原因归类为用量记录中的 outcome"""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, RateLimitExceeded):
+        return "rate_limited"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    return "error"
+
+
+def _parse_usage(usage: Optional[Dict[str, Any]]) -> Optional[tuple]:
+    """读取响应中的token用量(OpenAI兼容格式或千问格式),缺失时返回None"""
+    if not usage:
+        return None
+    prompt_tokens = usage.get("prompt_tokens", usage.get("input_tokens"))
+    completion_tokens = usage.get("completion_tokens", usage.get("output_tokens"))
+    if prompt_tokens is None and completion_tokens is None:
+        return None
+    return int(prompt_tokens or 0), int(completion_tokens or 0)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """读取429/503响应中的 Retry-After(秒)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("retry-after")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+    return None
+
+
+async def _iter_sse_data(response: httpx.Response) -> AsyncGenerator[str, None]:
+    """逐条读取SSE响应中 data: 行的内容"""
+    async for line in response.aiter_lines():
+        line = line.strip()
+        if not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return
+        yield payload
 
 
 class AIService:
     """AI服务基类"""
 
+    provider = "base"
+
     def __init__(self, api_key: str, api_base: str = None, model: str = None):
         self.api_key = api_key
         self.api_base = api_base
         self.model = model
-        # 设置更长的超时时间: 连接超时10秒,读取超时120秒
+        # 用量记录的归属,由 get_ai_service() 设置
+        self.user_id = None
+        self.feature = None
+        # 单次HTTP读取不超过整体时间预算,真正的截止时间由 chat() 控制
         self.client = httpx.AsyncClient(
             timeout=httpx.Timeout(
                 connect=10.0,
-                read=120.0,
+                read=AI_REQUEST_DEADLINE,
                 write=10.0,
                 pool=10.0
             )
         )
 
-    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
-        """发送聊天请求"""
+    async def chat(self, messages: List[Dict[str, str]], deadline: float = None, **kwargs) -> str:
+        """发送聊天请求
+
+        相同内容的请求优先命中响应缓存;未命中时在 deadline 秒(默认 AI_REQUEST_DEADLINE)的
+        总预算内对可重试错误做带抖动的指数退避重试,并经过服务商熔断器:
+        熔断打开时立即抛出 CircuitOpenError。每次尝试前在限流队列中排队,
+        预计等待超出预算时抛出 RateLimitExceeded。每次调用的token用量与结果都会被记录。
+        """
+        started = time.monotonic()
+        cache, cache_key = self._cache_lookup(messages, kwargs)
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self._record_usage("cache_hit", started, messages)
+                return cached
+
+        try:
+            result, usage = await self._chat_with_retries(messages, deadline, kwargs)
+        except BaseException as e:
+            self._record_usage(_usage_outcome(e), started, messages)
+            raise
+
+        self._record_usage("success", started, messages, result, usage)
+        if cache_key is not None:
+            cache.set(cache_key, result)
+        return result
+
+    async def _chat_with_retries(self, messages: List[Dict[str, str]], deadline: Optional[float],
+                                 kwargs: Dict[str, Any]):
+        """经过熔断器、限流与重试发送请求,返回 (响应文本, 用量)"""
+        breaker = get_breaker(self.provider)
+        breaker.acquire()
+
+        budget = deadline if deadline is not None else AI_REQUEST_DEADLINE
+        expires_at = time.monotonic() + budget
+        attempt = 0
+        while True:
+            try:
+                await self._acquire_rate_limit(messages, kwargs, expires_at)
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                result = await asyncio.wait_for(self._request(messages, **kwargs), timeout=remaining)
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                attempt += 1
+                await self._backoff_or_raise(breaker, e, attempt, expires_at, budget)
+                continue
+
+            breaker.record_success()
+            return result
+
+    async def chat_stream(self, messages: List[Dict[str, str]], deadline: float = None, **kwargs) -> AsyncGenerator[str, None]:
+        """流式发送聊天请求,逐段产出模型输出的文本
+
+        缓存命中时一次性产出完整响应。只有在收到第一段输出之前的失败才会重试,
+        截止时间与熔断规则与 chat() 相同。
+        """
+        started = time.monotonic()
+        cache, cache_key = self._cache_lookup(messages, kwargs)
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self._record_usage("cache_hit", started, messages)
+                yield cached
+                return
+
+        parts = []
+        usage = None
+        try:
+            breaker = get_breaker(self.provider)
+            breaker.acquire()
+
+            budget = deadline if deadline is not None else AI_REQUEST_DEADLINE
+            expires_at = time.monotonic() + budget
+            attempt = 0
+            while True:
+                stream = self._request_stream(messages, **kwargs)
+                try:
+                    await self._acquire_rate_limit(messages, kwargs, expires_at)
+                    while True:
+                        remaining = expires_at - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                        except StopAsyncIteration:
+                            break
+                        if isinstance(chunk, dict):
+                            # 服务商在流末尾返回的用量信息
+                            usage = chunk
+                        elif chunk:
+                            parts.append(chunk)
+                            yield chunk
+                except (asyncio.CancelledError, GeneratorExit):
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    if parts:
+                        # 已经向调用方输出了部分内容,无法透明重试
+                        if _is_retryable(e):
+                            breaker.record_failure()
+                        else:
+                            breaker.release()
+                        raise
+                    attempt += 1
+                    await self._backoff_or_raise(breaker, e, attempt, expires_at, budget)
+                    continue
+                finally:
+                    await stream.aclose()
+                break
+        except BaseException as e:
+            # 中途断开的流同样消耗了token,按已输出内容记录
+            self._record_usage(_usage_outcome(e), started, messages, "".join(parts) if parts else None, usage)
+            raise
+
+        breaker.record_success()
+        text = "".join(parts)
+        self._record_usage("success", started, messages, text, usage)
+        if cache_key is not None:
+            cache.set(cache_key, text)
+
+    def _record_usage(self, outcome: str, started: float, messages: List[Dict[str, str]],
+                      text: Optional[str] = None, usage: Optional[Dict[str, Any]] = None):
+        """记录一次调用的用量;服务商未返回用量时按本地估算(仅对实际产生输出的调用)"""
+        parsed = _parse_usage(usage)
+        estimated = False
+        if parsed is None:
+            if text is None:
+                parsed = (0, 0)
+            else:
+                parsed = (estimate_messages_tokens(messages), estimate_tokens(text))
+                estimated = True
+        ai_usage.recorder.record(
+            user_id=str(self.user_id) if self.user_id is not None else None,
+            provider=self.provider,
+            model=self.model,
+            feature=self.feature,
+            prompt_tokens=parsed[0],
+            completion_tokens=parsed[1],
+            estimated=estimated,
+            latency_ms=int((time.monotonic() - started) * 1000),
+            outcome=outcome
+        )
+
+    async def _acquire_rate_limit(self, messages: List[Dict[str, str]], kwargs: Dict[str, Any], expires_at: float):
+        """按预估token数在限流队列中排队,等待时间不超过剩余的截止时间"""
+        tokens = estimate_messages_tokens(messages) + int(kwargs.get("max_tokens") or AI_RATE_LIMIT_DEFAULT_COMPLETION_TOKENS)
+        max_wait = min(AI_RATE_LIMIT_MAX_WAIT, expires_at - time.monotonic())
+        await get_rate_limiter(self.provider, self.api_key).acquire(tokens, max_wait)
+
+    def _cache_lookup(self, messages: List[Dict[str, str]], kwargs: Dict[str, Any]):
+        """返回 (缓存实例, 缓存键);未启用缓存时均为None"""
+        cache = ai_cache.get_cache()
+        if cache is None:
+            return None, None
+        return cache, ai_cache.make_key(self.provider, self.model, messages, api_base=self.api_base, **kwargs)
+
+    async def _backoff_or_raise(self, breaker: CircuitBreaker, error: Exception, attempt: int,
+                                expires_at: float, budget: float):
+        """可重试且预算充足时等待退避间隔,否则更新熔断器并抛出原始错误"""
+        if not _is_retryable(error):
+            breaker.release()
+            raise error
+        delay = random.uniform(0, min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * (2 ** attempt)))
+        delay = max(delay, _retry_after(error) or 0)
+        if attempt > AI_MAX_RETRIES or time.monotonic() + delay >= expires_at:
+            breaker.record_failure()
+            if isinstance(error, asyncio.TimeoutError):
+                raise asyncio.TimeoutError(f"AI request exceeded deadline of {budget:.0f}s") from error
+            raise error
+        breaker.stats["retries"] += 1
+        print(f"[AI服务] {self.provider} 请求失败({type(error).__name__}),{delay:.2f}秒后第{attempt}次重试")
+        await asyncio.sleep(delay)
+
+    async def _request(self, messages: List[Dict[str, str]], **kwargs) -> tuple:
+        """发送单次聊天请求,返回 (响应文本, 服务商返回的usage);由子类实现"""
         raise NotImplementedError
 
+    async def _request_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncGenerator[Any, None]:
+        """发送单次流式聊天请求,产出文本片段,最后可产出一个usage字典;
+        默认退化为一次性返回完整响应"""
+        content, usage = await self._request(messages, **kwargs)
+        yield content
+        if usage:
+            yield usage
+
     async def close(self):
         """关闭客户端"""
         await self.client.aclose()
@@ -38,11 +549,13 @@ class AIService:
 class DeepSeekService(AIService):
     """DeepSeek AI服务"""
 
+    provider = "deepseek"
+
     def __init__(self, api_key: str, model: str = "deepseek-chat"):
         api_base = "https://api.deepseek.com/v1"
         super().__init__(api_key, api_base, model)
 
-    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+    async def _request(self, messages: List[Dict[str, str]], **kwargs) -> tuple:
         """调用DeepSeek API"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -63,17 +576,51 @@ class DeepSeekService(AIService):
 
         response.raise_for_status()
         result = response.json()
-        return result["choices"][0]["message"]["content"]
+        return result["choices"][0]["message"]["content"], result.get("usage")
+
+    async def _request_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncGenerator[str, None]:
+        """流式调用DeepSeek API(stream=true)"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            **kwargs
+        }
+
+        async with self.client.stream(
+            "POST",
+            f"{self.api_base}/chat/completions",
+            headers=headers,
+            json=data
+        ) as response:
+            response.raise_for_status()
+            async for payload in _iter_sse_data(response):
+                chunk = json.loads(payload)
+                # 开启 include_usage 后,最后一个数据块的 choices 为空,只携带 usage
+                for choice in chunk.get("choices") or []:
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield content
+                if chunk.get("usage"):
+                    yield chunk["usage"]
 
 
 class QwenService(AIService):
     """千问(Qwen) AI服务"""
 
+    provider = "qwen"
+
     def __init__(self, api_key: str, model: str = "qwen-turbo"):
         api_base = "https://dashscope.aliyuncs.com/api/v1"
         super().__init__(api_key, api_base, model)
 
-    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+    async def _request(self, messages: List[Dict[str, str]], **kwargs) -> tuple:
         """调用千问API"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -96,16 +643,54 @@ class QwenService(AIService):
 
         response.raise_for_status()
         result = response.json()
-        return result["output"]["text"]
+        return result["output"]["text"], result.get("usage")
+
+    async def _request_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncGenerator[str, None]:
+        """流式调用千问API(SSE增量输出)"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "X-DashScope-SSE": "enable"
+        }
+
+        parameters = dict(kwargs.pop("parameters", {}), incremental_output=True)
+        data = {
+            "model": self.model,
+            "input": {
+                "messages": messages
+            },
+            "parameters": parameters,
+            **kwargs
+        }
+
+        async with self.client.stream(
+            "POST",
+            f"{self.api_base}/services/aigc/text-generation/generation",
+            headers=headers,
+            json=data
+        ) as response:
+            response.raise_for_status()
+            usage = None
+            async for payload in _iter_sse_data(response):
+                chunk = json.loads(payload)
+                text = chunk.get("output", {}).get("text")
+                if text:
+                    yield text
+                # 千问每个数据块都携带累计用量,以最后一个为准
+                usage = chunk.get("usage") or usage
+            if usage:
+                yield usage
 
 
 class OpenAIService(AIService):
     """OpenAI兼容的服务(包括其他兼容OpenAI API的服务)"""
 
+    provider = "openai"
+
     def __init__(self, api_key: str, api_base: str, model: str = "gpt-3.5-turbo"):
         super().__init__(api_key, api_base, model)
 
-    async def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+    async def _request(self, messages: List[Dict[str, str]], **kwargs) -> tuple:
         """调用OpenAI兼容API"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -126,15 +711,68 @@ class OpenAIService(AIService):
 
         response.raise_for_status()
         result = response.json()
-        return result["choices"][0]["message"]["content"]
+        return result["choices"][0]["message"]["content"], result.get("usage")
+
+    async def _request_stream(self, messages: List[Dict[str, str]], **kwargs) -> AsyncGenerator[str, None]:
+        """流式调用OpenAI兼容API(stream=true)"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            **kwargs
+        }
+
+        async with self.client.stream(
+            "POST",
+            f"{self.api_base}/chat/completions",
+            headers=headers,
+            json=data
+        ) as response:
+            response.raise_for_status()
+            async for payload in _iter_sse_data(response):
+                chunk = json.loads(payload)
+                # 开启 include_usage 后,最后一个数据块的 choices 为空,只携带 usage
+                for choice in chunk.get("choices") or []:
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield content
+                if chunk.get("usage"):
+                    yield chunk["usage"]
+
+
+class MockService(OpenAIService):
+    """本地模拟服务(services/mock_llm.py),用于离线压测
+
+    设置 MOCK_LLM_URL 时访问独立运行的模拟服务,否则在本进程的后台线程中自动启动一个。
+    """
+
+    provider = "mock"
+
+    def __init__(self, api_key: str, api_base: str = None, model: str = "mock-chat"):
+        api_base = api_base or os.getenv("MOCK_LLM_URL", "")
+        if not api_base:
+            from services import mock_llm
+            api_base = mock_llm.ensure_local_server()
+        super().__init__(api_key, api_base, model)
+
 
+def get_ai_service(provider: str, api_key: str, api_base: str = None, model: str = None,
+                   user_id: str = None, feature: str = None) -> AIService:
+    """工厂函数:根据provider返回对应的AI服务实例
 
-def get_ai_service(provider: str, api_key: str, api_base: str = None, model: str = None) -> AIService:
-    """工厂函数:根据provider返回对应的AI服务实例"""
+    user_id / feature 用于用量统计,标记调用属于哪个用户和哪个功能。
+    """
     services = {
         'deepseek': DeepSeekService,
         'qwen': QwenService,
         'openai': OpenAIService,
+        'mock': MockService,
     }
 
     service_class = services.get(provider.lower())
@@ -142,6 +780,11 @@ def get_ai_service(provider: str, api_key: str, api_base: str = None, model: str
         raise ValueError(f"Unsupported AI provider: {provider}")
 
     if provider.lower() == 'openai':
-        return service_class(api_key, api_base, model)
+        service = service_class(api_key, api_base, model)
+    elif provider.lower() == 'mock':
+        service = service_class(api_key, api_base, model or "mock-chat")
     else:
-        return service_class(api_key, model or service_class.__init__.__defaults__[0])
+        service = service_class(api_key, model or service_class.__init__.__defaults__[0])
+    service.user_id = user_id
+    service.feature = feature
+    return service
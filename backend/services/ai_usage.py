@@ -0,0 +1,170 @@
+"""
+AI调用用量与费用统计
+每次大模型调用的token数、耗时与结果先写入内存缓冲区,按批次追加到 ai_usage 表,
+并提供按 日期/服务商/模型/用户/功能 聚合的查询。
+"""
+import os
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, case, insert
+from sqlalchemy.orm import Session
+
+import database
+import models
+
+
+AI_USAGE_ENABLED = os.getenv("AI_USAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+AI_USAGE_BATCH_SIZE = int(os.getenv("AI_USAGE_BATCH_SIZE", "50"))
+AI_USAGE_FLUSH_SECONDS = float(os.getenv("AI_USAGE_FLUSH_SECONDS", "5"))
+# 每百万token单价(输入/输出),按模型配置: "deepseek-chat=0.27/1.1,qwen-turbo=0.3/0.6"
+AI_PRICES = os.getenv("AI_PRICES", "")
+
+GROUP_BY_FIELDS = ("day", "provider", "model", "user", "feature")
+
+
+def _parse_prices(raw: str) -> Dict[str, tuple]:
+    prices = {}
+    for item in raw.split(","):
+        if "=" in item and "/" in item:
+            name, value = item.split("=", 1)
+            prompt_price, completion_price = value.split("/", 1)
+            prices[name.strip()] = (float(prompt_price), float(completion_price))
+    return prices
+
+
+_prices = _parse_prices(AI_PRICES)
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = _prices.get(model or "", (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class UsageRecorder:
+    """用量记录缓冲区:满一批或定时写入数据库"""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._task = None
+        self.stats = {"recorded": 0, "flushed": 0, "flush_errors": 0}
+
+    def record(self, **row):
+        """加入缓冲区;满一批时写入数据库(在事件循环中调用时交给线程池,不阻塞事件循环)"""
+        if not AI_USAGE_ENABLED:
+            return
+        row.setdefault("created_at", datetime.now(timezone.utc))
+        with self._lock:
+            self._buffer.append(row)
+            self.stats["recorded"] += 1
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                loop.run_in_executor(None, self.flush)
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        db = database.SessionLocal()
+        try:
+            db.execute(insert(models.AIUsage), rows)
+            db.commit()
+            self.stats["flushed"] += len(rows)
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            self.stats["flush_errors"] += 1
+            print(f"[AI用量] 写入失败,丢弃 {len(rows)} 条记录: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(AI_USAGE_FLUSH_SECONDS)
+            await asyncio.to_thread(self.flush)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "buffered": len(self._buffer)}
+
+
+recorder = UsageRecorder(AI_USAGE_BATCH_SIZE)
+
+
+def aggregate_usage(db: Session, group_by: str = "day", start: datetime = None, end: datetime = None,
+                    user_id: str = None) -> List[Dict[str, Any]]:
+    """按维度聚合用量;费用按模型单价计算后再按分组合并"""
+    recorder.flush()
+
+    key_columns = {
+        "day": func.date(models.AIUsage.created_at),
+        "provider": models.AIUsage.provider,
+        "model": models.AIUsage.model,
+        "user": models.AIUsage.user_id,
+        "feature": models.AIUsage.feature,
+    }
+    key = key_columns[group_by].label("key")
+
+    query = db.query(
+        key,
+        models.AIUsage.model,
+        func.count(models.AIUsage.id).label("calls"),
+        func.sum(case((models.AIUsage.outcome.notin_(["success", "cache_hit"]), 1), else_=0)).label("errors"),
+        func.sum(case((models.AIUsage.outcome == "cache_hit", 1), else_=0)).label("cache_hits"),
+        func.sum(models.AIUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(models.AIUsage.completion_tokens).label("completion_tokens"),
+        func.sum(models.AIUsage.latency_ms).label("latency_ms"),
+    )
+    if start is not None:
+        query = query.filter(models.AIUsage.created_at >= start)
+    if end is not None:
+        query = query.filter(models.AIUsage.created_at < end)
+    if user_id is not None:
+        query = query.filter(models.AIUsage.user_id == str(user_id))
+
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for row in query.group_by(key, models.AIUsage.model).all():
+        group = groups.setdefault(row.key, {
+            "key": str(row.key) if row.key is not None else None,
+            "calls": 0, "errors": 0, "cache_hits": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0, "cost": 0.0
+        })
+        prompt_tokens = int(row.prompt_tokens or 0)
+        completion_tokens = int(row.completion_tokens or 0)
+        group["calls"] += row.calls
+        group["errors"] += int(row.errors or 0)
+        group["cache_hits"] += int(row.cache_hits or 0)
+        group["prompt_tokens"] += prompt_tokens
+        group["completion_tokens"] += completion_tokens
+        group["latency_ms"] += int(row.latency_ms or 0)
+        group["cost"] += estimate_cost(row.model, prompt_tokens, completion_tokens)
+
+    results = []
+    for group in groups.values():
+        latency_ms = group.pop("latency_ms")
+        group["total_tokens"] = group["prompt_tokens"] + group["completion_tokens"]
+        group["avg_latency_ms"] = int(latency_ms / group["calls"]) if group["calls"] else 0
+        group["cost"] = round(group["cost"], 6)
+        results.append(group)
+    results.sort(key=lambda g: (g["key"] is None, g["key"] or ""))
+    return results
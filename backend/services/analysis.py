@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 import models
 import schemas
+from services import analytics_cache
 from datetime import date, timedelta
 
 def calculate_variance(db: Session, user_id: str, days: int = 7):
@@ -9,27 +10,28 @@ def calculate_variance(db: Session, user_id: str, days: int = 7):
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
 
-    # 2. Get Total Time across all projects
-    total_seconds = db.query(func.sum(models.TimeLog.duration_seconds))\
-        .filter(models.TimeLog.user_id == user_id)\
-        .filter(models.TimeLog.log_date >= start_date).scalar() or 0
+    # 2-3. Total time and time per project (from the in-memory analytics cache when enabled)
+    series = analytics_cache.cache.get(db, user_id)
+    if series is not None:
+        total_seconds = series.total(start_date)
+        project_times = list(series.by_project(start_date).items())
+    else:
+        total_seconds = db.query(func.sum(models.TimeLog.duration_seconds))\
+            .filter(models.TimeLog.user_id == user_id)\
+            .filter(models.TimeLog.log_date >= start_date).scalar() or 0
+        project_times = db.query(
+            models.TimeLog.project_id,
+            func.sum(models.TimeLog.duration_seconds).label('seconds')
+        ).filter(models.TimeLog.user_id == user_id)\
+         .filter(models.TimeLog.log_date >= start_date)\
+         .group_by(models.TimeLog.project_id).all()
 
     if total_seconds == 0:
         return []
 
-    # 3. Get Time per Project
-    project_times = db.query(
-        models.TimeLog.project_id,
-        func.sum(models.TimeLog.duration_seconds).label('seconds')
-    ).filter(models.TimeLog.user_id == user_id)\
-     .filter(models.TimeLog.log_date >= start_date)\
-     .group_by(models.TimeLog.project_id).all()
-
     results = []
     
-    for pt in project_times:
-        proj_id = pt.project_id
-        actual_seconds = pt.seconds
+    for proj_id, actual_seconds in project_times:
         actual_pct = (actual_seconds / total_seconds) * 100
 
         # 4. Get Current Target
@@ -0,0 +1,201 @@
+"""
+进程内列式分析缓存(可选)
+把活跃用户的时间记录保存为 NumPy 列数组(日期、项目序号、任务序号、秒数),
+概览、项目分布、趋势、精力分配与偏差分析直接在数组上做向量化归约,不再每次从SQL重建。
+
+缓存以用户数据版本为键: 写入时间记录后如果缓存正好落后一个版本,就把新记录追加到数组末尾;
+其他任何数据变更(删除、归档等)使版本号跳变,下次读取时整体重建。按内存预算做LRU淘汰。
+数组中的每一行是一个"时长增量": 计时结束时追加一行该记录的时长,求和结果与SQL一致。
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import crud
+import models
+
+
+ANALYTICS_CACHE_ENABLED = os.getenv("ANALYTICS_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# 所有用户数组占用内存的上限(字节)
+ANALYTICS_CACHE_MAX_BYTES = int(os.getenv("ANALYTICS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# date.toordinal() 与 numpy datetime64[D](1970-01-01 起的天数)之间的偏移
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _day(value: date) -> int:
+    return value.toordinal() - _EPOCH_ORDINAL
+
+
+class UserSeries:
+    """单个用户的时间记录列数组"""
+
+    def __init__(self, version: int, rows: Iterable[Tuple]):
+        self.version = version
+        self.project_ids: List[str] = []
+        self.task_ids: List[Optional[str]] = []
+        self._project_index: Dict[str, int] = {}
+        self._task_index: Dict[Optional[str], int] = {}
+
+        rows = list(rows)
+        self.days = np.array([_day(r[0]) for r in rows], dtype=np.int32)
+        self.projects = np.array([self._index(self._project_index, self.project_ids, r[1]) for r in rows], dtype=np.int32)
+        self.tasks = np.array([self._index(self._task_index, self.task_ids, r[2]) for r in rows], dtype=np.int32)
+        self.seconds = np.array([r[3] or 0 for r in rows], dtype=np.int64)
+
+    @staticmethod
+    def _index(index: Dict, ids: List, key) -> int:
+        if key not in index:
+            index[key] = len(ids)
+            ids.append(key)
+        return index[key]
+
+    @property
+    def nbytes(self) -> int:
+        return self.days.nbytes + self.projects.nbytes + self.tasks.nbytes + self.seconds.nbytes
+
+    def extended(self, version: int, rows: List[Tuple]) -> "UserSeries":
+        """返回追加了新行的副本;正在读取旧对象的请求不受影响(序号表只增不改,可以共享)"""
+        series = UserSeries.__new__(UserSeries)
+        series.version = version
+        series.project_ids, series._project_index = self.project_ids, self._project_index
+        series.task_ids, series._task_index = self.task_ids, self._task_index
+        series.days = np.append(self.days, np.array([_day(r[0]) for r in rows], dtype=np.int32))
+        series.projects = np.append(self.projects, np.array(
+            [self._index(self._project_index, self.project_ids, r[1]) for r in rows], dtype=np.int32))
+        series.tasks = np.append(self.tasks, np.array(
+            [self._index(self._task_index, self.task_ids, r[2]) for r in rows], dtype=np.int32))
+        series.seconds = np.append(self.seconds, np.array([r[3] or 0 for r in rows], dtype=np.int64))
+        return series
+
+    # --- 向量化查询 ---
+    def _mask(self, start_date: Optional[date], end_date: Optional[date]) -> np.ndarray:
+        mask = np.ones(self.days.shape, dtype=bool)
+        if start_date is not None and start_date > date.min:
+            mask &= self.days >= _day(start_date)
+        if end_date is not None and end_date < date.max:
+            mask &= self.days <= _day(end_date)
+        return mask
+
+    def total(self, start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+        return int(self.seconds[self._mask(start_date, end_date)].sum())
+
+    def study_days(self, start_date: Optional[date] = None, end_date: Optional[date] = None) -> int:
+        return int(np.unique(self.days[self._mask(start_date, end_date)]).size)
+
+    def first_date(self) -> Optional[date]:
+        return date.fromordinal(int(self.days.min()) + _EPOCH_ORDINAL) if self.days.size else None
+
+    def by_project(self, start_date: Optional[date] = None, end_date: Optional[date] = None) -> Dict[str, int]:
+        """各项目的时长(只包含时间段内有记录的项目)"""
+        mask = self._mask(start_date, end_date)
+        sums = np.bincount(self.projects[mask], weights=self.seconds[mask], minlength=len(self.project_ids))
+        present = np.bincount(self.projects[mask], minlength=len(self.project_ids)) > 0
+        return {self.project_ids[i]: int(sums[i]) for i in np.flatnonzero(present)}
+
+    def trend(self, start_date: date, end_date: date, granularity: str) -> List[Tuple[str, int]]:
+        """按 天/周/月 分桶的时长,标签格式与SQL分桶一致(桶起点 YYYY-MM-DD)"""
+        mask = self._mask(start_date, end_date)
+        days = self.days[mask].astype('datetime64[D]')
+        if granularity == 'week':
+            # 1970-01-01 是星期四,回退到本周一
+            weekday = (self.days[mask].astype(np.int64) + 3) % 7
+            buckets = days - weekday.astype('timedelta64[D]')
+        elif granularity == 'month':
+            buckets = days.astype('datetime64[M]').astype('datetime64[D]')
+        else:
+            buckets = days
+        labels, inverse = np.unique(buckets, return_inverse=True)
+        sums = np.bincount(inverse, weights=self.seconds[mask], minlength=labels.size)
+        return [(str(label), int(total)) for label, total in zip(labels, sums)]
+
+
+class AnalyticsCache:
+    """按用户保存 UserSeries,按内存预算LRU淘汰"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, UserSeries]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "builds": 0, "appends": 0, "invalidations": 0, "evictions": 0}
+
+    def _load(self, db: Session, user_id: str, version: int) -> UserSeries:
+        """从热表与归档汇总中读取该用户的全部时长记录"""
+        hot = db.query(
+            models.TimeLog.log_date, models.TimeLog.project_id, models.TimeLog.task_id, models.TimeLog.duration_seconds
+        ).filter(models.TimeLog.user_id == user_id, models.TimeLog.log_date.isnot(None))
+        archived = db.query(
+            models.TimeLogDaily.log_date, models.TimeLogDaily.project_id, models.TimeLogDaily.task_id,
+            models.TimeLogDaily.duration_seconds
+        ).filter(models.TimeLogDaily.user_id == user_id)
+        return UserSeries(version, list(hot) + list(archived))
+
+    def get(self, db: Session, user_id: str) -> Optional[UserSeries]:
+        """返回与当前数据版本一致的用户序列;未启用时返回 None,调用方走SQL"""
+        if not ANALYTICS_CACHE_ENABLED:
+            return None
+        user_id = str(user_id)
+        version = crud.get_data_version(db, user_id)
+        with self._lock:
+            series = self._entries.get(user_id)
+            if series is not None and series.version == version:
+                self._entries.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return series
+
+        series = self._load(db, user_id, version)
+        with self._lock:
+            self.stats["builds"] += 1
+            # 读取期间有并发写入时不缓存,避免之后的增量追加重复计入
+            if crud.get_data_version(db, user_id) == version:
+                self._store(user_id, series)
+        return series
+
+    def append(self, db: Session, user_id: str, logs: List[models.TimeLog]):
+        """写入时间记录并提交后调用,把记录的时长作为增量追加到缓存的序列"""
+        if not ANALYTICS_CACHE_ENABLED or not user_id:
+            return
+        user_id = str(user_id)
+        rows = [(log.log_date, log.project_id, log.task_id, log.duration_seconds) for log in logs]
+        version = crud.get_data_version(db, user_id)
+        with self._lock:
+            series = self._entries.get(user_id)
+            if series is None:
+                return
+            if series.version != version - 1:
+                # 中间还有其他写入,增量无法保证一致,下次读取时重建
+                self._drop(user_id)
+                self.stats["invalidations"] += 1
+                return
+            self._store(user_id, series.extended(version, rows))
+            self.stats["appends"] += 1
+
+    def _store(self, user_id: str, series: UserSeries):
+        self._drop(user_id)
+        self._entries[user_id] = series
+        self._bytes += series.nbytes
+        self._evict()
+
+    def _drop(self, user_id: str):
+        old = self._entries.pop(user_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+
+    def _evict(self):
+        # 至少保留最近使用的一个用户
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "users": len(self._entries), "bytes": self._bytes, "enabled": ANALYTICS_CACHE_ENABLED}
+
+
+cache = AnalyticsCache(ANALYTICS_CACHE_MAX_BYTES)
@@ -0,0 +1,289 @@
+"""
+时间记录冷存储归档
+把早于归档期限的时间记录按 用户+月份 打包成按列组织、zlib压缩的分段(time_log_archives),
+同时写入按日汇总(time_log_daily),然后从 time_logs 中删除,使热表及其索引只保留近期数据。
+统计查询读取 热表 + 按日汇总;需要具体时间点的统计(小时趋势、热力图)再读取分段。
+restore 把分段还原回热表。
+"""
+import os
+import json
+import zlib
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import Date, DateTime, select
+from sqlalchemy.orm import Session
+
+import database
+import models
+import crud
+
+
+# 早于该天数的时间记录会被归档(按整月归档,当月不足期限的部分保留在热表)
+ARCHIVE_HORIZON_DAYS = int(os.getenv("ARCHIVE_HORIZON_DAYS", "365"))
+# 每条 DELETE/INSERT 语句处理的行数
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+COLUMNS = [c.name for c in models.TimeLog.__table__.columns if c.name != 'user_id']
+
+
+def _month_of(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def _month_range(month: str):
+    """返回月份的 [第一天, 下月第一天)"""
+    first = datetime.strptime(month, '%Y-%m').date()
+    following = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return first, following
+
+
+def archive_cutoff(horizon_days: int = ARCHIVE_HORIZON_DAYS) -> date:
+    """归档分界: 早于该日期(所在月的第一天)的记录可归档"""
+    return date.fromordinal(date.today().toordinal() - horizon_days).replace(day=1)
+
+
+# --- 分段编解码 ---
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_column(name: str, values: List[Any]) -> List[Any]:
+    column_type = models.TimeLog.__table__.c[name].type
+    if isinstance(column_type, DateTime):
+        return [datetime.fromisoformat(v) if v else None for v in values]
+    if isinstance(column_type, Date):
+        return [date.fromisoformat(v) if v else None for v in values]
+    return values
+
+
+def encode_segment(rows: List[Dict[str, Any]]) -> bytes:
+    """按列组织后压缩: 同一列的值相邻存放,压缩率远高于逐行存储"""
+    columns = {name: [_encode_value(row.get(name)) for row in rows] for name in COLUMNS}
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode(), 9)
+
+
+def decode_segment(data: bytes) -> List[Dict[str, Any]]:
+    columns = json.loads(zlib.decompress(data))
+    names = [name for name in COLUMNS if name in columns]
+    decoded = [_decode_column(name, columns[name]) for name in names]
+    return [dict(zip(names, values)) for values in zip(*decoded)]
+
+
+# --- 归档 ---
+def _daily_aggregates(user_id: str, rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        key = (row['project_id'], row['task_id'], row['log_date'])
+        totals[key][0] += row['duration_seconds'] or 0
+        totals[key][1] += 1
+    return [
+        {'user_id': user_id, 'project_id': project_id, 'task_id': task_id, 'log_date': log_date,
+         'duration_seconds': duration, 'log_count': count}
+        for (project_id, task_id, log_date), (duration, count) in totals.items()
+    ]
+
+
+def _write_month(db: Session, user_id: str, month: str, rows: List[Dict[str, Any]]):
+    """写入(或覆盖)一个用户月份的分段,并据此重建该月的按日汇总"""
+    first, following = _month_range(month)
+    segment = db.query(models.TimeLogArchive).filter(
+        models.TimeLogArchive.user_id == user_id,
+        models.TimeLogArchive.month == month
+    ).first()
+    if segment is None:
+        segment = models.TimeLogArchive(user_id=user_id, month=month)
+        db.add(segment)
+    segment.data = encode_segment(rows)
+    segment.row_count = len(rows)
+    segment.total_seconds = sum(row['duration_seconds'] or 0 for row in rows)
+
+    db.query(models.TimeLogDaily).filter(
+        models.TimeLogDaily.user_id == user_id,
+        models.TimeLogDaily.log_date >= first,
+        models.TimeLogDaily.log_date < following
+    ).execution_options(include_deleted=True).delete(synchronize_session=False)
+    aggregates = _daily_aggregates(user_id, rows)
+    if aggregates:
+        db.bulk_insert_mappings(models.TimeLogDaily, aggregates)
+
+
+def archive_user_month(db: Session, user_id: str, month: str) -> int:
+    """把一个用户某月的热数据并入分段(单个事务),返回归档的行数"""
+    first, following = _month_range(month)
+    logs = models.TimeLog.__table__
+    hot = [dict(row._mapping) for row in db.query(*[getattr(models.TimeLog, name) for name in COLUMNS]).filter(
+        models.TimeLog.user_id == user_id,
+        models.TimeLog.log_date >= first,
+        models.TimeLog.log_date < following
+    )]
+    if not hot:
+        return 0
+
+    existing = db.query(models.TimeLogArchive.data).filter(
+        models.TimeLogArchive.user_id == user_id,
+        models.TimeLogArchive.month == month
+    ).scalar()
+    rows = (decode_segment(existing) if existing else []) + hot
+    _write_month(db, user_id, month, rows)
+
+    ids = [row['id'] for row in hot]
+    for i in range(0, len(ids), ARCHIVE_BATCH_SIZE):
+        db.execute(logs.delete().where(logs.c.id.in_(ids[i:i + ARCHIVE_BATCH_SIZE])))
+    # 统计的数据来源发生变化,递增数据版本使缓存的统计结果失效
+    crud.bump_data_version(db, user_id)
+    db.commit()
+    return len(hot)
+
+
+def archive_logs(horizon_days: int = ARCHIVE_HORIZON_DAYS, user_id: Optional[str] = None) -> Dict[str, int]:
+    """归档所有(或指定用户)早于期限的时间记录;每个用户月份一个事务,中断后重跑即可继续"""
+    cutoff = archive_cutoff(horizon_days)
+    stats = {"segments": 0, "rows": 0}
+
+    db = database.SessionLocal()
+    try:
+        query = db.query(models.TimeLog.user_id, models.TimeLog.log_date)\
+            .filter(models.TimeLog.log_date < cutoff)
+        if user_id:
+            query = query.filter(models.TimeLog.user_id == str(user_id))
+        pending = sorted({(uid, _month_of(day)) for uid, day in query.distinct() if uid and day})
+
+        for uid, month in pending:
+            try:
+                count = archive_user_month(db, uid, month)
+            except Exception as e:
+                db.rollback()
+                print(f"[归档] 用户 {uid} {month} 归档失败: {e}")
+                continue
+            if count:
+                stats["segments"] += 1
+                stats["rows"] += count
+    finally:
+        db.close()
+
+    print(f"[归档] 完成(早于 {cutoff}): {stats}")
+    return stats
+
+
+# --- 读取 ---
+def archived_rows(db: Session, user_id: str, start_date: date, end_date: date) -> List[Dict[str, Any]]:
+    """读取日期范围内的归档记录(已删除的项目/任务的记录会被排除)"""
+    segments = db.query(models.TimeLogArchive.data).filter(
+        models.TimeLogArchive.user_id == str(user_id),
+        models.TimeLogArchive.month >= _month_of(start_date),
+        models.TimeLogArchive.month <= _month_of(end_date)
+    ).all()
+    if not segments:
+        return []
+
+    projects = {row[0] for row in db.query(models.Project.id).filter(models.Project.user_id == user_id)}
+    tasks = {row[0] for row in db.query(models.Task.id).filter(models.Task.project_id.in_(projects))}
+    return [
+        row for segment in segments for row in decode_segment(segment.data)
+        if start_date <= row['log_date'] <= end_date
+        and row['project_id'] in projects
+        and (row['task_id'] is None or row['task_id'] in tasks)
+    ]
+
+
+def _existing_ids(db: Session, user_id: str):
+    """用户仍存在的项目与任务ID(含已软删除、尚未物理删除的)"""
+    projects = {r[0] for r in db.query(models.Project.id).filter(
+        models.Project.user_id == user_id
+    ).execution_options(include_deleted=True)}
+    tasks = {r[0] for r in db.query(models.Task.id).filter(
+        models.Task.project_id.in_(projects)
+    ).execution_options(include_deleted=True)} if projects else set()
+    return projects, tasks
+
+
+def _belongs(row: Dict[str, Any], projects, tasks) -> bool:
+    return row['project_id'] in projects and (row['task_id'] is None or row['task_id'] in tasks)
+
+
+# --- 还原 ---
+def restore_logs(user_id: Optional[str] = None, month: Optional[str] = None) -> Dict[str, int]:
+    """把分段还原回 time_logs,并删除对应的按日汇总与分段"""
+    stats = {"segments": 0, "rows": 0}
+    logs = models.TimeLog.__table__
+
+    db = database.SessionLocal()
+    try:
+        query = db.query(models.TimeLogArchive.id)
+        if user_id:
+            query = query.filter(models.TimeLogArchive.user_id == str(user_id))
+        if month:
+            query = query.filter(models.TimeLogArchive.month == month)
+
+        for (segment_id,) in query.order_by(models.TimeLogArchive.user_id, models.TimeLogArchive.month).all():
+            segment = db.get(models.TimeLogArchive, segment_id)
+            owner, first, following = segment.user_id, *_month_range(segment.month)
+            # 项目或任务已被物理删除的记录不再还原
+            projects, tasks = _existing_ids(db, owner)
+            rows = [
+                {**row, 'user_id': owner} for row in decode_segment(segment.data)
+                if _belongs(row, projects, tasks)
+            ]
+            # 已经在热表中的记录不重复插入(例如上次还原中途失败)
+            present = set()
+            ids = [row['id'] for row in rows]
+            for i in range(0, len(ids), ARCHIVE_BATCH_SIZE):
+                present.update(r[0] for r in db.execute(
+                    select(logs.c.id).where(logs.c.id.in_(ids[i:i + ARCHIVE_BATCH_SIZE]))
+                ))
+            rows = [row for row in rows if row['id'] not in present]
+            for i in range(0, len(rows), ARCHIVE_BATCH_SIZE):
+                db.execute(logs.insert(), rows[i:i + ARCHIVE_BATCH_SIZE])
+
+            db.query(models.TimeLogDaily).filter(
+                models.TimeLogDaily.user_id == owner,
+                models.TimeLogDaily.log_date >= first,
+                models.TimeLogDaily.log_date < following
+            ).execution_options(include_deleted=True).delete(synchronize_session=False)
+            db.delete(segment)
+            crud.bump_data_version(db, owner)
+            db.commit()
+
+            stats["segments"] += 1
+            stats["rows"] += len(rows)
+    finally:
+        db.close()
+
+    print(f"[归档] 还原完成: {stats}")
+    return stats
+
+
+# --- 清理 ---
+def prune_segments(user_id: str) -> int:
+    """从用户的分段中移除已被物理删除的项目/任务的记录(由 purger 在删除标记行后调用),返回移除的行数
+
+    分段为空时连同该月的按日汇总一起删除。
+    """
+    removed = 0
+    db = database.SessionLocal()
+    try:
+        projects, tasks = _existing_ids(db, user_id)
+        for segment in db.query(models.TimeLogArchive).filter(models.TimeLogArchive.user_id == str(user_id)).all():
+            rows = decode_segment(segment.data)
+            kept = [row for row in rows if _belongs(row, projects, tasks)]
+            if len(kept) == len(rows):
+                continue
+            removed += len(rows) - len(kept)
+            if kept:
+                _write_month(db, segment.user_id, segment.month, kept)
+            else:
+                first, following = _month_range(segment.month)
+                db.query(models.TimeLogDaily).filter(
+                    models.TimeLogDaily.user_id == segment.user_id,
+                    models.TimeLogDaily.log_date >= first,
+                    models.TimeLogDaily.log_date < following
+                ).execution_options(include_deleted=True).delete(synchronize_session=False)
+                db.delete(segment)
+            db.commit()
+    finally:
+        db.close()
+    return removed
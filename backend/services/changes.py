@@ -0,0 +1,170 @@
+"""
+增量同步(变更日志)
+crud 的每个项目/任务写路径在同一事务中向 change_log 追加 (实体, ID, upsert/delete) 记录(outbox),
+客户端带上次的游标调用 /api/changes,只取回此后变化的实体的当前状态,耗时与变更量成正比而不是数据量。
+
+压缩: 同一实体只保留最新的一条记录(旧记录被覆盖,任何游标都不受影响);
+超过 CHANGES_RETENTION_DAYS 的删除记录被清除,并把清除到的游标记为该用户的水位,
+游标早于水位的客户端会收到 reset,需要全量重新加载。
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from sqlalchemy import func, literal, select
+
+import database
+import models
+import schemas
+import crud
+
+
+CHANGES_COMPACT_ENABLED = os.getenv("CHANGES_COMPACT_ENABLED", "true").lower() in ("1", "true", "yes")
+# 删除记录的保留天数,离线超过该时长的客户端需要全量同步
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", "30"))
+# 两轮压缩之间的间隔(秒)
+CHANGES_COMPACT_INTERVAL_SECONDS = float(os.getenv("CHANGES_COMPACT_INTERVAL_SECONDS", "3600"))
+# 游标不越过这段时间内写入的记录: 并发事务可能以与游标不同的顺序提交,最近的记录下次会再返回一遍
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "2"))
+
+stats = {"runs": 0, "superseded": 0, "expired": 0, "errors": 0}
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite 读回的时间不带时区,按UTC处理
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def seed_change_log() -> int:
+    """变更日志为空时为现有的项目和任务各写入一条 upsert(首次启用时),使 since=0 的同步包含已有数据"""
+    with database.SessionLocal() as db:
+        if db.query(models.ChangeLog.id).first() is not None:
+            return 0
+        log = models.ChangeLog.__table__
+        columns = ["user_id", "entity", "entity_id", "op"]
+        seeded = 0
+        for entity, table in (('project', models.Project.__table__), ('task', models.Task.__table__)):
+            seeded += db.execute(log.insert().from_select(columns, select(
+                table.c.user_id, literal(entity), table.c.id, literal('upsert')
+            ).where(table.c.deleted_at.is_(None), table.c.user_id.isnot(None)))).rowcount or 0
+        db.commit()
+    if seeded:
+        print(f"[变更日志] 已为现有数据写入 {seeded} 条变更记录")
+    return seeded
+
+
+def get_changes(db, user_id: str, since: int = 0, limit: int = 500) -> Dict[str, Any]:
+    """游标 since 之后变化的项目与任务
+
+    每个实体只返回一次当前状态: 仍存在的为 upsert(附完整数据),已删除的为 delete。
+    返回的新游标不越过最近 CHANGES_SETTLE_SECONDS 内的记录,这些记录下次还会返回(按ID幂等应用即可)。
+    """
+    watermark = db.query(models.ChangeLogWatermark.purged_through).filter(
+        models.ChangeLogWatermark.user_id == user_id
+    ).scalar() or 0
+    if since < watermark:
+        latest = db.query(func.max(models.ChangeLog.id)).filter(models.ChangeLog.user_id == user_id).scalar()
+        return {"changes": [], "cursor": max(latest or 0, watermark), "has_more": False, "reset": True}
+
+    rows = db.query(models.ChangeLog).filter(
+        models.ChangeLog.user_id == user_id,
+        models.ChangeLog.id > since
+    ).order_by(models.ChangeLog.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    cursor = since
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+    for row in rows:
+        if row.created_at is not None and _utc(row.created_at) > settled_before:
+            break
+        cursor = row.id
+
+    latest = {}  # (实体, ID) -> 最新的一条记录
+    for row in rows:
+        latest[(row.entity, row.entity_id)] = row
+
+    task_ids = [entity_id for entity, entity_id in latest if entity == 'task']
+    project_ids = [entity_id for entity, entity_id in latest if entity == 'project']
+    tasks = {
+        t.id: t for t in db.query(models.Task).filter(models.Task.id.in_(task_ids), models.Task.user_id == user_id)
+    } if task_ids else {}
+    projects = {
+        p.id: p for p in db.query(models.Project).filter(
+            models.Project.id.in_(set(project_ids) | {t.project_id for t in tasks.values()}),
+            models.Project.user_id == user_id
+        )
+    } if project_ids or tasks else {}
+    durations = crud._logged_seconds(db, tasks) if tasks else {}
+
+    changes = []
+    for (entity, entity_id), row in sorted(latest.items(), key=lambda item: item[1].id):
+        data = None
+        if entity == 'task' and entity_id in tasks:
+            task = tasks[entity_id]
+            project = projects.get(task.project_id)
+            data = crud._task_payload(task, project.name if project else "", durations.get(task.id) or 0)
+        elif entity == 'project' and entity_id in projects:
+            data = schemas.Project.model_validate(crud._populate_project(projects[entity_id])).model_dump(mode="json")
+        changes.append({
+            "cursor": row.id,
+            "entity": entity,
+            "id": entity_id,
+            "op": "upsert" if data is not None else "delete",
+            "data": data
+        })
+    return {"changes": changes, "cursor": cursor, "has_more": has_more, "reset": False}
+
+
+# --- 压缩 ---
+def _compact(retention_days: int) -> Dict[str, int]:
+    db = database.SessionLocal()
+    try:
+        log = models.ChangeLog
+        newest = select(func.max(log.id)).group_by(log.user_id, log.entity, log.entity_id)
+        superseded = db.query(log).filter(log.id.notin_(newest)).delete(synchronize_session=False)
+
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        expired_by_user = db.query(log.user_id, func.max(log.id)).filter(
+            log.op == 'delete', log.created_at < cutoff
+        ).group_by(log.user_id).all()
+        expired = 0
+        for user_id, purged_through in expired_by_user:
+            expired += db.query(log).filter(
+                log.user_id == user_id, log.op == 'delete', log.id <= purged_through
+            ).delete(synchronize_session=False)
+            updated = db.query(models.ChangeLogWatermark).filter(
+                models.ChangeLogWatermark.user_id == user_id
+            ).update({models.ChangeLogWatermark.purged_through: purged_through})
+            if not updated:
+                db.add(models.ChangeLogWatermark(user_id=user_id, purged_through=purged_through))
+        db.commit()
+        return {"superseded": superseded, "expired": expired}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def compact(retention_days: int = CHANGES_RETENTION_DAYS) -> Dict[str, int]:
+    """删除被覆盖的变更记录与过期的删除记录,返回各自删除的行数"""
+    result = await asyncio.to_thread(_compact, retention_days)
+    stats["runs"] += 1
+    stats["superseded"] += result["superseded"]
+    stats["expired"] += result["expired"]
+    if any(result.values()):
+        print(f"[变更日志] 已压缩: {result}")
+    return result
+
+
+async def run_periodically():
+    """每隔 CHANGES_COMPACT_INTERVAL_SECONDS 执行一轮压缩"""
+    while True:
+        try:
+            await compact()
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"[变更日志] 压缩失败: {e}")
+        await asyncio.sleep(CHANGES_COMPACT_INTERVAL_SECONDS)
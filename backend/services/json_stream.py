@@ -0,0 +1,113 @@
+"""
+增量JSON解析
+边接收大模型的流式输出边扫描顶层对象,每当某个顶层字段的值完整时立即产出,
+无需等待整个响应结束。
+"""
+import json
+from typing import Any, List, NamedTuple, Tuple
+
+
+class MalformedField(NamedTuple):
+    """无法解析的字段值,由 feed() 代替值返回给调用方处理(跳过/提示)"""
+    raw: str
+    error: str
+
+
+class TopLevelFieldParser:
+    """增量解析一个JSON对象的顶层字段
+
+    第一个 '{' 之前的内容(如 ```json 代码块标记)会被忽略;
+    每次 feed() 返回本次新完成的 (字段名, 值) 列表,值格式错误时为 MalformedField。
+    字符串、对象和数组在收到结束的引号/括号时立即产出;
+    数字、true/false/null 没有结束符,在其后的 ',' 或 '}' 到达时产出。
+    """
+
+    def __init__(self):
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"  # key / colon / value / comma
+        self._key = None
+        self._key_start = 0
+        self._value_start = 0
+
+    @property
+    def text(self) -> str:
+        """目前为止接收到的完整文本"""
+        return self._text
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._text += chunk
+        fields = []
+        text = self._text
+
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key = json.loads(text[self._key_start:self._pos + 1])
+                        self._expect = "colon"
+                    elif self._depth == 1 and self._expect == "value":
+                        self._finish_value(fields, self._pos + 1)
+
+            elif self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._expect = "key"
+
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    self._key_start = self._pos
+                elif self._depth == 1 and self._expect == "value":
+                    self._value_start = self._pos
+
+            elif ch == ":" and self._depth == 1 and self._expect == "colon":
+                self._expect = "value"
+                self._value_start = self._pos + 1
+
+            elif ch in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._value_start = self._pos
+                self._depth += 1
+
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._expect == "value":
+                    # 对象/数组值的结束括号
+                    self._finish_value(fields, self._pos + 1)
+                elif self._depth == 0:
+                    # 顶层对象结束,最后一个字段可能是没有结束符的标量
+                    if self._expect == "value":
+                        self._finish_value(fields, self._pos)
+                    self.done = True
+
+            elif ch == "," and self._depth == 1:
+                if self._expect == "value":
+                    self._finish_value(fields, self._pos)
+                self._expect = "key"
+
+            self._pos += 1
+
+        return fields
+
+    def _finish_value(self, fields: List[Tuple[str, Any]], end: int):
+        raw = self._text[self._value_start:end].strip()
+        self._expect = "comma"
+        if not raw:
+            return
+        try:
+            fields.append((self._key, json.loads(raw)))
+        except ValueError as e:
+            # 单个字段格式错误时不影响其余字段
+            fields.append((self._key, MalformedField(raw, str(e))))
@@ -0,0 +1,192 @@
+"""
+本地模拟大模型服务
+实现 OpenAI 兼容的 POST /v1/chat/completions(含 stream=true),用于离线压测与故障演练。
+首字延迟、输出速度、错误率与畸形JSON比例均可配置;响应内容根据提示词生成
+格式合理的学习计划JSON,使规则引擎增强、完整分析与降级路径都能走通。
+
+独立运行: uvicorn services.mock_llm:app --port 9000
+然后设置 MOCK_LLM_URL=http://127.0.0.1:9000/v1;未设置时 mock 服务商会在进程内自动启动。
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+# 首个token前的延迟(毫秒)
+MOCK_LLM_LATENCY_MS = float(os.getenv("MOCK_LLM_LATENCY_MS", "200"))
+# 输出速度(token/秒),0 表示不限速
+MOCK_LLM_TOKENS_PER_SECOND = float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "50"))
+# 返回 500 错误的概率
+MOCK_LLM_ERROR_RATE = float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+# 返回被截断的(不合法的)JSON的概率
+MOCK_LLM_MALFORMED_RATE = float(os.getenv("MOCK_LLM_MALFORMED_RATE", "0"))
+
+# 运行时可修改(压测脚本按场景调整)
+settings = {
+    "latency_ms": MOCK_LLM_LATENCY_MS,
+    "tokens_per_second": MOCK_LLM_TOKENS_PER_SECOND,
+    "error_rate": MOCK_LLM_ERROR_RATE,
+    "malformed_rate": MOCK_LLM_MALFORMED_RATE,
+}
+
+# 每个流式分片包含的字符数(约等于一个token)
+CHUNK_CHARS = 2
+
+app = FastAPI(title="Mock LLM")
+
+_local_server_url = None
+_local_server_lock = threading.Lock()
+
+
+def _tokens(text: str) -> int:
+    return max(1, (len(text) + CHUNK_CHARS - 1) // CHUNK_CHARS)
+
+
+def _section(prompt: str, title: str) -> List[Dict[str, Any]]:
+    """读取提示词中 【标题】 下一行的JSON数组"""
+    match = re.search(rf"【{title}】\s*\n(.*)", prompt)
+    if not match:
+        return []
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return []
+
+
+def _full_plan(prompt: str) -> Dict[str, Any]:
+    """完整分析模式: 按提示词中的项目偏差与待办任务生成四个字段"""
+    deviations = _section(prompt, "项目精力偏差")
+    tasks = _section(prompt, "待办任务")
+    return {
+        "warnings": [
+            {
+                "title": f"{d['项目']}投入{'不足' if d['实际%'] < d['目标%'] else '过多'}",
+                "message": f"目标{d['目标%']}%,实际{d['实际%']}%",
+                "level": "high" if abs(d['目标%'] - d['实际%']) > 20 else "medium",
+                "suggestions": [{"text": "调整今日学习时间分配", "action": "adjust"}]
+            }
+            for d in deviations
+        ],
+        "recommendations": [
+            {
+                "id": t["id"],
+                "name": t["任务"],
+                "projectName": t["项目"],
+                "priority": t["优先级"],
+                "estimatedTime": 45,
+                "reason": "优先推进投入不足的项目"
+            }
+            for t in tasks[:4]
+        ],
+        "energySuggestions": [
+            {
+                "projectName": d["项目"],
+                "target": d["目标%"],
+                "actual": d["实际%"],
+                "status": "unbalanced",
+                "suggestion": "向目标占比靠拢"
+            }
+            for d in deviations
+        ],
+        "dailyTips": ["先完成最重要的任务", "每45分钟休息一次", "睡前回顾今日进度"]
+    }
+
+
+def generate_content(messages: List[Dict[str, str]]) -> str:
+    """根据提示词生成模拟回复"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "【待办任务】" in prompt:
+        return json.dumps(_full_plan(prompt), ensure_ascii=False)
+    if "推荐理由" in prompt:
+        names = re.findall(r"^- (.+?) \(", prompt, flags=re.MULTILINE)
+        return json.dumps([{"name": name, "reason": "与当前目标最相关"} for name in names], ensure_ascii=False)
+    return "建议把今天的时间优先留给投入不足的项目,并在每个学习块之间安排短暂休息。"
+
+
+def _malform(content: str) -> str:
+    """截掉尾部,制造不完整的JSON"""
+    return content[:max(1, len(content) * 2 // 3)]
+
+
+async def _pace(tokens: int):
+    rate = settings["tokens_per_second"]
+    if rate > 0:
+        await asyncio.sleep(tokens / rate)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "mock-chat")
+
+    if random.random() < settings["error_rate"]:
+        return JSONResponse(status_code=500, content={"error": {"message": "mock upstream error"}})
+
+    content = generate_content(messages)
+    if random.random() < settings["malformed_rate"]:
+        content = _malform(content)
+
+    prompt_tokens = sum(_tokens(m.get("content", "")) for m in messages)
+    completion_tokens = _tokens(content)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+    completion_id = f"mock-{int(time.time() * 1000)}"
+
+    await asyncio.sleep(settings["latency_ms"] / 1000)
+
+    if not body.get("stream"):
+        await _pace(completion_tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+    async def events():
+        for i in range(0, len(content), CHUNK_CHARS):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[i:i + CHUNK_CHARS]}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await _pace(1)
+        if include_usage:
+            yield f"data: {json.dumps({'id': completion_id, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def ensure_local_server() -> str:
+    """在后台线程中启动本地模拟服务(随机端口,每个进程只启动一次),返回其 api_base"""
+    global _local_server_url
+    with _local_server_lock:
+        if _local_server_url is None:
+            import uvicorn
+
+            server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+            threading.Thread(target=server.run, name="mock-llm", daemon=True).start()
+            while not server.started:
+                time.sleep(0.01)
+            port = server.servers[0].sockets[0].getsockname()[1]
+            _local_server_url = f"http://127.0.0.1:{port}/v1"
+            print(f"[模拟模型] 本地服务已启动: {_local_server_url}")
+        return _local_server_url
@@ -0,0 +1,86 @@
+"""
+学习计划离峰预生成
+在夜间逐个用户调用 generate_daily_plan 并写入 ai_suggestions,
+早高峰的规划请求直接命中缓存,避免同时打满大模型的延迟与限流。
+"""
+import os
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict
+
+import database
+import models
+import crud
+from services import ai_planning
+
+
+PLAN_PRECOMPUTE_ENABLED = os.getenv("PLAN_PRECOMPUTE_ENABLED", "false").lower() in ("1", "true", "yes")
+# 每天开始预生成的本地时间(小时)
+PLAN_PRECOMPUTE_HOUR = int(os.getenv("PLAN_PRECOMPUTE_HOUR", "3"))
+# 每分钟最多处理的用户数,平摊对大模型服务商的请求
+PLAN_PRECOMPUTE_RATE_PER_MINUTE = float(os.getenv("PLAN_PRECOMPUTE_RATE_PER_MINUTE", "30"))
+PLAN_PRECOMPUTE_PERIOD = os.getenv("PLAN_PRECOMPUTE_PERIOD", "today")
+PLAN_PRECOMPUTE_MODE = os.getenv("PLAN_PRECOMPUTE_MODE", "enhanced")
+
+
+async def precompute_daily_plans(period: str = PLAN_PRECOMPUTE_PERIOD, use_ai: str = PLAN_PRECOMPUTE_MODE,
+                                 rate_per_minute: float = PLAN_PRECOMPUTE_RATE_PER_MINUTE) -> Dict[str, int]:
+    """为所有配置了AI的用户预生成当天的学习计划
+
+    已有有效缓存的用户会被跳过,因此中断后重新运行即可从断点继续。
+    """
+    interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0
+    stats = {"generated": 0, "skipped": 0, "failed": 0}
+
+    db = database.SessionLocal()
+    try:
+        user_ids = [row[0] for row in db.query(models.AIConfig.user_id).filter(
+            models.AIConfig.is_active == True
+        ).distinct().order_by(models.AIConfig.user_id).all()]
+    finally:
+        db.close()
+
+    print(f"[预生成] 开始为 {len(user_ids)} 个用户生成计划")
+    for user_id in user_ids:
+        db = database.SessionLocal()
+        try:
+            if crud.get_cached_plan(db, user_id, period, use_ai) is not None:
+                stats["skipped"] += 1
+                continue
+
+            plan = await ai_planning.generate_daily_plan(db, user_id, period, use_ai=use_ai, use_cache=False)
+            if crud.get_cached_plan(db, user_id, period, use_ai) is not None:
+                stats["generated"] += 1
+            else:
+                # AI失败降级或没有项目时不写入缓存,下次运行会重试
+                stats["failed"] += 1
+                print(f"[预生成] 用户 {user_id} 未能生成AI计划: {plan.get('error') or plan.get('note')}")
+        except Exception as e:
+            stats["failed"] += 1
+            print(f"[预生成] 用户 {user_id} 生成失败: {e}")
+        finally:
+            db.close()
+
+        if interval:
+            await asyncio.sleep(interval)
+
+    print(f"[预生成] 完成: {stats}")
+    return stats
+
+
+def _seconds_until(hour: int) -> float:
+    now = datetime.now()
+    run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return (run_at - now).total_seconds()
+
+
+async def run_scheduler():
+    """每天在 PLAN_PRECOMPUTE_HOUR 点执行一次预生成"""
+    while True:
+        await asyncio.sleep(_seconds_until(PLAN_PRECOMPUTE_HOUR))
+        try:
+            await precompute_daily_plans()
+        except Exception as e:
+            print(f"[预生成] 执行异常: {e}")
@@ -0,0 +1,134 @@
+"""
+软删除数据清理
+删除项目/任务时只写入 deleted_at 标记(读路径立即不可见),本模块在后台把它们的
+时间记录、预算以及标记行本身分批物理删除。每批在独立的短事务中执行并在线程池中运行,
+批与批之间让出时间,避免长时间锁住 SQLite 数据库阻塞其他用户的请求。
+"""
+import os
+import asyncio
+from typing import Dict, Set
+
+from sqlalchemy import exists, select
+
+import database
+import models
+from services import archive
+
+
+PURGE_ENABLED = os.getenv("PURGE_ENABLED", "true").lower() in ("1", "true", "yes")
+# 每批删除的行数
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+# 批与批之间的停顿(秒)
+PURGE_PAUSE_SECONDS = float(os.getenv("PURGE_PAUSE_SECONDS", "0.05"))
+# 两轮清理之间的间隔(秒)
+PURGE_INTERVAL_SECONDS = float(os.getenv("PURGE_INTERVAL_SECONDS", "30"))
+
+stats = {"runs": 0, "deleted": 0, "errors": 0}
+
+
+def _purge_steps():
+    """按依赖顺序排列的清理步骤: (名称, 表, 条件);父行最后删除,中断后重跑即可继续"""
+    projects = models.Project.__table__
+    tasks = models.Task.__table__
+    logs = models.TimeLog.__table__
+    budgets = models.ProjectBudget.__table__
+    daily = models.TimeLogDaily.__table__
+    deleted_projects = select(projects.c.id).where(projects.c.deleted_at.isnot(None))
+    deleted_tasks = select(tasks.c.id).where(tasks.c.deleted_at.isnot(None))
+    return [
+        ("time_logs(task)", logs, logs.c.task_id.in_(deleted_tasks)),
+        ("time_logs(project)", logs, logs.c.project_id.in_(deleted_projects)),
+        ("time_log_daily(task)", daily, daily.c.task_id.in_(deleted_tasks)),
+        ("time_log_daily(project)", daily, daily.c.project_id.in_(deleted_projects)),
+        ("project_budgets", budgets, budgets.c.project_id.in_(deleted_projects)),
+        ("tasks", tasks, tasks.c.deleted_at.isnot(None)),
+        ("projects", projects, projects.c.deleted_at.isnot(None)),
+    ]
+
+
+def _delete_batch(table, condition, batch_size: int) -> int:
+    """在独立事务中删除最多 batch_size 行满足条件的记录"""
+    db = database.SessionLocal()
+    try:
+        ids = select(table.c.id).where(condition).limit(batch_size)
+        result = db.execute(table.delete().where(table.c.id.in_(ids)))
+        db.commit()
+        return result.rowcount or 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _has_deleted() -> bool:
+    """是否有待物理删除的项目或任务(只读查询,不开启写事务)"""
+    db = database.SessionLocal()
+    try:
+        return bool(db.execute(select(
+            exists().where(models.Project.__table__.c.deleted_at.isnot(None))
+            | exists().where(models.Task.__table__.c.deleted_at.isnot(None))
+        )).scalar())
+    finally:
+        db.close()
+
+
+def _owners_with_deleted() -> Set[str]:
+    """有待物理删除的项目或任务的用户(删除后需要清理他们的归档分段)"""
+    projects = models.Project.__table__
+    tasks = models.Task.__table__
+    db = database.SessionLocal()
+    try:
+        owners = {r[0] for r in db.execute(select(projects.c.user_id).where(projects.c.deleted_at.isnot(None)).distinct())}
+        owners |= {r[0] for r in db.execute(
+            select(projects.c.user_id).where(projects.c.id.in_(
+                select(tasks.c.project_id).where(tasks.c.deleted_at.isnot(None))
+            )).distinct()
+        )}
+        return {owner for owner in owners if owner}
+    finally:
+        db.close()
+
+
+async def purge(batch_size: int = PURGE_BATCH_SIZE, pause: float = PURGE_PAUSE_SECONDS) -> Dict[str, int]:
+    """清理所有已软删除的数据,返回各步骤删除的行数
+
+    没有软删除标记时直接返回,空闲时不执行任何删除语句(避免周期性地占用 SQLite 写锁)。
+    """
+    deleted = {}
+    if not await asyncio.to_thread(_has_deleted):
+        stats["runs"] += 1
+        return deleted
+    owners = await asyncio.to_thread(_owners_with_deleted)
+    for name, table, condition in _purge_steps():
+        total = 0
+        while True:
+            count = await asyncio.to_thread(_delete_batch, table, condition, batch_size)
+            total += count
+            if count < batch_size:
+                break
+            await asyncio.sleep(pause)
+        if total:
+            deleted[name] = total
+    # 归档分段按用户+月份存放,不能按条件批量删除,逐个用户重写
+    pruned = 0
+    for owner in owners:
+        pruned += await asyncio.to_thread(archive.prune_segments, owner)
+    if pruned:
+        deleted["time_log_archives"] = pruned
+    stats["runs"] += 1
+    stats["deleted"] += sum(deleted.values())
+    if deleted:
+        print(f"[数据清理] 已删除: {deleted}")
+    return deleted
+
+
+async def run_periodically():
+    """每隔 PURGE_INTERVAL_SECONDS 执行一轮清理"""
+    while True:
+        try:
+            await purge()
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"[数据清理] 清理失败: {e}")
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
@@ -0,0 +1,245 @@
+"""
+计时器状态实时同步
+每个用户一个频道: 计时开始/暂停/停止提交后由 crud 发布事件,WebSocket 连接订阅本用户的频道并转发给客户端。
+连接期间有计时进行时,每 REALTIME_TICK_SECONDS 推送一次已计时长(由各连接按开始时间计算,不查询数据库)。
+
+默认使用进程内的发布订阅,只能送达连接在同一进程的客户端;
+多进程部署时设置 REALTIME_REDIS_URL,改由 Redis 的发布订阅在进程间转发(需安装 redis 包)。
+"""
+import os
+import json
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+import database
+import models
+
+
+REALTIME_REDIS_URL = os.getenv("REALTIME_REDIS_URL", "")
+REALTIME_TICK_SECONDS = float(os.getenv("REALTIME_TICK_SECONDS", "1"))
+
+CHANNEL_PREFIX = "timer:"
+# 每个连接待发送事件的上限,客户端读取过慢时丢弃最旧的事件
+QUEUE_SIZE = 100
+
+
+def _channel(user_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{user_id}"
+
+
+def _utc(value: datetime) -> datetime:
+    # SQLite 读回的时间不带时区,按UTC处理
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _elapsed(start_at: datetime) -> int:
+    return max(0, int((datetime.now(timezone.utc) - start_at).total_seconds()))
+
+
+class LocalBroker:
+    """进程内发布订阅
+
+    订阅者是各连接所在事件循环中的 asyncio.Queue;publish 可以在任意线程调用
+    (同步接口在线程池中执行),通过 call_soon_threadsafe 投递。
+    """
+
+    backend = "local"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self.stats = {"published": 0, "delivered": 0, "dropped": 0}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        self.stats["published"] += 1
+        self.deliver(channel, message)
+
+    def deliver(self, channel: str, message: Dict[str, Any]):
+        """投递给本进程内该频道的订阅者"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, message)
+            except RuntimeError:
+                # 订阅者所在的事件循环已关闭
+                self.unsubscribe(channel, queue)
+
+    def _put(self, queue: asyncio.Queue, message: Dict[str, Any]):
+        if queue.full():
+            queue.get_nowait()
+            self.stats["dropped"] += 1
+        queue.put_nowait(message)
+        self.stats["delivered"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            connections = sum(len(s) for s in self._subscribers.values())
+            channels = len(self._subscribers)
+        return {"backend": self.backend, "connections": connections, "channels": channels, **self.stats}
+
+
+class RedisBroker(LocalBroker):
+    """经 Redis 发布订阅在进程间转发: 每个进程订阅全部计时频道,收到的事件再分发给本进程内的订阅者"""
+
+    backend = "redis"
+
+    def __init__(self, url: str):
+        super().__init__()
+        # 可选依赖,只在配置了 REALTIME_REDIS_URL 时需要
+        import redis
+        import redis.asyncio
+        self._client = redis.Redis.from_url(url)
+        self._async_client = redis.asyncio.Redis.from_url(url)
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        await self._async_client.close()
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self._async_client.pubsub()
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                async for item in pubsub.listen():
+                    if item["type"] == "pmessage":
+                        self.deliver(item["channel"].decode(), json.loads(item["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[实时] Redis订阅中断,1秒后重连: {e}")
+                await asyncio.sleep(1)
+
+    def publish(self, channel: str, message: Dict[str, Any]):
+        self.stats["published"] += 1
+        self._client.publish(channel, json.dumps(message))
+
+
+broker = RedisBroker(REALTIME_REDIS_URL) if REALTIME_REDIS_URL else LocalBroker()
+
+
+# --- 计时事件 ---
+def _timer_payload(log: models.TimeLog) -> Dict[str, Any]:
+    start_at = _utc(log.start_at)
+    return {"task_id": str(log.task_id), "log_id": str(log.id), "start_at": start_at.isoformat()}
+
+
+def publish_timer_event(user_id: str, event: str, log: models.TimeLog):
+    """在计时记录提交后发布事件(timer.started / timer.paused / timer.stopped)
+
+    发布失败只记录日志: 数据已经提交,客户端重连时会收到最新的快照。
+    """
+    message = {"type": event, **_timer_payload(log)}
+    if event != "timer.started":
+        message["duration_seconds"] = log.duration_seconds
+    try:
+        broker.publish(_channel(user_id), message)
+    except Exception as e:
+        print(f"[实时] 发布计时事件失败: {e}")
+
+
+def active_timers(db: Session, user_id: str) -> List[Dict[str, Any]]:
+    """用户当前进行中的计时(未结束的计时记录)"""
+    logs = db.query(models.TimeLog).filter(
+        models.TimeLog.user_id == user_id,
+        models.TimeLog.log_type == "TIMER",
+        models.TimeLog.end_at.is_(None)
+    ).all()
+    return [_timer_payload(log) for log in logs if log.start_at]
+
+
+def _load_active_timers(user_id: str) -> List[Dict[str, Any]]:
+    # 会话只用于读取快照,不在整个连接期间占用连接池
+    with database.SessionLocal() as db:
+        return active_timers(db, user_id)
+
+
+# --- 连接 ---
+def _ticks(running: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {"task_id": task_id, "elapsed_seconds": _elapsed(timer["start"])}
+        for task_id, timer in running.items()
+    ]
+
+
+async def _until_disconnect(websocket: WebSocket):
+    """读取并忽略客户端消息,连接关闭时返回"""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def serve(websocket: WebSocket, user_id: str):
+    """转发用户频道的计时事件,并在有计时进行时定期推送已计时长
+
+    连接建立后先发送 timer.snapshot(当前进行中的计时);之后每个事件原样转发,
+    计时进行中每 REALTIME_TICK_SECONDS 发送一次 timer.tick。
+    先订阅再读取快照: 读取期间发布的事件留在队列中,快照之后按顺序应用(重复应用不改变结果)。
+    """
+    channel = _channel(user_id)
+    queue = broker.subscribe(channel)
+    loop = asyncio.get_running_loop()
+    closed = asyncio.ensure_future(_until_disconnect(websocket))
+    try:
+        timers = await asyncio.to_thread(_load_active_timers, user_id)
+        running = {t["task_id"]: {**t, "start": datetime.fromisoformat(t["start_at"])} for t in timers}
+        await websocket.send_json({"type": "timer.snapshot", "timers": [
+            {**{k: v for k, v in t.items() if k != "start"}, "elapsed_seconds": _elapsed(t["start"])}
+            for t in running.values()
+        ]})
+        next_tick = loop.time() + REALTIME_TICK_SECONDS
+        while not closed.done():
+            getter = asyncio.ensure_future(queue.get())
+            timeout = max(0.0, next_tick - loop.time()) if running else None
+            done, _ = await asyncio.wait({getter, closed}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                message = getter.result()
+                if message["type"] == "timer.started":
+                    running[message["task_id"]] = {**message, "start": datetime.fromisoformat(message["start_at"])}
+                else:
+                    running.pop(message.get("task_id"), None)
+                await websocket.send_json(message)
+            else:
+                getter.cancel()
+            if running and loop.time() >= next_tick and not closed.done():
+                await websocket.send_json({"type": "timer.tick", "timers": _ticks(running)})
+            if loop.time() >= next_tick or not running:
+                next_tick = loop.time() + REALTIME_TICK_SECONDS
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed.cancel()
+        broker.unsubscribe(channel, queue)
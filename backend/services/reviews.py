@@ -0,0 +1,87 @@
+"""
+间隔复习(艾宾浩斯遗忘曲线)
+任务完成时按第一个间隔安排复习;每次复习记住则推进到下一个间隔,忘记则回到第一个间隔,
+全部间隔复习完后不再安排(next_review_at 为空)。任务重新打开时取消复习计划。
+待复习队列按 (user_id, next_review_at) 索引做范围扫描,不扫描全部任务。
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+import crud
+
+
+# 复习间隔(天),逗号分隔
+REVIEW_INTERVALS = [float(d) for d in os.getenv("REVIEW_INTERVALS", "1,2,4,7,15,30").split(",") if d.strip()]
+
+
+def next_review_at(stage: int, now: Optional[datetime] = None) -> Optional[datetime]:
+    """第 stage 个间隔之后的复习时间,超出间隔列表时返回 None(已掌握)"""
+    if stage >= len(REVIEW_INTERVALS):
+        return None
+    return (now or datetime.now(timezone.utc)) + timedelta(days=REVIEW_INTERVALS[stage])
+
+
+def on_status_change(task: models.Task, was_done: bool, now: Optional[datetime] = None):
+    """任务状态变化后调整复习计划
+
+    只修改会话中的对象,由调用方(crud 的写路径)的 commit 一并提交。
+    """
+    is_done = task.status == 'done'
+    if is_done and not was_done:
+        task.review_stage = 0
+        task.next_review_at = next_review_at(0, now)
+    elif was_done and not is_done:
+        task.next_review_at = None
+
+
+def get_due_tasks(db: Session, user_id: str, until: Optional[datetime] = None, limit: int = 50) -> List[models.Task]:
+    """截至 until(默认当前时间)到期的复习任务,最早到期的在前"""
+    until = until or datetime.now(timezone.utc)
+    tasks = db.query(models.Task).filter(
+        models.Task.user_id == user_id,
+        models.Task.next_review_at <= until
+    ).order_by(models.Task.next_review_at).limit(limit).all()
+
+    project_ids = {t.project_id for t in tasks}
+    names = dict(db.query(models.Project.id, models.Project.name).filter(
+        models.Project.id.in_(project_ids)
+    ).all()) if project_ids else {}
+    for t in tasks:
+        t.project_name = names.get(t.project_id, "Unknown")
+        t.status = crud.TASK_STATUS_MAP.get(t.status, t.status)
+    return tasks
+
+
+def next_due_at(db: Session, user_id: str, after: datetime) -> Optional[datetime]:
+    """after 之后最早的复习到期时间,没有时返回 None"""
+    return db.query(func.min(models.Task.next_review_at)).filter(
+        models.Task.user_id == user_id,
+        models.Task.next_review_at > after
+    ).scalar()
+
+
+def review_task(db: Session, user_id: str, task_id: str, remembered: bool) -> Optional[models.Task]:
+    """记录一次复习并安排下一次,任务不存在时返回 None
+
+    Raises:
+        ValueError: 任务尚未完成
+    """
+    task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.user_id == user_id).first()
+    if not task:
+        return None
+    if task.status != 'done':
+        raise ValueError("Only completed tasks can be reviewed")
+
+    now = datetime.now(timezone.utc)
+    task.review_stage = task.review_stage + 1 if remembered else 0
+    task.next_review_at = next_review_at(task.review_stage, now)
+    task.last_reviewed_at = now
+    crud.record_change(db, user_id, 'task', task.id)
+    crud.bump_data_version(db, user_id)
+    db.commit()
+    return crud.get_task(db, task.id)
@@ -0,0 +1,251 @@
+"""
+任务与项目全文检索
+SQLite: FTS5 虚拟表 search_index(kind, ref, owner, title, body),由 tasks/projects 上的触发器同步,
+        ref/owner 是任务(项目)ID与用户ID的十六进制,查询时用列过滤限定到当前用户;
+        候选行在应用中打分排序。
+PostgreSQL: tasks/projects 上的 to_tsvector 表达式 GIN 索引。
+查询的每个词都按前缀匹配,结果按相关度排序并分页。
+"""
+import os
+import re
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Float, String, text
+from sqlalchemy.orm import Session
+
+import database
+import models
+import crud
+
+
+KINDS = ('task', 'project')
+
+# SQLite 上每次查询最多取回并打分的候选行数(超出部分不参与排序)
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "2000"))
+
+# 参与检索的列的权重: 标题命中比描述命中更相关
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+_TRIGGERS = ('search_tasks_ai', 'search_tasks_au', 'search_tasks_ad',
+             'search_projects_ai', 'search_projects_au', 'search_projects_ad')
+
+_TASK_ROW = """
+    SELECT 'task', hex(new.id), hex(p.user_id), search_text(new.title), search_text(new.description)
+    FROM projects p WHERE p.id = new.project_id AND new.deleted_at IS NULL
+"""
+_PROJECT_ROW = """
+    SELECT 'project', hex(new.id), hex(new.user_id), search_text(new.name), NULL
+    WHERE new.deleted_at IS NULL
+"""
+_DELETE_OLD = """DELETE FROM search_index WHERE search_index MATCH 'ref:"' || hex(old.id) || '"';"""
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(kind UNINDEXED, ref, owner, title, body)",
+    f"CREATE TRIGGER search_tasks_ai AFTER INSERT ON tasks BEGIN INSERT INTO search_index {_TASK_ROW}; END",
+    f"""CREATE TRIGGER search_tasks_au AFTER UPDATE OF title, description, project_id, deleted_at ON tasks BEGIN
+        {_DELETE_OLD} INSERT INTO search_index {_TASK_ROW}; END""",
+    f"CREATE TRIGGER search_tasks_ad AFTER DELETE ON tasks BEGIN {_DELETE_OLD} END",
+    f"CREATE TRIGGER search_projects_ai AFTER INSERT ON projects BEGIN INSERT INTO search_index {_PROJECT_ROW}; END",
+    f"""CREATE TRIGGER search_projects_au AFTER UPDATE OF name, deleted_at ON projects BEGIN
+        {_DELETE_OLD} INSERT INTO search_index {_PROJECT_ROW}; END""",
+    f"CREATE TRIGGER search_projects_ad AFTER DELETE ON projects BEGIN {_DELETE_OLD} END",
+]
+
+_SQLITE_BACKFILL = [
+    "DELETE FROM search_index",
+    """INSERT INTO search_index (kind, ref, owner, title, body)
+       SELECT 'task', hex(t.id), hex(p.user_id), search_text(t.title), search_text(t.description)
+       FROM tasks t JOIN projects p ON p.id = t.project_id
+       WHERE t.deleted_at IS NULL AND p.deleted_at IS NULL""",
+    """INSERT INTO search_index (kind, ref, owner, title, body)
+       SELECT 'project', hex(id), hex(user_id), search_text(name), NULL
+       FROM projects WHERE deleted_at IS NULL""",
+]
+
+
+def _task_vector(prefix: str = "") -> str:
+    return f"to_tsvector('simple', coalesce({prefix}title, '') || ' ' || coalesce({prefix}description, ''))"
+
+
+def _project_vector(prefix: str = "") -> str:
+    return f"to_tsvector('simple', coalesce({prefix}name, ''))"
+
+
+_POSTGRES_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_tasks_search ON tasks USING GIN ({_task_vector()})",
+    f"CREATE INDEX IF NOT EXISTS ix_projects_search ON projects USING GIN ({_project_vector()})",
+]
+
+
+def ensure_search_index(bind=None):
+    """创建检索索引(幂等)
+
+    SQLite 上触发器缺失时(首次启用,或表被 UUID 迁移重建后)重新创建触发器并按现有数据重建索引。
+    """
+    bind = bind or database.engine
+    with bind.begin() as conn:
+        if bind.dialect.name == "postgresql":
+            for ddl in _POSTGRES_DDL:
+                conn.exec_driver_sql(ddl)
+            return
+        if bind.dialect.name != "sqlite":
+            return
+        present = {row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'search_%'"
+        )}
+        if present >= set(_TRIGGERS):
+            return
+        for name in _TRIGGERS:
+            conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+        for ddl in _SQLITE_DDL:
+            conn.exec_driver_sql(ddl)
+        for sql in _SQLITE_BACKFILL:
+            conn.exec_driver_sql(sql)
+        count = conn.exec_driver_sql("SELECT count(*) FROM search_index").scalar()
+    print(f"[检索] 已重建全文索引: {count} 条")
+
+
+# --- 查询 ---
+def _terms(q: str) -> List[str]:
+    return [term for term in q.split() if term]
+
+
+def _phrases(terms: Sequence[str]) -> List[Tuple[List[str], bool]]:
+    """把每个词拆成分词后的短语: (词元列表, 末尾是否按前缀匹配)
+
+    汉字按单字成词,末尾是汉字时单字已是完整的词,不需要前缀匹配(前缀查询明显更慢)。
+    """
+    phrases = []
+    for term in terms:
+        tokens = re.findall(r"\w+", database.search_text(term).lower())
+        if tokens:
+            phrases.append((tokens, not database._CJK.match(tokens[-1])))
+    return phrases
+
+
+def _fts_query(user_id: str, phrases) -> str:
+    """所有短语都要出现在标题或描述中,并限定到当前用户"""
+    owner = database._uuid_bytes(user_id).hex().upper()
+    parts = " ".join('"' + " ".join(tokens) + '"' + ("*" if prefix else "") for tokens, prefix in phrases)
+    return f'owner:"{owner}" AND {{title body}}:({parts})'
+
+
+def _count_phrase(tokens: List[str], phrase: List[str], prefix: bool) -> int:
+    n = len(phrase)
+    hits = 0
+    for i in range(len(tokens) - n + 1):
+        if tokens[i:i + n - 1] == phrase[:-1] and (
+            tokens[i + n - 1].startswith(phrase[-1]) if prefix else tokens[i + n - 1] == phrase[-1]
+        ):
+            hits += 1
+    return hits
+
+
+def _score(phrases, title: Optional[str], body: Optional[str]) -> float:
+    """命中次数按列加权并按文本长度归一化: 标题命中、短文本中的命中得分更高"""
+    score = 0.0
+    for text_value, weight in ((title, TITLE_WEIGHT), (body, BODY_WEIGHT)):
+        tokens = re.findall(r"\w+", (text_value or "").lower())
+        if tokens:
+            hits = sum(_count_phrase(tokens, phrase, prefix) for phrase, prefix in phrases)
+            score += weight * hits / math.sqrt(len(tokens))
+    return score
+
+
+def _ts_query(terms: Sequence[str]) -> str:
+    words = [w for term in terms for w in re.findall(r"\w+", term)]
+    return " & ".join(f"{w}:*" for w in words)
+
+
+def _uuid_from_hex(value: str) -> str:
+    h = value.lower()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}" if len(h) == 32 else bytes.fromhex(h).decode()
+
+
+def _ranked_refs(db: Session, user_id: str, terms: Sequence[str], kinds: Sequence[str], limit: int, offset: int):
+    """返回 [(类型, ID, 得分)],按相关度从高到低"""
+    if db.get_bind().dialect.name == "postgresql":
+        params = {"limit": limit, "offset": offset}
+        query = _ts_query(terms)
+        if not query:
+            return []
+        parts = []
+        if 'task' in kinds:
+            parts.append(f"""SELECT 'task' AS kind, CAST(t.id AS TEXT) AS ref, ts_rank({_task_vector('t.')}, q) AS score
+                FROM tasks t JOIN projects p ON p.id = t.project_id, to_tsquery('simple', :q) q
+                WHERE p.user_id = CAST(:user_id AS uuid) AND t.deleted_at IS NULL AND p.deleted_at IS NULL
+                  AND {_task_vector('t.')} @@ q""")
+        if 'project' in kinds:
+            parts.append(f"""SELECT 'project' AS kind, CAST(p.id AS TEXT) AS ref, ts_rank({_project_vector('p.')}, q) AS score
+                FROM projects p, to_tsquery('simple', :q) q
+                WHERE p.user_id = CAST(:user_id AS uuid) AND p.deleted_at IS NULL AND {_project_vector('p.')} @@ q""")
+        sql = " UNION ALL ".join(parts) + " ORDER BY score DESC LIMIT :limit OFFSET :offset"
+        params.update(q=query, user_id=str(user_id))
+        rows = db.execute(text(sql).columns(kind=String, ref=String, score=Float), params)
+        return [(kind, ref, score) for kind, ref, score in rows]
+
+    phrases = _phrases(terms)
+    if not phrases:
+        return []
+    params = {"q": _fts_query(user_id, phrases), "cap": SEARCH_MAX_CANDIDATES}
+    kind_filter = ""
+    if set(kinds) != set(KINDS):
+        kind_filter = "AND kind IN (" + ", ".join(f"'{k}'" for k in kinds) + ")"
+    # 不使用 bm25(): 它要按全表统计每个短语的文档数,常见词在百万级索引上需要数百毫秒;
+    # 当前用户的候选行很少,取回后在这里打分排序
+    sql = f"""SELECT kind, ref, title, body FROM search_index
+        WHERE search_index MATCH :q {kind_filter} LIMIT :cap"""
+    rows = db.execute(text(sql).columns(kind=String, ref=String, title=String, body=String), params)
+    ranked = sorted(
+        ((kind, _uuid_from_hex(ref), _score(phrases, title, body)) for kind, ref, title, body in rows),
+        key=lambda item: -item[2]
+    )
+    return ranked[offset:offset + limit]
+
+
+def search(db: Session, user_id: str, q: str, kinds: Sequence[str] = KINDS,
+           limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """检索当前用户的任务与项目,返回一页按相关度排序的结果"""
+    terms = _terms(q)
+    kinds = [k for k in kinds if k in KINDS]
+    if not terms or not kinds:
+        return {"items": [], "limit": limit, "offset": offset, "has_more": False}
+
+    # 多取一条判断是否还有下一页
+    refs = _ranked_refs(db, user_id, terms, kinds, limit + 1, offset)
+    has_more = len(refs) > limit
+    refs = refs[:limit]
+
+    task_ids = [ref for kind, ref, _ in refs if kind == 'task']
+    project_ids = [ref for kind, ref, _ in refs if kind == 'project']
+    tasks = {t.id: t for t in db.query(models.Task).filter(models.Task.id.in_(task_ids))} if task_ids else {}
+    project_ids += [t.project_id for t in tasks.values()]
+    projects = {
+        p.id: p for p in db.query(models.Project).filter(
+            models.Project.id.in_(project_ids), models.Project.user_id == user_id
+        )
+    } if project_ids else {}
+
+    items = []
+    for kind, ref, score in refs:
+        if kind == 'task':
+            task = tasks.get(ref)
+            project = projects.get(task.project_id) if task else None
+            if project is None:
+                continue
+            items.append({
+                "type": "task", "id": task.id, "title": task.title, "description": task.description,
+                "project_id": project.id, "project_name": project.name,
+                "status": crud.TASK_STATUS_MAP.get(task.status, task.status), "score": score
+            })
+        else:
+            project = projects.get(ref)
+            if project is None:
+                continue
+            items.append({
+                "type": "project", "id": project.id, "title": project.name,
+                "description": project.description, "score": score
+            })
+    return {"items": items, "limit": limit, "offset": offset, "has_more": has_more}
@@ -0,0 +1,111 @@
+"""
+请求合并(Single-flight)
+相同key的并发请求只触发一次上游调用,其余请求等待同一个结果;
+流式请求则共享同一条事件流,后加入的订阅者会先回放已产生的事件。
+"""
+import asyncio
+import copy
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """合并并发的相同协程调用"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self) -> int:
+        """当前正在执行的调用数"""
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行fn;若相同key的调用正在进行,则等待其结果
+
+        共享调用运行在独立的Task中,单个等待方被取消不会中断其他等待方。
+        返回值为深拷贝,调用方可以放心修改。
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+
+        result = await asyncio.shield(future)
+        return copy.deepcopy(result)
+
+    def _finish(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # 取出异常,避免所有等待方都已取消时出现 "exception was never retrieved"
+        if not future.cancelled():
+            future.exception()
+
+
+class _Channel:
+    """可回放的广播通道"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.closed = False
+        self._cond = asyncio.Condition()
+
+    async def publish(self, event: Any):
+        async with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    async def close(self):
+        async with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncGenerator[Any, None]:
+        index = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: index < len(self.events) or self.closed)
+                pending = self.events[index:]
+                closed = self.closed
+            for event in pending:
+                yield event
+            index += len(pending)
+            if closed and index >= len(self.events):
+                return
+
+
+class StreamSingleFlight:
+    """合并并发的相同流式请求"""
+
+    def __init__(self):
+        self._channels: Dict[Hashable, _Channel] = {}
+
+    def in_flight(self) -> int:
+        """当前正在生成的事件流数"""
+        return len(self._channels)
+
+    async def subscribe(
+        self,
+        key: Hashable,
+        producer: Callable[[], AsyncGenerator[Any, None]]
+    ) -> AsyncGenerator[Any, None]:
+        """订阅key对应的事件流;没有进行中的流时由producer创建
+
+        生产者运行在独立的Task中,任一订阅者断开连接都不会影响其他订阅者。
+        """
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = _Channel()
+            self._channels[key] = channel
+            asyncio.ensure_future(self._run(key, channel, producer()))
+
+        async for event in channel.subscribe():
+            yield event
+
+    async def _run(self, key: Hashable, channel: _Channel, events: AsyncGenerator[Any, None]):
+        try:
+            async for event in events:
+                await channel.publish(event)
+        finally:
+            if self._channels.get(key) is channel:
+                del self._channels[key]
+            await channel.close()
@@ -1,12 +1,27 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, and_, cast, literal, String, Integer
+import numpy as np
 import models
 import schemas
-from datetime import date, timedelta, datetime
+from services import archive, analytics_cache
+from datetime import date, timedelta, datetime, timezone
+from typing import Optional
 
 
-def get_date_range(period: str):
-    """根据时间周期获取日期范围"""
+# 趋势统计支持的时间粒度(week 为ISO周,以周一为起点)
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+# 自动选择粒度时,各粒度允许覆盖的最大天数
+AUTO_GRANULARITY_MAX_DAYS = (('day', 62), ('week', 366))
+
+
+def get_date_range(period: str, start: Optional[date] = None, end: Optional[date] = None):
+    """根据时间周期获取日期范围;显式传入的 start/end 优先(均包含当天)"""
+    start_date, end_date = _period_range(period)
+    return start or start_date, end or end_date
+
+
+def _period_range(period: str):
     end_date = date.today()
 
     if period == 'week':
@@ -23,16 +38,31 @@ def get_date_range(period: str):
     return start_date, end_date
 
 
-def get_overview_stats(db: Session, user_id: str, period: str = 'week') -> schemas.OverviewStats:
+def _archived_query(db: Session, user_id: str, start_date: date, end_date: date, *columns):
+    """查询已归档时间记录的按日汇总(与热表 time_logs 互不重叠)"""
+    return db.query(*columns)\
+        .filter(models.TimeLogDaily.user_id == user_id)\
+        .filter(models.TimeLogDaily.log_date >= start_date)\
+        .filter(models.TimeLogDaily.log_date <= end_date)
+
+
+def get_overview_stats(db: Session, user_id: str, period: str = 'week', start: Optional[date] = None,
+                       end: Optional[date] = None) -> schemas.OverviewStats:
     """获取概览统计数据"""
-    start_date, end_date = get_date_range(period)
+    start_date, end_date = get_date_range(period, start, end)
+
+    # 启用分析缓存时,时长类指标直接在内存数组上计算
+    series = analytics_cache.cache.get(db, user_id)
 
     # 今日学习时长
     today = date.today()
-    today_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
-        .filter(models.TimeLog.user_id == user_id)\
-        .filter(models.TimeLog.log_date == today)\
-        .scalar() or 0
+    if series is not None:
+        today_duration = series.total(today, today)
+    else:
+        today_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
+            .filter(models.TimeLog.user_id == user_id)\
+            .filter(models.TimeLog.log_date == today)\
+            .scalar() or 0
 
     # 活跃项目数（status为active的项目）
     active_projects = db.query(func.count(models.Project.id))\
@@ -47,19 +77,29 @@ def get_overview_stats(db: Session, user_id: str, period: str = 'week') -> schem
         .filter(models.Task.status.in_(['todo', 'in_progress']))\
         .scalar() or 0
 
-    # 总学习时长
-    total_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
-        .filter(models.TimeLog.user_id == user_id)\
-        .filter(models.TimeLog.log_date >= start_date)\
-        .filter(models.TimeLog.log_date <= end_date)\
-        .scalar() or 0
+    if series is not None:
+        total_duration = series.total(start_date, end_date)
+        study_days = series.study_days(start_date, end_date)
+    else:
+        # 总学习时长(热数据 + 归档汇总)
+        total_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
+            .filter(models.TimeLog.user_id == user_id)\
+            .filter(models.TimeLog.log_date >= start_date)\
+            .filter(models.TimeLog.log_date <= end_date)\
+            .scalar() or 0
+        total_duration += _archived_query(
+            db, user_id, start_date, end_date, func.sum(models.TimeLogDaily.duration_seconds)
+        ).scalar() or 0
 
-    # 学习天数（有记录的日期数量）
-    study_days = db.query(func.count(func.distinct(models.TimeLog.log_date)))\
-        .filter(models.TimeLog.user_id == user_id)\
-        .filter(models.TimeLog.log_date >= start_date)\
-        .filter(models.TimeLog.log_date <= end_date)\
-        .scalar() or 0
+        # 学习天数（有记录的日期数量）
+        hot_days = db.query(models.TimeLog.log_date)\
+            .filter(models.TimeLog.user_id == user_id)\
+            .filter(models.TimeLog.log_date >= start_date)\
+            .filter(models.TimeLog.log_date <= end_date)
+        archived_days = _archived_query(db, user_id, start_date, end_date, models.TimeLogDaily.log_date)
+        study_days = db.query(func.count())\
+            .select_from(hot_days.union(archived_days).subquery())\
+            .scalar() or 0
 
     # 日均学习时长
     avg_daily_duration = int(total_duration / study_days) if study_days > 0 else 0
@@ -72,12 +112,6 @@ def get_overview_stats(db: Session, user_id: str, period: str = 'week') -> schem
         .scalar() or 0
 
     # 计算精力达标率（简化计算，实际可能需要更复杂的逻辑）
-    all_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
-        .filter(models.TimeLog.user_id == user_id)\
-        .filter(models.TimeLog.log_date >= start_date)\
-        .filter(models.TimeLog.log_date <= end_date)\
-        .scalar() or 0
-
     # 简化：假设达标率为日均学习时长/目标时长（8小时=28800秒）
     energy_rate = int((avg_daily_duration / 28800) * 100) if avg_daily_duration > 0 else 0
 
@@ -93,9 +127,28 @@ def get_overview_stats(db: Session, user_id: str, period: str = 'week') -> schem
     )
 
 
-def get_project_time_distribution(db: Session, user_id: str, period: str = 'week') -> list[schemas.ProjectTimeDistribution]:
+def get_project_time_distribution(db: Session, user_id: str, period: str = 'week', start: Optional[date] = None,
+                                  end: Optional[date] = None) -> list[schemas.ProjectTimeDistribution]:
     """获取项目时间分布"""
-    start_date, end_date = get_date_range(period)
+    start_date, end_date = get_date_range(period, start, end)
+
+    series = analytics_cache.cache.get(db, user_id)
+    if series is not None:
+        durations = series.by_project(start_date, end_date)
+        projects = db.query(models.Project)\
+            .filter(models.Project.user_id == user_id)\
+            .filter(models.Project.id.in_(list(durations)))\
+            .all()
+        return [
+            schemas.ProjectTimeDistribution(
+                id=str(project.id),
+                name=project.name,
+                color_hex=project.color_hex,
+                icon=project.icon,
+                duration=durations[project.id]
+            )
+            for project in projects
+        ]
 
     # 查询每个项目的时间分布
     project_times = db.query(
@@ -111,87 +164,182 @@ def get_project_time_distribution(db: Session, user_id: str, period: str = 'week
      .group_by(models.Project.id, models.Project.name, models.Project.color_hex, models.Project.icon)\
      .all()
 
-    return [
-        schemas.ProjectTimeDistribution(
+    archived = dict(_archived_query(
+        db, user_id, start_date, end_date,
+        models.TimeLogDaily.project_id, func.sum(models.TimeLogDaily.duration_seconds)
+    ).group_by(models.TimeLogDaily.project_id).all())
+
+    results = {
+        pt.id: schemas.ProjectTimeDistribution(
             id=str(pt.id),
             name=pt.name,
             color_hex=pt.color_hex,
             icon=pt.icon,
-            duration=pt.duration or 0
+            duration=(pt.duration or 0) + (archived.pop(pt.id, 0) or 0)
         )
         for pt in project_times
-    ]
-
-
-def get_daily_trend(db: Session, user_id: str, period: str = 'week') -> list[schemas.DailyTrend]:
-    """获取每日学习时长趋势"""
-    start_date, end_date = get_date_range(period)
-
-    # 查询每日学习时长
-    daily_times = db.query(
+    }
+    if archived:
+        # 只有归档数据的项目
+        for project in db.query(models.Project).filter(models.Project.id.in_(list(archived))).all():
+            results[project.id] = schemas.ProjectTimeDistribution(
+                id=str(project.id),
+                name=project.name,
+                color_hex=project.color_hex,
+                icon=project.icon,
+                duration=archived[project.id] or 0
+            )
+    return list(results.values())
+
+
+def time_bucket(dialect: str, granularity: str, log_date, timestamp):
+    """生成按粒度截断时间的SQL表达式,返回桶起点的字符串标签
+
+    day/week/month 按 log_date 分桶,hour 按记录的开始时间分桶。
+    SQLite 使用 strftime/date 修饰符,PostgreSQL 使用 date_trunc + to_char。
+    """
+    if dialect == 'postgresql':
+        if granularity == 'hour':
+            return func.to_char(func.date_trunc('hour', timestamp), 'YYYY-MM-DD HH24:00')
+        return func.to_char(func.date_trunc(granularity, log_date), 'YYYY-MM-DD')
+
+    if granularity == 'hour':
+        return func.strftime('%Y-%m-%d %H:00', timestamp)
+    if granularity == 'week':
+        # 回退到本周一: %w 中周日为0
+        offset = (cast(func.strftime('%w', log_date), Integer) + 6) % 7
+        return func.date(log_date, literal('-') + cast(offset, String) + literal(' days'))
+    if granularity == 'month':
+        return func.strftime('%Y-%m-01', log_date)
+    return func.strftime('%Y-%m-%d', log_date)
+
+
+def resolve_granularity(db: Session, user_id: str, start_date: date, end_date: date,
+                        granularity: Optional[str]) -> str:
+    """未指定粒度时按时间跨度自动选择,使长时间范围返回的数据点数量有上限"""
+    if granularity:
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        return granularity
+
+    if start_date == date.min:
+        # "all" 周期从用户第一条记录开始计算跨度
+        first = db.query(func.min(models.TimeLog.log_date))\
+            .filter(models.TimeLog.user_id == user_id)\
+            .scalar()
+        first_archived = db.query(func.min(models.TimeLogDaily.log_date))\
+            .filter(models.TimeLogDaily.user_id == user_id)\
+            .scalar()
+        start_date = min(filter(None, (first, first_archived)), default=end_date)
+
+    days = (end_date - start_date).days + 1
+    for name, max_days in AUTO_GRANULARITY_MAX_DAYS:
+        if days <= max_days:
+            return name
+    return 'month'
+
+
+def get_daily_trend(db: Session, user_id: str, period: str = 'week', start: Optional[date] = None,
+                    end: Optional[date] = None, granularity: Optional[str] = None) -> list[schemas.DailyTrend]:
+    """获取学习时长趋势,在数据库中按 小时/天/周/月 分桶汇总"""
+    start_date, end_date = get_date_range(period, start, end)
+    granularity = resolve_granularity(db, user_id, start_date, end_date, granularity)
+
+    series = analytics_cache.cache.get(db, user_id) if granularity != 'hour' else None
+    if series is not None:
+        return [
+            schemas.DailyTrend(date=label, duration=duration)
+            for label, duration in series.trend(start_date, end_date, granularity)
+        ]
+
+    dialect = db.get_bind().dialect.name
+    bucket = time_bucket(
+        dialect,
+        granularity,
         models.TimeLog.log_date,
+        func.coalesce(models.TimeLog.start_at, models.TimeLog.created_at)
+    ).label('bucket')
+
+    buckets = db.query(
+        bucket,
         func.sum(models.TimeLog.duration_seconds).label('duration')
     ).filter(models.TimeLog.user_id == user_id)\
      .filter(models.TimeLog.log_date >= start_date)\
      .filter(models.TimeLog.log_date <= end_date)\
-     .group_by(models.TimeLog.log_date)\
-     .order_by(models.TimeLog.log_date)\
+     .group_by(bucket)\
+     .order_by(bucket)\
      .all()
 
+    totals = {str(b.bucket): b.duration or 0 for b in buckets}
+    if granularity == 'hour':
+        # 归档汇总只到天,小时粒度从归档分段中读取开始时间
+        for row in archive.archived_rows(db, user_id, start_date, end_date):
+            started = row['start_at'] or row['created_at']
+            if started is None:
+                continue
+            if started.tzinfo is not None:
+                started = started.astimezone(timezone.utc)
+            key = started.strftime('%Y-%m-%d %H:00')
+            totals[key] = totals.get(key, 0) + (row['duration_seconds'] or 0)
+    else:
+        archived_bucket = time_bucket(
+            dialect, granularity, models.TimeLogDaily.log_date, models.TimeLogDaily.log_date
+        ).label('bucket')
+        for b in _archived_query(
+            db, user_id, start_date, end_date, archived_bucket, func.sum(models.TimeLogDaily.duration_seconds)
+        ).group_by(archived_bucket).all():
+            totals[str(b[0])] = totals.get(str(b[0]), 0) + (b[1] or 0)
+
     return [
-        schemas.DailyTrend(
-            date=str(dt.log_date),
-            duration=dt.duration or 0
-        )
-        for dt in daily_times
+        schemas.DailyTrend(date=bucket_label, duration=duration)
+        for bucket_label, duration in sorted(totals.items())
     ]
 
 
-def get_energy_distribution(db: Session, user_id: str, period: str = 'week') -> list[schemas.EnergyDistribution]:
+def get_energy_distribution(db: Session, user_id: str, period: str = 'week', start: Optional[date] = None,
+                            end: Optional[date] = None) -> list[schemas.EnergyDistribution]:
     """获取精力分配对比"""
-    start_date, end_date = get_date_range(period)
+    start_date, end_date = get_date_range(period, start, end)
 
     # 查询所有项目
     projects = db.query(models.Project)\
         .filter(models.Project.user_id == user_id)\
         .all()
 
+    series = analytics_cache.cache.get(db, user_id)
+    if series is not None:
+        cached_durations = series.by_project(start_date, end_date)
+        all_duration = series.total(start_date, end_date)
+    else:
+        # 归档数据按项目的时长,以及时间段内全部项目的总时长(只计算一次)
+        archived = dict(_archived_query(
+            db, user_id, start_date, end_date,
+            models.TimeLogDaily.project_id, func.sum(models.TimeLogDaily.duration_seconds)
+        ).group_by(models.TimeLogDaily.project_id).all())
+        all_duration = (db.query(func.sum(models.TimeLog.duration_seconds))\
+            .filter(models.TimeLog.user_id == user_id)\
+            .filter(models.TimeLog.log_date >= start_date)\
+            .filter(models.TimeLog.log_date <= end_date)\
+            .scalar() or 0) + sum(v or 0 for v in archived.values())
+
     results = []
 
     for project in projects:
-        # 获取当前目标精力（从预算表）
-        budget = db.query(models.ProjectBudget)\
-            .filter(models.ProjectBudget.project_id == project.id)\
-            .filter(models.ProjectBudget.valid_to == None)\
-            .first()
-
-        target_energy = budget.target_percentage if budget else 0
+        # 当前目标精力与任务统计直接读取项目的计数列
+        target_energy = project.current_target_percentage or 0
 
         # 计算该时间段内的总学习时长
-        total_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
-            .filter(models.TimeLog.project_id == project.id)\
-            .filter(models.TimeLog.log_date >= start_date)\
-            .filter(models.TimeLog.log_date <= end_date)\
-            .scalar() or 0
-
-        # 获取任务统计
-        total_tasks = db.query(func.count(models.Task.id))\
-            .filter(models.Task.project_id == project.id)\
-            .scalar() or 0
-
-        completed_tasks = db.query(func.count(models.Task.id))\
-            .filter(models.Task.project_id == project.id)\
-            .filter(models.Task.status == 'done')\
-            .scalar() or 0
+        if series is not None:
+            total_duration = cached_durations.get(project.id, 0)
+        else:
+            total_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
+                .filter(models.TimeLog.project_id == project.id)\
+                .filter(models.TimeLog.log_date >= start_date)\
+                .filter(models.TimeLog.log_date <= end_date)\
+                .scalar() or 0
+            total_duration += archived.get(project.id) or 0
 
         # 计算实际精力分配百分比
-        # 需要获取该时间段内所有项目的总时长
-        all_duration = db.query(func.sum(models.TimeLog.duration_seconds))\
-            .filter(models.TimeLog.user_id == user_id)\
-            .filter(models.TimeLog.log_date >= start_date)\
-            .filter(models.TimeLog.log_date <= end_date)\
-            .scalar() or 0
-
         actual_energy = int((total_duration / all_duration * 100)) if all_duration > 0 else 0
 
         results.append(schemas.EnergyDistribution(
@@ -202,8 +350,86 @@ def get_energy_distribution(db: Session, user_id: str, period: str = 'week') ->
             targetEnergy=target_energy,
             actualEnergy=actual_energy,
             totalDuration=total_duration,
-            completedTasks=completed_tasks,
-            totalTasks=total_tasks
+            completedTasks=project.done_count or 0,
+            totalTasks=project.task_count or 0
         ))
 
     return results
+
+
+def epoch_seconds(dialect: str, column):
+    """把时间列转换为Unix时间戳(秒)的SQL表达式"""
+    if dialect == 'postgresql':
+        return cast(func.extract('epoch', column), Integer)
+    return cast(func.strftime('%s', column), Integer)
+
+
+def accumulate_heatmap(starts: np.ndarray, ends: np.ndarray, tz_offset_seconds: int = 0) -> np.ndarray:
+    """把时间区间按整点切分,累加到 7×24(周一至周日 × 0-23点)的秒数矩阵
+
+    全部使用向量化运算: 先算出每个区间跨越的小时数,用 np.repeat 展开成逐小时的片段,
+    再用 np.bincount 按 (星期, 小时) 累加。
+    """
+    starts = np.asarray(starts, dtype=np.int64) + tz_offset_seconds
+    ends = np.asarray(ends, dtype=np.int64) + tz_offset_seconds
+    valid = ends > starts
+    starts, ends = starts[valid], ends[valid]
+    if starts.size == 0:
+        return np.zeros((7, 24), dtype=np.int64)
+
+    first_hour = starts // 3600
+    counts = (ends - 1) // 3600 - first_hour + 1
+
+    # 第 i 个片段属于哪个区间、是该区间的第几个小时
+    piece_offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    hours = np.repeat(first_hour, counts) + piece_offset
+    seconds = (
+        np.minimum(np.repeat(ends, counts), (hours + 1) * 3600)
+        - np.maximum(np.repeat(starts, counts), hours * 3600)
+    )
+
+    # 1970-01-01 是星期四(周一为0时为3)
+    weekday = (hours // 24 + 3) % 7
+    cell = weekday * 24 + hours % 24
+    return np.bincount(cell, weights=seconds, minlength=7 * 24).astype(np.int64).reshape(7, 24)
+
+
+def _as_utc(value: datetime) -> datetime:
+    """SQLite 中保存的是不带时区的UTC时间"""
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def get_focus_heatmap(db: Session, user_id: str, period: str = 'week', start: Optional[date] = None,
+                      end: Optional[date] = None, tz_offset_minutes: Optional[int] = None) -> schemas.FocusHeatmap:
+    """获取学习时段热力图(星期 × 小时)"""
+    start_date, end_date = get_date_range(period, start, end)
+    if tz_offset_minutes is None:
+        # 默认使用服务器所在时区
+        tz_offset_minutes = int(datetime.now().astimezone().utcoffset().total_seconds() // 60)
+
+    dialect = db.get_bind().dialect.name
+    rows = db.query(
+        epoch_seconds(dialect, models.TimeLog.start_at),
+        epoch_seconds(dialect, models.TimeLog.end_at)
+    ).filter(models.TimeLog.user_id == user_id)\
+     .filter(models.TimeLog.start_at.isnot(None))\
+     .filter(models.TimeLog.end_at.isnot(None))\
+     .filter(models.TimeLog.log_date >= start_date)\
+     .filter(models.TimeLog.log_date <= end_date)\
+     .all()
+
+    # 归档分段中的计时区间
+    rows += [
+        (int(_as_utc(row['start_at']).timestamp()), int(_as_utc(row['end_at']).timestamp()))
+        for row in archive.archived_rows(db, user_id, start_date, end_date)
+        if row['start_at'] is not None and row['end_at'] is not None
+    ]
+
+    intervals = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    matrix = accumulate_heatmap(intervals[:, 0], intervals[:, 1], tz_offset_minutes * 60)
+
+    return schemas.FocusHeatmap(
+        cells=matrix.tolist(),
+        total_seconds=int(matrix.sum()),
+        tz_offset_minutes=tz_offset_minutes
+    )
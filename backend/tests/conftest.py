@@ -0,0 +1,13 @@
+"""
+测试使用临时目录中的独立 SQLite 数据库,必须在导入后端模块之前设置 DATABASE_URL
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DB_DIR = tempfile.mkdtemp(prefix="mindbalance-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+sys.path.insert(0, BACKEND_DIR)
+
+import main  # noqa: E402,F401  建表并执行迁移
@@ -0,0 +1,135 @@
+"""冷数据归档: 归档 -> 删除/清理 -> 还原"""
+import asyncio
+import uuid
+from datetime import date, datetime, timezone
+
+import crud
+import database
+import models
+from services import archive, changes, purger
+
+
+def _seed(user_id: str):
+    """一个项目、两个任务,各有两条早于归档期限的时间记录"""
+    with database.SessionLocal() as db:
+        project = models.Project(user_id=user_id, name="归档测试")
+        db.add(project)
+        db.flush()
+        tasks = [models.Task(project_id=project.id, user_id=user_id, title=f"任务{i}") for i in range(2)]
+        db.add_all(tasks)
+        db.flush()
+        for task in tasks:
+            for day in (3, 17):
+                db.add(models.TimeLog(
+                    task_id=task.id, project_id=project.id, user_id=user_id, log_type="MANUAL",
+                    duration_seconds=600, log_date=date(2020, 1, day)
+                ))
+        db.commit()
+        return project.id, [t.id for t in tasks]
+
+
+def _hot_logs(user_id: str):
+    with database.SessionLocal() as db:
+        return db.query(models.TimeLog).filter(models.TimeLog.user_id == user_id).all()
+
+
+def _segment(user_id: str):
+    with database.SessionLocal() as db:
+        return db.query(models.TimeLogArchive).filter(models.TimeLogArchive.user_id == user_id).first()
+
+
+def _daily_seconds(user_id: str):
+    with database.SessionLocal() as db:
+        rows = db.query(models.TimeLogDaily).filter(models.TimeLogDaily.user_id == user_id)\
+            .execution_options(include_deleted=True).all()
+        return sum(r.duration_seconds for r in rows)
+
+
+def _soft_delete_task(task_id: str):
+    with database.SessionLocal() as db:
+        db.query(models.Task).filter(models.Task.id == task_id).update(
+            {models.Task.deleted_at: datetime.now(timezone.utc)}, synchronize_session=False
+        )
+        db.commit()
+
+
+def test_archive_and_restore_round_trip():
+    user_id = str(uuid.uuid4())
+    _seed(user_id)
+
+    assert archive.archive_logs(horizon_days=30, user_id=user_id) == {"segments": 1, "rows": 4}
+    assert _hot_logs(user_id) == []
+    segment = _segment(user_id)
+    assert (segment.month, segment.row_count, segment.total_seconds) == ("2020-01", 4, 2400)
+    assert _daily_seconds(user_id) == 2400
+
+    assert archive.restore_logs(user_id=user_id) == {"segments": 1, "rows": 4}
+    assert len(_hot_logs(user_id)) == 4
+    assert _segment(user_id) is None
+    assert _daily_seconds(user_id) == 0
+
+
+def test_purge_prunes_segments_of_deleted_task():
+    user_id = str(uuid.uuid4())
+    _, (kept, removed) = _seed(user_id)
+    archive.archive_logs(horizon_days=30, user_id=user_id)
+
+    _soft_delete_task(removed)
+    result = asyncio.run(purger.purge())
+    assert result["time_log_archives"] == 2
+    segment = _segment(user_id)
+    assert (segment.row_count, segment.total_seconds) == (2, 1200)
+    assert _daily_seconds(user_id) == 1200
+
+    archive.restore_logs(user_id=user_id)
+    assert {log.task_id for log in _hot_logs(user_id)} == {kept}
+
+
+def test_restore_skips_rows_of_purged_task():
+    user_id = str(uuid.uuid4())
+    _, (kept, removed) = _seed(user_id)
+    archive.archive_logs(horizon_days=30, user_id=user_id)
+
+    # 任务已被物理删除但分段尚未清理(例如清理中途中断)
+    with database.SessionLocal() as db:
+        db.query(models.Task).filter(models.Task.id == removed).delete(synchronize_session=False)
+        db.commit()
+
+    assert archive.restore_logs(user_id=user_id)["rows"] == 2
+    assert {log.task_id for log in _hot_logs(user_id)} == {kept}
+
+
+def test_purge_removes_empty_segment_with_project():
+    user_id = str(uuid.uuid4())
+    project_id, _ = _seed(user_id)
+    archive.archive_logs(horizon_days=30, user_id=user_id)
+
+    with database.SessionLocal() as db:
+        db.query(models.Project).filter(models.Project.id == project_id).update(
+            {models.Project.deleted_at: datetime.now(timezone.utc)}, synchronize_session=False
+        )
+        db.commit()
+    asyncio.run(purger.purge())
+    assert _segment(user_id) is None
+    assert _daily_seconds(user_id) == 0
+
+
+def test_task_total_includes_archived_logs():
+    user_id = str(uuid.uuid4())
+    project_id, (task_id, _) = _seed(user_id)
+    with database.SessionLocal() as db:
+        crud.record_change(db, user_id, 'task', task_id)
+        db.commit()
+
+    def totals():
+        with database.SessionLocal() as db:
+            single = crud.get_task(db, task_id).total_duration
+            listed = {t.id: t.total_duration for t in crud.get_tasks(db, project_id)}[task_id]
+            sparse = {r['id']: r['total_duration'] for r in crud.get_tasks_sparse(db, ['id', 'total_duration'], project_id)}[task_id]
+            feed = {c['id']: c['data'] for c in changes.get_changes(db, user_id)['changes']}[task_id]['total_duration']
+            return single, listed, sparse, feed
+
+    assert totals() == (1200,) * 4
+    archive.archive_logs(horizon_days=30, user_id=user_id)
+    assert _hot_logs(user_id) == []
+    assert totals() == (1200,) * 4
@@ -0,0 +1,94 @@
+"""UUID列迁移: 文本UUID的 SQLite 数据库经 migrate_uuid_columns 转换为16字节格式"""
+import uuid
+
+import pytest
+from sqlalchemy import MetaData, String, inspect
+
+import database
+import models
+from services import search
+
+
+def _text_uuid_metadata() -> MetaData:
+    """迁移之前的表结构: GUID 列以文本保存"""
+    metadata = MetaData()
+    for table in models.Base.metadata.sorted_tables:
+        copy = table.to_metadata(metadata)
+        for column in copy.columns:
+            if isinstance(column.type, database.GUID):
+                column.type = String()
+    return metadata
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    engine = database._create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    _text_uuid_metadata().create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def _ids(n: int):
+    return [str(uuid.uuid4()) for _ in range(n)]
+
+
+def _seed_text_ids(engine):
+    user_id, project_id, deleted_project_id, task_id, deleted_task_id, log_id, dead_log_id = _ids(7)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO users (id, email) VALUES (?, 'legacy@example.com')", (user_id,))
+        conn.exec_driver_sql(
+            "INSERT INTO projects (id, user_id, name, deleted_at) VALUES (?, ?, 'Vocabulary', NULL), (?, ?, 'Dropped', '2024-01-01 00:00:00')",
+            (project_id, user_id, deleted_project_id, user_id)
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO project_budgets (project_id, target_percentage) VALUES (?, 40)", (project_id,)
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO tasks (id, project_id, user_id, title, status, deleted_at) VALUES "
+            "(?, ?, ?, 'Irregular verbs', 'todo', NULL), (?, ?, ?, 'Old notes', 'todo', '2024-01-01 00:00:00')",
+            (task_id, project_id, user_id, deleted_task_id, project_id, user_id)
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO time_logs (id, task_id, project_id, user_id, log_type, duration_seconds, log_date) VALUES "
+            "(?, ?, ?, ?, 'MANUAL', 600, '2024-01-02'), (?, NULL, ?, ?, 'MANUAL', 300, '2024-01-02')",
+            (log_id, task_id, project_id, user_id, dead_log_id, deleted_project_id, user_id)
+        )
+    return {"user": user_id, "project": project_id, "task": task_id, "deleted_task": deleted_task_id, "log": log_id}
+
+
+def test_migrate_text_uuid_database(legacy_engine):
+    ids = _seed_text_ids(legacy_engine)
+    # 迁移前已存在的检索触发器随旧表一起删除,之后按现有数据重建
+    search.ensure_search_index(legacy_engine)
+
+    converted = database.migrate_uuid_columns(legacy_engine)
+    assert {"projects.id", "tasks.id", "tasks.project_id", "time_logs.task_id"} <= set(converted)
+    assert database.migrate_uuid_columns(legacy_engine) == []
+
+    inspector = inspect(legacy_engine)
+    assert not isinstance({c["name"]: c["type"] for c in inspector.get_columns("tasks")}["id"], String)
+    assert {"ix_tasks_deleted_at", "idx_tasks_user_next_review"} <= {i["name"] for i in inspector.get_indexes("tasks")}
+    with legacy_engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT length(id) FROM tasks").scalars().all() == [16, 16]
+
+    search.ensure_search_index(legacy_engine)
+    with database.SessionLocal(bind=legacy_engine) as db:
+        # 跨表引用(无外键约束的 project_id/task_id)仍能关联
+        project = db.query(models.Project).one()
+        assert project.id == ids["project"]
+        assert [b.target_percentage for b in project.budgets] == [40]
+        task = db.query(models.Task).one()
+        assert (task.id, task.project_id, task.user_id) == (ids["task"], ids["project"], ids["user"])
+
+        # 软删除列保留: 已删除的项目/任务及其时间记录仍不可见
+        assert db.query(models.Task).execution_options(include_deleted=True).count() == 2
+        assert [log.id for log in db.query(models.TimeLog)] == [ids["log"]]
+        assert db.query(models.TimeLog).execution_options(include_deleted=True).count() == 2
+
+        # 检索: 重建的索引包含已有数据,触发器对新写入生效
+        hits = search.search(db, ids["user"], "verbs")["items"]
+        assert [hit["id"] for hit in hits] == [ids["task"]]
+        assert search.search(db, ids["user"], "notes")["items"] == []
+        db.add(models.Task(project_id=ids["project"], user_id=ids["user"], title="Phrasal verbs"))
+        db.commit()
+        assert len(search.search(db, ids["user"], "verbs")["items"]) == 2
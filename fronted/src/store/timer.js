@@ -1,5 +1,9 @@
 import { defineStore } from 'pinia'
 import { ref, computed } from 'vue'
+import { taskApi } from '@/utils/api'
+
+// 断线后重连的间隔(毫秒)
+const RECONNECT_DELAY = 3000
 
 export const useTimerStore = defineStore('timer', () => {
   // 当前计时状态
@@ -8,6 +12,10 @@ export const useTimerStore = defineStore('timer', () => {
   const elapsedSeconds = ref(0)
   const startTime = ref(null)
   const timerInterval = ref(null)
+  // 计时同步连接(/api/ws/timer)
+  let socket = null
+  let reconnectTimer = null
+  let syncEnabled = false
 
   // 计算属性：格式化后的时长
   const formattedTime = computed(() => {
@@ -156,6 +164,109 @@ export const useTimerStore = defineStore('timer', () => {
     clearTimerState()
   }
 
+  /**
+   * 按开始时间在本地开始计时(其他设备开始的计时)
+   * @param {string} taskId - 任务ID
+   * @param {string} startAt - 服务端记录的开始时间(ISO格式)
+   */
+  function applyRemoteStart(taskId, startAt) {
+    if (currentTask.value?.id === taskId) {
+      if (!isRunning.value) resumeTimer()
+      return
+    }
+    if (timerInterval.value) {
+      clearInterval(timerInterval.value)
+    }
+    currentTask.value = { id: taskId, name: '' }
+    isRunning.value = true
+    startTime.value = Date.parse(startAt)
+    elapsedSeconds.value = Math.max(0, Math.floor((Date.now() - startTime.value) / 1000))
+    timerInterval.value = setInterval(() => {
+      elapsedSeconds.value = Math.floor((Date.now() - startTime.value) / 1000)
+    }, 1000)
+    saveTimerState()
+
+    // 事件只带任务ID,补取任务名称用于显示
+    taskApi.getTaskDetail(taskId).then((task) => {
+      if (currentTask.value?.id === taskId && task) {
+        currentTask.value = { ...currentTask.value, name: task.title }
+        saveTimerState()
+      }
+    }).catch(() => {})
+  }
+
+  /**
+   * 处理同步连接推送的消息;本设备发起的操作回传时本地状态已一致,不重复处理
+   * @param {object} message - timer.snapshot / timer.started / timer.paused / timer.stopped / timer.tick
+   */
+  function handleSyncMessage(message) {
+    switch (message.type) {
+      case 'timer.snapshot': {
+        const timer = message.timers[0]
+        if (timer) {
+          applyRemoteStart(timer.task_id, timer.start_at)
+        } else if (isRunning.value) {
+          pauseTimer()
+        }
+        break
+      }
+      case 'timer.started':
+        applyRemoteStart(message.task_id, message.start_at)
+        break
+      case 'timer.paused':
+        if (currentTask.value?.id === message.task_id) pauseTimer()
+        break
+      case 'timer.stopped':
+        if (currentTask.value?.id === message.task_id) resetTimer()
+        break
+      default:
+        // timer.tick: 已计时长由本地定时器计算
+        break
+    }
+  }
+
+  /**
+   * 连接计时同步,接收本用户其他设备上的计时变化;断线后自动重连
+   */
+  function connectSync() {
+    syncEnabled = true
+    if (socket) return
+
+    const base = import.meta.env.VITE_API_BASE_URL || '/api'
+    const url = new URL(`${base}/ws/timer`, window.location.href)
+    url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:'
+
+    socket = new WebSocket(url)
+    socket.onmessage = (event) => {
+      try {
+        handleSyncMessage(JSON.parse(event.data))
+      } catch (e) {
+        console.error('Invalid timer sync message:', e)
+      }
+    }
+    socket.onclose = () => {
+      socket = null
+      if (syncEnabled) {
+        reconnectTimer = setTimeout(connectSync, RECONNECT_DELAY)
+      }
+    }
+  }
+
+  /**
+   * 断开计时同步
+   */
+  function disconnectSync() {
+    syncEnabled = false
+    if (reconnectTimer) {
+      clearTimeout(reconnectTimer)
+      reconnectTimer = null
+    }
+    if (socket) {
+      socket.close()
+      socket = null
+    }
+  }
+
   return {
     currentTask,
     isRunning,
@@ -166,6 +277,8 @@ export const useTimerStore = defineStore('timer', () => {
     resumeTimer,
     stopTimer,
     resetTimer,
-    restoreTimerState
+    restoreTimerState,
+    connectSync,
+    disconnectSync
   }
 })
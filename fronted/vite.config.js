@@ -15,7 +15,8 @@ export default defineConfig({
     proxy: {
       '/api': {
         target: 'http://127.0.0.1:8000',
-        changeOrigin: true
+        changeOrigin: true,
+        ws: true // 转发 /api/ws/timer 的 WebSocket 连接
         // 不重写路径，保留 /api 前缀
       }
     }